@@ -1,97 +1,561 @@
 import requests
 import pandas as pd
-from pathlib import Path
-from yaml import safe_load
 from Functions.logger import get_logger
+from Functions import http_client, metrics
+from Functions.run_context import RunContext
+from Functions.http_cache import conditional_get
+from Functions.snapshot_store import load_snapshot
+from Functions.sdmx_structure import read_dimension_ids, metadata_available
+from Functions.artefact_store import store_dataflow_structure
+from Functions.download_scheduler import estimate_sizes, prioritise, load_download_sizes, record_download_size
+from Functions.chunked_download import plan_chunks, download_chunks, series_keys_query
+from Functions.high_water_marks import record_high_water_mark, dataflow_key
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from urllib.parse import urlparse
+from datetime import datetime, timezone
+import threading
+from pathlib import Path
+import time
+import shutil
 import os
 
 logger = get_logger()
 
-def generate_and_save_api_data():
+# Kind of run journal item recorded for each completed dataflow download
+JOURNAL_DOWNLOAD = "download"
+
+# One semaphore per host caps the number of simultaneous connections to it
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# Tag in the names of partial downloads. Sharded download workers sharing the output folder
+# each set their own, so a dataflow reclaimed from a stalled worker is never written by two
+# workers into the same file
+_temp_tag = ""
+
+def set_temp_tag(tag) -> None:
     """
-    Fetches and saves data and metadata for 'New Insert' records from the data_changes file.
-    Saves the data as CSV and metadata as XML.
+    Sets the tag inserted into the names of this process's partial downloads, e.g. its worker ID.
+    """
+    global _temp_tag
+    _temp_tag = f".{tag}" if tag else ""
+
+def temp_path(file_name, suffix=".part") -> Path:
+    """
+    Returns the temporary file a download of file_name is written to before it is renamed into place.
+    """
+    return file_name.with_name(f"{file_name.name}{_temp_tag}{suffix}")
+
+def get_host_semaphore(url, max_per_host):
+    """
+    Returns the semaphore limiting concurrent requests to the host of the given URL.
+    Args:
+        url (str): The URL about to be requested.
+        max_per_host (int): Maximum number of concurrent requests per host.
+    """
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(max_per_host)
+        return _host_semaphores[host]
+
+def data_query_url(config, agency_id, dataflow_id) -> str:
+    """
+    Returns the data query URL of a dataflow. When labels are joined locally, the compact
+    code-only CSV is requested instead of the CSV with labels.
+    Args:
+        config (dict): Configuration data.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+    """
+    template_key = "COMPACT_DATA_QUERY" if config.get("LABELS", {}).get("JOIN_LOCALLY", False) else "DATA_QUERY"
+    return config["API"][template_key].format(agency_id=agency_id, dataflow_id=dataflow_id)
+
+def _expected_size(response, offset):
+    """
+    Returns the final size of the file being downloaded, or None if the server did not say.
+    Args:
+        response (requests.Response): The streamed response.
+        offset (int): Number of bytes already on disk before this response.
+    """
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    # Compressed bodies are decoded while streaming, so their length cannot be checked
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and not response.headers.get("Content-Encoding"):
+        return offset + int(content_length)
+    return None
+
+def _validator(response):
+    """
+    Returns the validator a partial download of the response can be resumed with through If-Range:
+    a strong ETag, or else the Last-Modified date. None if the response has neither.
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+def stream_to_file(url, file_name, chunk_size, resume_attempts) -> int:
+    """
+    Streams the response body of a URL to disk without holding it in memory.
+    The body is written to a '.part' file next to the destination (see temp_path), which is atomically
+    renamed into place once complete. If the transfer is interrupted, the partial file is
+    kept together with the validator of the response it came from, and the download resumes with
+    an HTTP Range request conditional on that validator (If-Range): if the resource changed
+    meanwhile, or the server does not support ranges, the whole body is downloaded again.
+    Partial files without a validator are never resumed.
+    Args:
+        url (str): The API URL to download.
+        file_name (Path): Destination file.
+        chunk_size (int): Number of bytes read from the socket per write.
+        resume_attempts (int): How many times an interrupted transfer is resumed.
+    Returns:
+        int: The HTTP status code of the final response (200 once the file is saved).
+    """
+    part_file = temp_path(file_name)
+    validator_file = temp_path(file_name, ".validator")
+    last_error = None
+    for _ in range(resume_attempts + 1):
+        offset = part_file.stat().st_size if part_file.exists() else 0
+        validator = validator_file.read_text() if offset and validator_file.exists() else None
+        headers = {}
+        if validator:
+            # Ask for the raw representation so byte offsets match what is already on disk
+            headers = {"Range": f"bytes={offset}-", "If-Range": validator, "Accept-Encoding": "identity"}
+
+        try:
+            with http_client.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 206 and validator:
+                    mode = "ab"
+                    metrics.increment("download_resumes")
+                    logger.info(f"Resuming download of {url} from byte {offset}")
+                elif response.status_code == 200:
+                    # Nothing to resume, ranges not supported or the resource changed: start from scratch
+                    mode = "wb"
+                    offset = 0
+                    validator = _validator(response)
+                    if validator:
+                        validator_file.write_text(validator)
+                    else:
+                        validator_file.unlink(missing_ok=True)
+                elif response.status_code == 416 and validator:
+                    # Partial file no longer matches the resource; discard it and retry
+                    part_file.unlink()
+                    validator_file.unlink(missing_ok=True)
+                    continue
+                else:
+                    return response.status_code
+
+                expected_size = _expected_size(response, offset)
+                with open(part_file, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        http_client.record_received(len(chunk))
+
+            written = part_file.stat().st_size
+            metrics.increment("download_bytes", written - offset, kind="data")
+            if expected_size is not None and written != expected_size:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"received {written} of {expected_size} bytes")
+
+            os.replace(part_file, file_name)
+            validator_file.unlink(missing_ok=True)
+            return 200
+
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            last_error = e
+            received = part_file.stat().st_size if part_file.exists() else 0
+            metrics.increment("download_interruptions")
+            logger.warning(f"Transfer of {url} interrupted after {received} bytes: {e}")
+
+    raise last_error or requests.exceptions.ConnectionError(f"Could not complete download of {url}")
+
+def _download_to_file(url, file_name, description, max_per_host, chunk_size, resume_attempts) -> bool:
+    """
+    Downloads the given URL and streams the response body to a file.
+    Args:
+        url (str): The API URL to download.
+        file_name (Path): Destination file.
+        description (str): Short label used in log messages ('data' or 'metadata').
+        max_per_host (int): Maximum number of concurrent requests per host.
+        chunk_size (int): Number of bytes read from the socket per write.
+        resume_attempts (int): How many times an interrupted transfer is resumed.
+    Returns:
+        bool: True if the file was saved, False otherwise.
+    """
+    try:
+        logger.info(f"Downloading {description} from: {url}")
+        started = time.perf_counter()
+        with get_host_semaphore(url, max_per_host):
+            status_code = stream_to_file(url, file_name, chunk_size, resume_attempts)
+        elapsed = time.perf_counter() - started
+        metrics.observe("download_seconds", elapsed, kind=description)
+        metrics.record_event("download", url=url, file=str(file_name), status=status_code, seconds=round(elapsed, 3),
+                             bytes=file_name.stat().st_size if status_code == 200 else 0)
+        if status_code == 200:
+            logger.info(f"{description.capitalize()} successfully saved to: {file_name}")
+            return True
+        logger.error(f"Failed to download {description} query API: {url}, Status code: {status_code}")
+    except Exception as e:
+        logger.error(f"Error downloading {description} query API: {e}")
+    return False
+
+def _download_cached(url, file_name, description, max_per_host, cache_folder, chunk_size) -> bool:
+    """
+    Downloads the given URL through the HTTP cache and copies the body to a file.
+    Unchanged responses (304) are served from the cache without transferring the body again.
+    Args:
+        url (str): The API URL to download.
+        file_name (Path): Destination file.
+        description (str): Short label used in log messages.
+        max_per_host (int): Maximum number of concurrent requests per host.
+        cache_folder (Path): Folder holding the HTTP cache entries.
+        chunk_size (int): Number of bytes read from the socket per write.
+    Returns:
+        bool: True if the file was saved, False otherwise.
+    """
+    try:
+        logger.info(f"Downloading {description} from: {url}")
+        with get_host_semaphore(url, max_per_host):
+            response = conditional_get(url, cache_folder, chunk_size)
+        if response.status_code in (200, 304):
+            if response.not_modified:
+                logger.info(f"{description.capitalize()} not modified, reusing cached copy: {url}")
+            part_file = temp_path(file_name)
+            shutil.copyfile(response.path, part_file)
+            os.replace(part_file, file_name)
+            logger.info(f"{description.capitalize()} successfully saved to: {file_name}")
+            return True
+        logger.error(f"Failed to download {description} query API: {url}, Status code: {response.status_code}")
+    except Exception as e:
+        logger.error(f"Error downloading {description} query API: {e}")
+    return False
+
+def _download_structure_artefacts(config, store_folder, cache_folder, agency_id, dataflow_id, version, file_name, materialise) -> bool:
+    """
+    Resolves a dataflow's structure metadata through the shared artefact store, so codelists and
+    concept schemes used by many dataflows are downloaded only once.
+    Args:
+        config (dict): Configuration data.
+        store_folder (Path): Folder holding the stored artefacts.
+        cache_folder (Path): Folder holding the HTTP cache entries, used to revalidate non-final artefacts.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        version (str): Version of the dataflow.
+        file_name (Path): The metadata file the manifest (and optional full message) is saved for.
+        materialise (bool): Also write the full structure message to the metadata file.
+    Returns:
+        bool: True if the metadata was saved, False otherwise.
+    """
+    try:
+        logger.info(f"Resolving metadata for {agency_id},{dataflow_id}({version}) through the artefact store")
+        count = store_dataflow_structure(config, store_folder, cache_folder, agency_id, dataflow_id, version, file_name, materialise)
+        logger.info(f"Metadata successfully saved for {file_name.name} ({count} artefacts referenced)")
+        return True
+    except Exception as e:
+        logger.error(f"Error resolving metadata for {agency_id},{dataflow_id}: {e}")
+    return False
+
+def structure_downloader(ctx, agency_id, dataflow_id, version, file_name):
+    """
+    Returns a callable that downloads a dataflow's structure metadata to file_name, either whole
+    through the HTTP cache (STRUCTURE_QUERY) or assembled from shared artefacts (ARTEFACT_STORE).
+    Args:
+        ctx (RunContext): Shared run context.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        version (str): Version of the dataflow.
+        file_name (Path): The dataflow's metadata file.
+    Returns:
+        callable: Takes no arguments and returns True if the metadata was saved.
+    """
+    config = ctx.config
+    download_config = config.get("DOWNLOAD", {})
+    cache_folder = ctx.path("HTTP_CACHE_FOLDER")
+    artefact_config = config.get("ARTEFACT_STORE", {})
+    if artefact_config.get("ENABLED", False):
+        return partial(_download_structure_artefacts, config, ctx.path("ARTEFACT_STORE_FOLDER"), cache_folder, agency_id, dataflow_id,
+                       version, file_name, artefact_config.get("MATERIALISE_METADATA", True))
+    structure_query_api = config["API"]["STRUCTURE_QUERY"].format(agency_id=agency_id, dataflow_id=dataflow_id, version=version)
+    return partial(_download_cached, structure_query_api, file_name, "metadata", download_config.get("MAX_PER_HOST", 4),
+                   cache_folder, download_config.get("CHUNK_SIZE", 1024 * 1024))
+
+def _download_chunked(url, file_name, structure_file_name, download_structure, chunking_config,
+                      max_per_host, chunk_size, resume_attempts) -> bool:
     """
+    Downloads a large dataflow as parallel sub-queries split along its dimensions (or time
+    windows) and stitches them into one file, verified against the series keys of the
+    unchunked query. If any chunk fails or the check does not pass, the dataflow is downloaded
+    with the unchunked query instead. The structure metadata is downloaded first because the
+    split is planned from its codelists.
+    Args:
+        url (str): Data query URL of the whole dataflow.
+        file_name (Path): Destination data file.
+        structure_file_name (Path): The dataflow's metadata file.
+        download_structure (callable): Downloads the metadata; returns True on success.
+        chunking_config (dict): DOWNLOAD.CHUNKING settings.
+        max_per_host (int): Maximum number of concurrent requests per host.
+        chunk_size (int): Number of bytes read from the socket per write.
+        resume_attempts (int): How many times an interrupted transfer is resumed.
+    Returns:
+        bool: True if both the metadata and the data were saved, False otherwise.
+    """
+    if not download_structure():
+        return False
+
+    try:
+        queries = plan_chunks(url, structure_file_name, chunking_config)
+    except Exception as e:
+        logger.warning(f"Could not plan chunks for {url}, downloading it whole: {e}")
+        queries = [url]
+    if len(queries) < 2:
+        return _download_to_file(url, file_name, "data", max_per_host, chunk_size, resume_attempts)
+
+    def download(query, chunk_file):
+        with get_host_semaphore(query, max_per_host):
+            return stream_to_file(query, chunk_file, chunk_size, resume_attempts)
+
     try:
-        # Dynamically determine project root
-        current_dir = Path(__file__).resolve().parent
-        project_root = current_dir.parent
+        dimension_ids = read_dimension_ids(structure_file_name) if metadata_available(structure_file_name) else None
+    except Exception:
+        dimension_ids = None
+
+    try:
+        logger.info(f"Downloading data in {len(queries)} chunks from: {url}")
+        started = time.perf_counter()
+        rows = download_chunks(queries, file_name, download, chunking_config.get("WORKERS", max_per_host),
+                               series_keys_query(url), dimension_ids, _temp_tag)
+        elapsed = time.perf_counter() - started
+        metrics.observe("download_seconds", elapsed, kind="chunked data")
+        metrics.record_event("download", url=url, file=str(file_name), status=200, seconds=round(elapsed, 3),
+                             bytes=file_name.stat().st_size, chunks=len(queries))
+        logger.info(f"Data successfully saved to: {file_name} ({rows} rows from {len(queries)} chunks)")
+        return True
+    except Exception as e:
+        logger.warning(f"Chunked download of {url} failed, downloading it whole: {e}")
+        metrics.increment("chunked_download_fallbacks")
+    return _download_to_file(url, file_name, "data", max_per_host, chunk_size, resume_attempts)
+
+def new_insert_jobs(changes_df) -> list:
+    """
+    Returns the dataflows to download among the given changes: 'New Insert' records with Is Final = True.
+    Args:
+        changes_df (pd.DataFrame): Changed dataflows produced by the compare stage.
+    Returns:
+        list: Unique (agency ID, dataflow ID, version) tuples, in change order.
+    """
+    # 'Is Final' is stored as the API's "true"/"false"
+    is_final = changes_df['Is Final'].astype(str).str.lower() == 'true'
+    new_inserts = changes_df[(changes_df['Change_Type'] == 'New Insert') & is_final]
+    return list(dict.fromkeys(zip(new_inserts['Agency ID'], new_inserts['Dataflow ID'], new_inserts['Version'])))
+
+def download_new_inserts(ctx, changes_df, job_filter=None) -> int:
+    """
+    Fetches and saves data and metadata for the 'New Insert' records among the given changes.
+    Saves the data as CSV and metadata as XML. Downloads run concurrently, bounded by
+    DOWNLOAD.MAX_WORKERS overall and DOWNLOAD.MAX_PER_HOST per host.
+    Args:
+        ctx (RunContext): Shared run context.
+        changes_df (pd.DataFrame): Changed dataflows produced by the compare stage.
+        job_filter (callable): Restricts the downloads to the (agency ID, dataflow ID, version)
+            tuples it returns True for, e.g. one shard of a sharded download.
+    Returns:
+        int: Number of dataflows downloaded successfully.
+    """
+    config = ctx.config
+    output_folder = ctx.project_root / "output"
+    output_folder.mkdir(exist_ok=True)  # Create the output folder if it doesn't exist
+
+    # Load concurrency limits from config
+    download_config = config.get("DOWNLOAD", {})
+    max_workers = download_config.get("MAX_WORKERS", 8)
+    max_per_host = download_config.get("MAX_PER_HOST", 4)
+    chunk_size = download_config.get("CHUNK_SIZE", 1024 * 1024)
+    resume_attempts = download_config.get("RESUME_ATTEMPTS", 3)
+
+    if changes_df.empty:
+        logger.info("No changes to download.")
+        return 0
 
-        # Resolve the path to config.yaml
-        config_path = project_root / "config.yaml"
+    jobs = new_insert_jobs(changes_df)
+    if job_filter is not None:
+        jobs = [job for job in jobs if job_filter(job)]
+    if not jobs:
+        logger.info("No records with 'New Insert' type and 'Is Final' = TRUE to download.")
+        return 0
 
-        # Load configurations
-        with open(config_path, "r") as f:
-            config = safe_load(f)
+    # Start important and large dataflows first so the run does not end on a long tail
+    scheduler_config = config.get("SCHEDULER", {})
+    sizes_file = ctx.path("DOWNLOAD_SIZES_FILE")
 
-        # Load paths from config
-        data_changes_file = project_root / config["PATHS"]["DATA_CHANGES_FILE"]
-        output_folder = project_root / "output"
-        output_folder.mkdir(exist_ok=True)  # Create the output folder if it doesn't exist
+    # Skip dataflows already downloaded by the interrupted run being resumed
+    journal = ctx.journal
+    if journal is not None and journal.resumed:
+        finished = [job for job in jobs if journal.item_done(JOURNAL_DOWNLOAD, f"{job[0]},{job[1]},{job[2]}")]
+        for agency_id, dataflow_id, _ in finished:
+            ctx.downloaded_files.append(output_folder / f"{agency_id}_{dataflow_id}_ALL.csv")
+        jobs = [job for job in jobs if job not in finished]
+        logger.info(f"Resuming downloads: {len(finished)} already completed, {len(jobs)} remaining.")
+        if not jobs:
+            return 0
 
-        # Check if data_changes file exists
-        if not data_changes_file.exists():
-            print(f"No data changes file found: '{data_changes_file}'")
-            logger.info(f"No data changes file found: '{data_changes_file}'")
-            return 
+    probe_urls = None
+    if scheduler_config.get("PROBE_SIZES", False):
+        probe_urls = {job: data_query_url(config, job[0], job[1]) for job in jobs}
+    job_sizes = estimate_sizes(jobs, load_download_sizes(sizes_file), probe_urls, max_workers)
+    jobs = prioritise(jobs, job_sizes, scheduler_config.get("PRIORITY_DATAFLOWS", []))
 
-        # Load data_changes Excel file
-        logger.info(f"Loading data changes file: {data_changes_file}")
-        df = pd.read_excel(data_changes_file)
+    # Dataflows too large for a single request are split into parallel sub-queries
+    chunking_config = download_config.get("CHUNKING", {})
+    chunked_jobs = set()
+    if chunking_config.get("ENABLED", False):
+        min_size = chunking_config.get("MIN_SIZE_MB", 200) * 1024 * 1024
+        always = set(chunking_config.get("DATAFLOWS", []))
+        chunked_jobs = {job for job in jobs
+                        if dataflow_key(job[0], job[1]) in always or (job_sizes[job] or 0) >= min_size}
 
-        # Filter for 'New Insert' and Is Final = True
-        new_inserts = df[(df['Change_Type'] == 'New Insert') & (df['Is Final'] == True)]
+    logger.info(f"Downloading {len(jobs)} dataflows with {max_workers} workers "
+                f"(max {max_per_host} per host)...")
 
-        if new_inserts.empty:
-            logger.info("No records with 'New Insert' type and 'Is Final' = TRUE found.")
-            return
+    # Full downloads contain every observation changed before they were requested
+    started_at = datetime.now(timezone.utc)
+    state_file = ctx.path("HIGH_WATER_MARKS_FILE")
 
-        # Iterate through the filtered records
-        for _, row in new_inserts.iterrows():
-            dataflow_id = row['Dataflow ID']
-            agency_id = row['Agency ID']
-            version = row['Version']
+    # Submit data and structure downloads as independent tasks so they overlap (chunked
+    # downloads fetch the structure first, as it drives the split)
+    futures = {}
+    pending = {}
+    results = {}
+    succeeded = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for agency_id, dataflow_id, version in jobs:
+            row_key = (dataflow_id, agency_id, version)
 
-            # Construct API URLs using configuration
-            data_query_api = config["API"]["DATA_QUERY"].format(agency_id=agency_id, dataflow_id=dataflow_id)
-            structure_query_api = config["API"]["STRUCTURE_QUERY"].format(agency_id=agency_id, dataflow_id=dataflow_id, version=version)
+            # Construct the API URL using configuration
+            data_query_api = data_query_url(config, agency_id, dataflow_id)
 
             # Define output file names
             data_file_name = output_folder / f"{agency_id}_{dataflow_id}_ALL.csv"
             structure_file_name = output_folder / f"{agency_id}_{dataflow_id}_metadata.xml"
 
-            # Download and save the data query API response
-            try:
-                logger.info(f"Downloading data from: {data_query_api}")
-                data_response = requests.get(data_query_api)
-                if data_response.status_code == 200:
-                    with open(data_file_name, "wb") as f:
-                        f.write(data_response.content)
-                    logger.info(f"Data successfully saved to: {data_file_name}")
-                else:
-                    logger.error(f"Failed to download data query API: {data_query_api}, Status code: {data_response.status_code}")
-            except Exception as e:
-                logger.error(f"Error downloading data query API: {e}")
-
-            # Download and save the structure query API response
-            try:
-                logger.info(f"Downloading metadata from: {structure_query_api}")
-                structure_response = requests.get(structure_query_api)
-                if structure_response.status_code == 200:
-                    with open(structure_file_name, "wb") as f:
-                        f.write(structure_response.content)
-                    logger.info(f"Metadata successfully saved to: {structure_file_name}")
+            # Structure metadata is either downloaded whole or assembled from shared artefacts
+            download_structure = structure_downloader(ctx, agency_id, dataflow_id, version, structure_file_name)
+
+            if (agency_id, dataflow_id, version) in chunked_jobs:
+                futures[executor.submit(_download_chunked, data_query_api, data_file_name, structure_file_name, download_structure, chunking_config, max_per_host, chunk_size, resume_attempts)] = row_key
+                pending[row_key] = pending.get(row_key, 0) + 1
+            else:
+                futures[executor.submit(_download_to_file, data_query_api, data_file_name, "data", max_per_host, chunk_size, resume_attempts)] = row_key
+                futures[executor.submit(download_structure)] = row_key
+                pending[row_key] = pending.get(row_key, 0) + 2
+            results[row_key] = True
+
+        # Report each dataflow as soon as all of its downloads have finished
+        for future in as_completed(futures):
+            row_key = futures[future]
+            results[row_key] = results[row_key] and future.result()
+            pending[row_key] -= 1
+            if pending[row_key] == 0:
+                dataflow_id, agency_id, version = row_key
+                if results[row_key]:
+                    succeeded += 1
+                    record_high_water_mark(state_file, agency_id, dataflow_id, started_at)
+                    data_file_name = output_folder / f"{agency_id}_{dataflow_id}_ALL.csv"
+                    record_download_size(sizes_file, agency_id, dataflow_id, data_file_name.stat().st_size)
+                    ctx.downloaded_files.append(data_file_name)
+                    if journal is not None:
+                        journal.complete_item(JOURNAL_DOWNLOAD, f"{agency_id},{dataflow_id},{version}")
+                    logger.info(f"Completed download for Dataflow ID: {dataflow_id}, Agency ID: {agency_id}, Version: {version}")
                 else:
-                    logger.error(f"Failed to download structure query API: {structure_query_api}, Status code: {structure_response.status_code}")
-            except Exception as e:
-                logger.error(f"Error downloading structure query API: {e}")
+                    ctx.failed_downloads.append((agency_id, dataflow_id, version))
+                    logger.error(f"Download incomplete for Dataflow ID: {dataflow_id}, Agency ID: {agency_id}, Version: {version}")
+                logger.info("-" * 80)
+
+    logger.info(f"Downloaded {succeeded} of {len(results)} dataflows successfully.")
+    return succeeded
+
+def downloads_incomplete(ctx, failed) -> bool:
+    """
+    Decides whether the download stage fails because some new dataflows could not be downloaded.
+    A failed stage leaves the run unfinished in the run journal, so the next run resumes it and
+    downloads them again instead of retiring the changes that list them. Once the run has been
+    attempted DOWNLOAD.RUN_ATTEMPTS times the failures are only logged, so a dataflow that can
+    never be downloaded does not hold back every later run.
+    Args:
+        ctx (RunContext): Shared run context.
+        failed (int): Number of dataflows that could not be downloaded.
+    Returns:
+        bool: True if the stage should fail.
+    """
+    if not failed:
+        return False
+    journal = ctx.journal
+    run_attempts = ctx.config.get("DOWNLOAD", {}).get("RUN_ATTEMPTS", 3)
+    if journal is not None and journal.attempt >= run_attempts:
+        logger.error(f"Giving up on {failed} dataflows that failed to download in {journal.attempt} attempts of run {journal.run_id}.")
+        metrics.increment("abandoned_downloads", failed)
+        return False
+    logger.error(f"{failed} dataflows failed to download.")
+    return True
+
+def load_changes(ctx) -> pd.DataFrame:
+    """
+    Returns the changed dataflows handed over by the compare stage, or loads them from the
+    data_changes file when the stage runs on its own.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        pd.DataFrame: The changed dataflows (empty if there are none).
+    """
+    if ctx.changes is not None:
+        return ctx.changes
+
+    # Check if data_changes file exists
+    data_changes_file = ctx.path("DATA_CHANGES_FILE")
+    if not data_changes_file.exists():
+        logger.info(f"No data changes file found: '{data_changes_file}'")
+        return pd.DataFrame()
 
-            
-            logger.info(f"Completed download for Dataflow ID: {dataflow_id}, Agency ID: {agency_id}, Version: {version}")
-            logger.info("-" * 80)
+    # Load data_changes snapshot
+    logger.info(f"Loading data changes file: {data_changes_file}")
+    ctx.changes = load_snapshot(data_changes_file)
+    return ctx.changes
 
+def run_download_stage(ctx) -> bool:
+    """
+    Pipeline stage: downloads the new dataflows found by the compare stage.
+    Fails if any of them could not be downloaded, so the run is resumed (see downloads_incomplete).
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    try:
+        download_new_inserts(ctx, load_changes(ctx))
+        return not downloads_incomplete(ctx, len(ctx.failed_downloads))
+
+    except Exception as e:
+        logger.error(f"An error occurred while fetching and saving API data: {e}")
+        return False
+
+def generate_and_save_api_data(ctx=None) -> bool:
+    """
+    Fetches and saves data and metadata for 'New Insert' records from the data_changes file.
+    Args:
+        ctx (RunContext): Shared run context (created from config.yaml if omitted).
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    try:
+        return run_download_stage(ctx or RunContext())
     except Exception as e:
         logger.error(f"An error occurred while fetching and saving API data: {e}")
+        return False
 
 if __name__ == "__main__":
     logger.info("Starting API downloader...")
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from lxml import etree
+from Functions.logger import get_logger
+from Functions.atomic_file import atomic_open, write_atomic
+from Functions.http_cache import conditional_get
+from Functions.sdmx_structure import STRUCTURE_NS, manifest_path, build_structure_message
+
+logger = get_logger()
+
+# SDMX information model package of each maintainable artefact class, used to build URNs
+ARTEFACT_PACKAGES = {
+    "AgencyScheme": "base",
+    "Dataflow": "datastructure",
+    "DataStructure": "datastructure",
+    "Codelist": "codelist",
+    "HierarchicalCodelist": "codelist",
+    "ConceptScheme": "conceptscheme",
+    "CategoryScheme": "categoryscheme",
+    "Categorisation": "categoryscheme",
+    "ContentConstraint": "registry",
+}
+
+# Item classes are stored through the scheme that maintains them
+ITEM_PARENT_CLASSES = {
+    "Agency": "AgencyScheme",
+    "Code": "Codelist",
+    "Concept": "ConceptScheme",
+    "Category": "CategoryScheme",
+}
+
+# Artefact classes that reference a dataflow rather than being referenced by it
+PARENT_CLASSES = ("Categorisation", "ContentConstraint")
+
+# Serialises fetches of the same artefact between download threads
+_artefact_locks = {}
+_artefact_locks_lock = threading.Lock()
+
+# Monotonic time each non-final artefact was last revalidated by this process
+_revalidated = {}
+
+def artefact_urn(artefact_class, agency_id, artefact_id, version) -> str:
+    """
+    Builds the SDMX URN identifying a maintainable artefact version.
+    """
+    package = ARTEFACT_PACKAGES[artefact_class]
+    return f"urn:sdmx:org.sdmx.infomodel.{package}.{artefact_class}={agency_id}:{artefact_id}({version})"
+
+def artefact_file(store_folder, urn) -> Path:
+    """
+    Returns the file holding an artefact in the store, addressed by a hash of its URN.
+    """
+    return Path(store_folder) / f"{hashlib.sha256(urn.encode('utf-8')).hexdigest()}.xml"
+
+def _artefact_lock(urn):
+    """
+    Returns the lock guarding the fetch of one artefact.
+    """
+    with _artefact_locks_lock:
+        return _artefact_locks.setdefault(urn, threading.Lock())
+
+def _references(element):
+    """
+    Lists the maintainable artefacts referenced from an artefact element.
+    Item references (e.g. a Concept) are resolved to the scheme that maintains them.
+    Args:
+        element (lxml.etree._Element): The artefact element.
+    Returns:
+        set: (artefact class, agency ID, artefact ID, version) tuples.
+    """
+    references = set()
+    for ref in element.iter("Ref"):
+        artefact_class = ref.get("class")
+        agency_id = ref.get("agencyID")
+        if not artefact_class or not agency_id:
+            continue  # Local reference to a component of the same structure
+
+        if ref.get("maintainableParentID"):
+            artefact_class = ITEM_PARENT_CLASSES.get(artefact_class)
+            artefact_id = ref.get("maintainableParentID")
+            version = ref.get("maintainableParentVersion", "1.0")
+        else:
+            artefact_id = ref.get("id")
+            version = ref.get("version", "1.0")
+
+        if artefact_class in ARTEFACT_PACKAGES:
+            references.add((artefact_class, agency_id, artefact_id, version))
+    return references
+
+def _extract_artefacts(body_file, artefact_class=None):
+    """
+    Returns the maintainable artefact elements of a structure message, optionally of one class only.
+    """
+    root = etree.parse(str(body_file)).getroot()
+    elements = []
+    for element in root.iter(*(f"{{{STRUCTURE_NS}}}{name}" for name in ARTEFACT_PACKAGES)):
+        if artefact_class is None or etree.QName(element).localname == artefact_class:
+            elements.append(element)
+    return elements
+
+def _store_element(stored_file, element) -> None:
+    """
+    Writes an artefact element to the store via a temporary file and rename.
+    """
+    write_atomic(stored_file, etree.tostring(element, xml_declaration=True, encoding="utf-8"))
+
+def _is_final(element) -> bool:
+    """
+    Returns True if the artefact is final, i.e. can no longer change under its URN.
+    """
+    return element.get("isFinal") == "true"
+
+def fetch_artefact(config, store_folder, cache_folder, artefact_class, agency_id, artefact_id, version):
+    """
+    Returns an artefact from the store. Final artefacts are immutable and fetched from the API only
+    the first time they are needed. Non-final ones may change under the same URN, so they are
+    revalidated through the HTTP cache (a 304 costs no body) at most every
+    ARTEFACT_STORE.REVALIDATE_SECONDS.
+    Args:
+        config (dict): Configuration data.
+        store_folder (Path): Folder holding the stored artefacts.
+        cache_folder (Path): Folder holding the HTTP cache entries.
+        artefact_class (str): SDMX class of the artefact, e.g. "Codelist".
+        agency_id (str): Maintenance agency.
+        artefact_id (str): Artefact ID.
+        version (str): Artefact version.
+    Returns:
+        tuple: (URN, stored file, parsed artefact element).
+    """
+    urn = artefact_urn(artefact_class, agency_id, artefact_id, version)
+    stored_file = artefact_file(store_folder, urn)
+    revalidate_seconds = config.get("ARTEFACT_STORE", {}).get("REVALIDATE_SECONDS", 300)
+
+    with _artefact_lock(urn):
+        if stored_file.exists():
+            element = etree.parse(str(stored_file)).getroot()
+            checked_at = _revalidated.get(urn)
+            if _is_final(element) or (checked_at is not None and time.monotonic() - checked_at < revalidate_seconds):
+                return urn, stored_file, element
+
+        url = config["API"]["ARTEFACT_QUERY"].format(
+            resource=artefact_class.lower(), agency_id=agency_id, artefact_id=artefact_id, version=version)
+        logger.info(f"Fetching shared artefact {urn} from: {url}")
+        response = conditional_get(url, cache_folder)
+        if response.status_code not in (200, 304):
+            raise RuntimeError(f"Failed to fetch artefact: {url}, Status code: {response.status_code}")
+
+        # Keep only the artefact element itself; the message wrapper is rebuilt on demand
+        element = None
+        for candidate in _extract_artefacts(response.path, artefact_class):
+            if candidate.get("id") == artefact_id and candidate.get("agencyID") == agency_id:
+                element = candidate
+                break
+        if element is None:
+            raise RuntimeError(f"Artefact {urn} not found in response from: {url}")
+
+        if not (response.not_modified and stored_file.exists()):
+            _store_element(stored_file, element)
+        _revalidated[urn] = time.monotonic()
+        return urn, stored_file, element
+
+def fetch_parent_artefacts(config, store_folder, cache_folder, agency_id, dataflow_id, version) -> list:
+    """
+    Stores the artefacts that reference a dataflow (its categorisations and content constraints),
+    which a 'references=all' structure query returns but its own references never lead to.
+    Args:
+        config (dict): Configuration data.
+        store_folder (Path): Folder holding the stored artefacts.
+        cache_folder (Path): Folder holding the HTTP cache entries.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        version (str): Version of the dataflow.
+    Returns:
+        list: (artefact class, URN, stored file, artefact element) of each parent artefact.
+    """
+    url = config["API"]["ARTEFACT_PARENTS_QUERY"].format(
+        resource="dataflow", agency_id=agency_id, artefact_id=dataflow_id, version=version)
+    response = conditional_get(url, cache_folder)
+    if response.status_code == 404:
+        return []  # SDMX services answer 404 when nothing references the dataflow
+    if response.status_code not in (200, 304):
+        raise RuntimeError(f"Failed to fetch parent artefacts: {url}, Status code: {response.status_code}")
+
+    parents = []
+    for element in _extract_artefacts(response.path):
+        artefact_class = etree.QName(element).localname
+        if artefact_class not in PARENT_CLASSES:
+            continue
+        urn = artefact_urn(artefact_class, element.get("agencyID"), element.get("id"), element.get("version", "1.0"))
+        stored_file = artefact_file(store_folder, urn)
+        with _artefact_lock(urn):
+            _store_element(stored_file, element)
+        parents.append((artefact_class, urn, stored_file, element))
+    return parents
+
+def store_dataflow_structure(config, store_folder, cache_folder, agency_id, dataflow_id, version, metadata_file, materialise=True):
+    """
+    Resolves a dataflow, every artefact it depends on and the artefacts that reference it
+    (categorisations, content constraints) through the artefact store, and records them in a
+    reference manifest next to the metadata file.
+    Shared artefacts (codelists, concept schemes, ...) are fetched once and reused by every
+    dataflow that references them.
+    Args:
+        config (dict): Configuration data.
+        store_folder (Path): Folder holding the stored artefacts.
+        cache_folder (Path): Folder holding the HTTP cache entries.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        version (str): Version of the dataflow.
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file.
+        materialise (bool): Also write the full structure message to the metadata file.
+    Returns:
+        int: Number of artefacts referenced by the dataflow.
+    """
+    metadata_file = Path(metadata_file)
+    pending = [("Dataflow", agency_id, dataflow_id, version)]
+    seen = set(pending)
+    artefacts = []
+    parents_resolved = False
+
+    # Walk the references breadth first, fetching each artefact at most once
+    while pending:
+        reference = pending.pop(0)
+        urn, stored_file, element = fetch_artefact(config, store_folder, cache_folder, *reference)
+        artefacts.append({"urn": urn, "class": reference[0],
+                          "file": os.path.relpath(stored_file, metadata_file.parent)})
+        for child in _references(element) - seen:
+            seen.add(child)
+            pending.append(child)
+
+        # Once the dataflow's own references are resolved, add the artefacts referencing it
+        # and what they reference in turn (e.g. the category scheme of a categorisation)
+        if not pending and not parents_resolved:
+            parents_resolved = True
+            for artefact_class, urn, stored_file, element in fetch_parent_artefacts(config, store_folder, cache_folder, agency_id, dataflow_id, version):
+                artefacts.append({"urn": urn, "class": artefact_class,
+                                  "file": os.path.relpath(stored_file, metadata_file.parent)})
+                for child in _references(element) - seen:
+                    seen.add(child)
+                    pending.append(child)
+
+    manifest = {"dataflow": artefacts[0]["urn"], "artefacts": artefacts}
+    manifest_file = manifest_path(metadata_file)
+    write_atomic(manifest_file, json.dumps(manifest, indent=2))
+
+    if materialise:
+        root = build_structure_message([(a["class"], metadata_file.parent / a["file"]) for a in artefacts])
+        with atomic_open(metadata_file, "wb") as f:
+            etree.ElementTree(root).write(f, xml_declaration=True, encoding="utf-8")
+    else:
+        # A stale full copy would otherwise take precedence over the manifest
+        metadata_file.unlink(missing_ok=True)
+    return len(artefacts)
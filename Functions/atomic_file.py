@@ -0,0 +1,40 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+@contextmanager
+def atomic_open(path, mode="w", newline=None):
+    """
+    Opens a temporary file next to the target and renames it over the target once the block
+    completes, so readers never see a partial file. The data is flushed to disk before the rename;
+    if the block raises, the temporary file is removed and the target is left untouched.
+    Args:
+        path (Path): File to write.
+        mode (str): 'w' for text or 'wb' for bytes.
+        newline (str): Newline translation of a text file, as for open().
+    Yields:
+        file: The open temporary file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, newline=newline) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+def write_atomic(path, data) -> None:
+    """
+    Writes text or bytes to a file via atomic_open.
+    Args:
+        path (Path): File to write.
+        data (str | bytes): Content of the file.
+    """
+    with atomic_open(path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+import pandas as pd
+
+# Dynamically add the project root to Python's module search path when run as a script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from Functions.logger import get_logger
+from Functions.run_context import RunContext
+from Functions.snapshot_store import load_snapshot, save_snapshot
+from Functions.diff_engine import CHANGE_TYPE_COLUMN, CHANGED_FIELDS_COLUMN, DELETED
+
+logger = get_logger()
+
+# Append-only index of the history: one JSON line per base snapshot or per-run delta
+HISTORY_INDEX = "history.jsonl"
+BASE = "base"
+DELTA = "delta"
+
+def read_index(history_folder) -> list:
+    """
+    Reads the history index, oldest entry first, ignoring a last line torn by a crash.
+    Args:
+        history_folder (Path): Folder holding the change history.
+    Returns:
+        list: Entries with run_id, timestamp, kind ('base' or 'delta'), file and rows.
+    """
+    index_file = Path(history_folder) / HISTORY_INDEX
+    if not index_file.exists():
+        return []
+    entries = []
+    with open(index_file, "r") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return entries
+
+def _append_entry(history_folder, run_id, kind, df) -> dict:
+    """
+    Writes one base snapshot or delta file and appends it to the index.
+    """
+    history_folder = Path(history_folder)
+    timestamp = datetime.now(timezone.utc)
+    file_name = f"{kind}_{timestamp.strftime('%Y%m%dT%H%M%S%fZ')}.parquet"
+    save_snapshot(df, history_folder / kind / file_name)
+
+    entry = {"run_id": run_id, "timestamp": timestamp.isoformat(), "kind": kind, "file": f"{kind}/{file_name}", "rows": len(df)}
+    with open(history_folder / HISTORY_INDEX, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return entry
+
+def history_enabled(ctx) -> bool:
+    """
+    Returns True if the change history replaces the archived snapshots (HISTORY.ENABLED).
+    """
+    return bool(ctx.config.get("HISTORY", {}).get("ENABLED", False))
+
+def record_run(history_folder, run_id, catalog, changes_df, base_every=30, force_base=False) -> None:
+    """
+    Records the outcome of one run: the changed rows as a delta, plus a compacted base snapshot
+    of the whole catalog when there is none yet or base_every deltas were written since the last one.
+    Recording the same run twice (e.g. when an interrupted run resumes) has no effect.
+    Args:
+        history_folder (Path): Folder holding the change history.
+        run_id (str): Identifier of the run.
+        catalog (pd.DataFrame): The catalog after the run.
+        changes_df (pd.DataFrame): Changes found by the comparison (may be empty).
+        base_every (int): Number of deltas after which a new base snapshot is written.
+        force_base (bool): Always write a base snapshot (e.g. when a new baseline is created).
+    """
+    history_folder = Path(history_folder)
+    history_folder.mkdir(parents=True, exist_ok=True)
+    entries = read_index(history_folder)
+    if any(entry["run_id"] == run_id for entry in entries):
+        logger.info(f"Run {run_id} already recorded in the change history.")
+        return
+
+    last_base = max((i for i, entry in enumerate(entries) if entry["kind"] == BASE), default=None)
+    if changes_df is not None and not changes_df.empty and last_base is not None:
+        entry = _append_entry(history_folder, run_id, DELTA, changes_df)
+        logger.info(f"Recorded {entry['rows']} changes in the change history: {entry['file']}")
+        entries.append(entry)
+
+    deltas_since_base = len(entries) - 1 - last_base if last_base is not None else None
+    if force_base or last_base is None or deltas_since_base >= base_every:
+        entry = _append_entry(history_folder, run_id, BASE, catalog)
+        logger.info(f"Recorded base snapshot of {entry['rows']} dataflows in the change history: {entry['file']}")
+
+def record_context_run(ctx, changes_df, force_base=False) -> None:
+    """
+    Records the catalog and changes of the current run in HISTORY_FOLDER, under the run ID of
+    the run journal when there is one.
+    Args:
+        ctx (RunContext): Shared run context.
+        changes_df (pd.DataFrame): Changes found by the comparison (may be empty).
+        force_base (bool): Always write a base snapshot.
+    """
+    run_id = ctx.journal.run_id if ctx.journal is not None else datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    base_every = ctx.config.get("HISTORY", {}).get("BASE_EVERY", 30)
+    record_run(ctx.path("HISTORY_FOLDER"), run_id, ctx.catalog, changes_df, base_every, force_base)
+
+def _apply_delta(catalog, delta, key_columns) -> pd.DataFrame:
+    """
+    Applies one delta to a catalog: deleted keys are removed, inserted and updated rows replace
+    the rows with the same key.
+    """
+    delta_keys = pd.MultiIndex.from_frame(delta[key_columns].astype(str))
+    catalog_keys = pd.MultiIndex.from_frame(catalog[key_columns].astype(str))
+    upserts = delta[delta[CHANGE_TYPE_COLUMN] != DELETED].drop(columns=[CHANGE_TYPE_COLUMN, CHANGED_FIELDS_COLUMN])
+    kept = catalog[~catalog_keys.isin(delta_keys)]
+    return pd.concat([kept, upserts.reindex(columns=catalog.columns)], ignore_index=True)
+
+def rebuild_catalog(history_folder, key_columns, as_of=None) -> pd.DataFrame:
+    """
+    Rebuilds the catalog as it was after a past run, from the latest base snapshot at or
+    before that run and the deltas recorded since.
+    Args:
+        history_folder (Path): Folder holding the change history.
+        key_columns (list): Columns that identify a dataflow.
+        as_of: Run ID, timestamp (ISO string or datetime) or None for the latest run.
+    Returns:
+        pd.DataFrame: The catalog, sorted by the key columns.
+    Raises:
+        ValueError: If the history holds no base snapshot at or before the requested point.
+    """
+    history_folder = Path(history_folder)
+    entries = read_index(history_folder)
+
+    # Keep the entries up to the requested run or time
+    if as_of is not None:
+        run_positions = [i for i, entry in enumerate(entries) if entry["run_id"] == as_of]
+        if run_positions:
+            entries = entries[: run_positions[-1] + 1]
+        else:
+            moment = as_of if isinstance(as_of, datetime) else datetime.fromisoformat(str(as_of))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            entries = [entry for entry in entries if datetime.fromisoformat(entry["timestamp"]) <= moment]
+
+    last_base = max((i for i, entry in enumerate(entries) if entry["kind"] == BASE), default=None)
+    if last_base is None:
+        raise ValueError(f"No base snapshot in the change history at or before {as_of}")
+
+    catalog = load_snapshot(history_folder / entries[last_base]["file"])
+    for entry in entries[last_base + 1:]:
+        if entry["kind"] == DELTA:
+            catalog = _apply_delta(catalog, load_snapshot(history_folder / entry["file"]), key_columns)
+    return catalog.sort_values(by=key_columns, kind="stable").reset_index(drop=True)
+
+if __name__ == "__main__":
+    from Functions.data_comparator import DATAFLOW_KEY_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Rebuilds the dataflow catalog as of a past run from the change history.")
+    parser.add_argument("--as-of", help="Run ID or ISO timestamp (defaults to the latest run)")
+    parser.add_argument("--output", required=True, help="Snapshot file to write (.parquet, .feather, .sqlite or .xlsx)")
+    args = parser.parse_args()
+
+    ctx = RunContext()
+    catalog = rebuild_catalog(ctx.path("HISTORY_FOLDER"), DATAFLOW_KEY_COLUMNS, args.as_of)
+    save_snapshot(catalog, args.output)
+    logger.info(f"Rebuilt catalog of {len(catalog)} dataflows as of {args.as_of or 'the latest run'}: {args.output}")
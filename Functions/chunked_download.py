@@ -0,0 +1,260 @@
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from Functions.logger import get_logger
+from Functions.sdmx_structure import read_dimension_codes, TIME_DIMENSION_ID
+
+logger = get_logger()
+
+# Ways of splitting a data query: by codes of one dimension, or by time windows
+CHUNK_BY_KEY = "key"
+CHUNK_BY_TIME = "time"
+
+# Status returned by SDMX services for a query that matches no observations
+NO_RESULTS_STATUS = 404
+
+# Columns of an SDMX-CSV file that never identify a series
+NON_KEY_COLUMNS = {TIME_DIMENSION_ID, "OBS_VALUE"}
+
+def with_query_params(url, **params) -> str:
+    """
+    Adds or replaces query parameters on a URL.
+    Args:
+        url (str): The API URL.
+        **params: Parameters to set.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update(params)
+    return urlunsplit(parts._replace(query=urlencode(query, safe=",:")))
+
+def with_series_key(url, key) -> str:
+    """
+    Adds an SDMX series key filter (e.g. '.AUS+FRA..') to a data query URL.
+    Args:
+        url (str): Data query URL ending in the '{agency},{dataflow}' flow reference.
+        key (str): The key, one position per dimension separated by '.', codes joined with '+'.
+    """
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"{parts.path.rstrip('/')}/{key}"))
+
+def _split(items, count) -> list:
+    """
+    Splits a list into at most count contiguous, non-empty groups of similar size.
+    """
+    count = max(1, min(count, len(items)))
+    size, extra = divmod(len(items), count)
+    groups, start = [], 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+def key_chunk_queries(url, metadata_file, chunks) -> list:
+    """
+    Splits a data query into disjoint sub-queries, each filtering one dimension to a group of its codes.
+    The dimension is the first one (in key order) with at least as many codes as chunks wanted,
+    or the one with the most codes. Together the sub-queries cover every code of the codelist,
+    so they return every observation of the dataflow exactly once.
+    Args:
+        url (str): Data query URL of the whole dataflow.
+        metadata_file (Path): Structure metadata of the dataflow.
+        chunks (int): Number of sub-queries wanted.
+    Returns:
+        list: Sub-query URLs (only the original URL if the dataflow cannot be split).
+    """
+    dimension_codes = read_dimension_codes(metadata_file)
+    coded = [(position, codes) for position, (_, codes) in enumerate(dimension_codes) if codes]
+    if not coded:
+        return [url]
+
+    position, codes = next(((p, c) for p, c in coded if len(c) >= chunks), max(coded, key=lambda item: len(item[1])))
+    queries = []
+    for group in _split(codes, chunks):
+        key = ["" for _ in dimension_codes]
+        key[position] = "+".join(group)
+        queries.append(with_series_key(url, ".".join(key)))
+    return queries
+
+def time_chunk_queries(url, split_years) -> list:
+    """
+    Splits a data query into consecutive startPeriod/endPeriod windows. The first window is
+    open-ended before the first split year and the last one open-ended after the last, so the
+    windows cover every period.
+    Args:
+        url (str): Data query URL of the whole dataflow.
+        split_years (list): Years starting a new window, e.g. [1990, 2000, 2010].
+    Returns:
+        list: Sub-query URLs.
+    """
+    years = sorted(int(year) for year in split_years)
+    if not years:
+        return [url]
+
+    queries = [with_query_params(url, endPeriod=str(years[0] - 1))]
+    for start, end in zip(years, years[1:]):
+        queries.append(with_query_params(url, startPeriod=str(start), endPeriod=str(end - 1)))
+    queries.append(with_query_params(url, startPeriod=str(years[-1])))
+    return queries
+
+def plan_chunks(url, metadata_file, chunking_config) -> list:
+    """
+    Returns the sub-queries a large dataflow is downloaded with, according to DOWNLOAD.CHUNKING.
+    """
+    mode = chunking_config.get("MODE", CHUNK_BY_KEY)
+    if mode == CHUNK_BY_TIME:
+        return time_chunk_queries(url, chunking_config.get("SPLIT_YEARS", []))
+    return key_chunk_queries(url, metadata_file, chunking_config.get("CHUNKS", 8))
+
+def series_keys_query(url) -> str:
+    """
+    Returns the query listing the series keys of a data query without any observation
+    (SDMX 'detail=serieskeysonly').
+    """
+    return with_query_params(url, detail="serieskeysonly")
+
+def read_series_keys(csv_file, key_columns, chunk_rows=200000) -> set:
+    """
+    Reads the distinct series keys of an SDMX-CSV file without loading it whole.
+    Args:
+        csv_file (Path): Data or series keys file.
+        key_columns (list): Columns identifying a series.
+        chunk_rows (int): Number of CSV rows read per chunk.
+    Returns:
+        set: Tuples of key column values.
+    """
+    keys = set()
+    for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, usecols=key_columns, chunksize=chunk_rows):
+        keys.update(chunk[key_columns].itertuples(index=False, name=None))
+    return keys
+
+def _verify_series(stitched_file, series_keys_file, dimension_ids=None) -> None:
+    """
+    Checks that a stitched file holds exactly the series the unchunked query lists, so a chunk
+    plan that missed codes or periods, or overlapped, is detected.
+    Raises:
+        ValueError: If the series differ.
+    """
+    stitched_columns = list(pd.read_csv(stitched_file, dtype=str, nrows=0).columns)
+    listed_columns = list(pd.read_csv(series_keys_file, dtype=str, nrows=0).columns)
+    candidates = dimension_ids or listed_columns
+    key_columns = [c for c in candidates if c not in NON_KEY_COLUMNS and c in stitched_columns and c in listed_columns]
+    if not key_columns:
+        raise ValueError("No series key columns shared by the stitched file and the series keys")
+
+    expected = read_series_keys(series_keys_file, key_columns)
+    stitched = read_series_keys(stitched_file, key_columns)
+    if stitched != expected:
+        raise ValueError(f"Stitched file holds {len(stitched)} series ({len(stitched - expected)} unexpected), "
+                         f"the unchunked query lists {len(expected)} ({len(expected - stitched)} missing)")
+
+def stitch_chunks(chunk_files, file_name, series_keys_file=None, dimension_ids=None, temp_tag="") -> int:
+    """
+    Concatenates the CSV chunks of one dataflow into a single file with one header, and
+    verifies the result: every chunk must have the same header, the output must hold every
+    chunk body, and, given the series keys of the unchunked query, exactly those series must
+    be present. The output is renamed into place only once verified.
+    Args:
+        chunk_files (list): Downloaded chunk files; None for chunks that matched no observations.
+        file_name (Path): Destination file.
+        series_keys_file (Path): Series keys of the unchunked query (see series_keys_query), or
+            None to skip the series check.
+        dimension_ids (list): Dimension IDs of the dataflow, used as series key columns; by
+            default every column of the series keys file except TIME_PERIOD and OBS_VALUE.
+        temp_tag (str): Inserted into the name of the temporary output, e.g. '.{worker ID}'.
+    Returns:
+        int: Number of data rows written.
+    Raises:
+        ValueError: If the chunks do not fit together or the output is incomplete.
+    """
+    part_file = file_name.with_name(f"{file_name.name}{temp_tag}.part")
+    header = None
+    expected_size = 0
+    rows = 0
+    with open(part_file, "wb") as out:
+        for chunk_file in chunk_files:
+            if chunk_file is None:
+                continue
+            with open(chunk_file, "rb") as f:
+                chunk_header = f.readline()
+                if header is None:
+                    header = chunk_header
+                    out.write(header)
+                    expected_size += len(header)
+                elif chunk_header != header:
+                    raise ValueError(f"Chunk {chunk_file.name} has different columns than the first chunk")
+
+                body_size = os.path.getsize(chunk_file) - len(chunk_header)
+                # Make sure each chunk body ends with a newline so rows never merge across chunks
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    out.write(block)
+                    rows += block.count(b"\n")
+                    last = block
+                if body_size and not last.endswith(b"\n"):
+                    out.write(b"\n")
+                    rows += 1
+                    body_size += 1
+                expected_size += body_size
+        out.flush()
+        os.fsync(out.fileno())
+
+    if header is None:
+        part_file.unlink()
+        raise ValueError("No chunk returned any observations")
+    if os.path.getsize(part_file) != expected_size:
+        part_file.unlink()
+        raise ValueError(f"Stitched file has {os.path.getsize(part_file)} bytes, expected {expected_size}")
+    if series_keys_file is not None:
+        try:
+            _verify_series(part_file, series_keys_file, dimension_ids)
+        except Exception:
+            part_file.unlink()
+            raise
+
+    os.replace(part_file, file_name)
+    return rows
+
+def download_chunks(queries, file_name, download, workers, series_query=None, dimension_ids=None, temp_tag="") -> int:
+    """
+    Downloads the sub-queries of a dataflow in parallel and stitches them into one file.
+    Args:
+        queries (list): Sub-query URLs.
+        file_name (Path): Destination file.
+        download (callable): download(url, chunk_file) returning the HTTP status code.
+        workers (int): Number of chunks downloaded at the same time.
+        series_query (str): Series keys query of the whole dataflow the stitched file is checked
+            against, or None to skip the check.
+        dimension_ids (list): Dimension IDs of the dataflow (see stitch_chunks).
+        temp_tag (str): Inserted into the names of the chunk and temporary files, so workers
+            downloading the same dataflow never share them.
+    Returns:
+        int: Number of data rows in the stitched file.
+    Raises:
+        RuntimeError: If any chunk or the series keys could not be downloaded; no output is written then.
+        ValueError: If the stitched file fails verification; no output is written then.
+    """
+    file_name = Path(file_name)
+    chunk_files = [file_name.with_name(f"{file_name.name}{temp_tag}.chunk{i:03d}") for i in range(len(queries))]
+    series_keys_file = file_name.with_name(f"{file_name.name}{temp_tag}.serieskeys")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            series_future = executor.submit(download, series_query, series_keys_file) if series_query else None
+            statuses = list(executor.map(download, queries, chunk_files))
+            series_status = series_future.result() if series_future else None
+
+        failed = [(query, status) for query, status in zip(queries, statuses) if status not in (200, NO_RESULTS_STATUS)]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(queries)} chunks failed, e.g. {failed[0][0]} (status {failed[0][1]})")
+        if series_query and series_status != 200:
+            raise RuntimeError(f"Failed to download the series keys: {series_query} (status {series_status})")
+
+        return stitch_chunks([chunk if status == 200 else None for chunk, status in zip(chunk_files, statuses)], file_name,
+                             series_keys_file if series_query else None, dimension_ids, temp_tag)
+    finally:
+        for chunk_file in chunk_files + [series_keys_file]:
+            chunk_file.unlink(missing_ok=True)
+            chunk_file.with_name(f"{chunk_file.name}{temp_tag}.part").unlink(missing_ok=True)
+            chunk_file.with_name(f"{chunk_file.name}{temp_tag}.validator").unlink(missing_ok=True)
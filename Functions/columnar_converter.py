@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from Functions.logger import get_logger, child_process_logging
+from Functions import metrics
+from Functions.sdmx_structure import TIME_DIMENSION_ID, metadata_available, metadata_file_for, read_text_types
+
+logger = get_logger()
+
+# Columns holding numeric observation values; TIME_PERIOD is stored as the date its period
+# starts, columns with a numeric SDMX text type as numbers, every other column as dictionary-encoded text
+NUMERIC_COLUMNS = {"OBS_VALUE"}
+
+# Arrow types of the numeric SDMX text types
+TEXT_TYPE_ARROW_TYPES = {
+    "BigInteger": pa.int64(), "Integer": pa.int64(), "Long": pa.int64(), "Short": pa.int64(), "Count": pa.int64(),
+    "Decimal": pa.float64(), "Float": pa.float64(), "Double": pa.float64(),
+    "InclusiveValueRange": pa.float64(), "ExclusiveValueRange": pa.float64(), "Incremental": pa.float64(),
+}
+
+# Periods of the SDMX reporting periods ('2020-Q3', '2020-M07', ...) in months
+REPORTING_PERIOD_MONTHS = {"A": 12, "S": 6, "T": 4, "Q": 3, "M": 1}
+
+# SDMX time periods: a calendar year, month or day, or a year with a reporting period
+TIME_PERIOD_PATTERN = r"^(\d{4})(?:-(\d{2})(?:-(\d{2}))?|-([ASTQMWD])(\d{1,3}))?$"
+
+FORMAT_SUFFIXES = {"parquet": ".parquet", "feather": ".feather"}
+
+class _DictionaryEncoder:
+    """
+    Dictionary-encodes one text column chunk by chunk.
+    Codes are stable across chunks (new values are appended to the dictionary), so every chunk's
+    dictionary extends the previous one and can be written as a delta.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, series) -> pa.DictionaryArray:
+        for value in pd.unique(series.dropna()):
+            if value not in self.codes:
+                self.codes[value] = len(self.values)
+                self.values.append(value)
+        indices = series.map(self.codes).to_numpy(dtype="float64")
+        mask = np.isnan(indices)
+        indices = pa.array(np.nan_to_num(indices).astype("int32"), mask=mask, type=pa.int32())
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.values, type=pa.string()))
+
+def _schema(columns, column_types=None) -> pa.Schema:
+    """
+    Builds the output schema: numeric values as float64, TIME_PERIOD as date32, the columns in
+    column_types with their type, every other column as dictionary-encoded text.
+    """
+    column_types = column_types or {}
+    fields = []
+    for column in columns:
+        if column in NUMERIC_COLUMNS:
+            fields.append(pa.field(column, pa.float64()))
+        elif column == TIME_DIMENSION_ID:
+            fields.append(pa.field(column, pa.date32()))
+        elif column in column_types:
+            fields.append(pa.field(column, column_types[column]))
+        else:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(fields)
+
+def _numeric_array(values, field) -> pa.Array:
+    """
+    Converts a text column chunk to numbers. Empty cells and 'NaN' become nulls; any other value
+    that is not a number (or not a whole number for integer columns) raises, so it is never
+    silently replaced by a null.
+    """
+    numbers = pd.to_numeric(values, errors="coerce")
+    invalid = numbers.isna() & values.notna() & (values.str.lower() != "nan")
+    if pa.types.is_integer(field.type):
+        invalid |= numbers.notna() & (numbers != np.round(numbers))
+    if invalid.any():
+        raise ValueError(f"{field.name} holds {int(invalid.sum())} non-numeric values, e.g. {values[invalid].iloc[0]!r}")
+    if pa.types.is_integer(field.type):
+        numbers = numbers.astype("Int64")
+    return pa.array(numbers, type=field.type)
+
+def _period_start_array(values, field) -> pa.Array:
+    """
+    Converts SDMX time periods ('2020', '2020-Q3', '2020-M07', '2020-W05', '2020-07-15', ...) to
+    the date each period starts; a time range ('2020-01-01/P1Y') starts at its first date.
+    Empty cells become nulls; any other value that is not a time period raises.
+    """
+    text = values.str.replace(r"/.*$", "", regex=True).str.replace(r"T\d{2}:.*$", "", regex=True)
+    parts = text.str.extract(TIME_PERIOD_PATTERN)
+    year = pd.to_numeric(parts[0])
+    month = pd.to_numeric(parts[1]).fillna(1)
+    day = pd.to_numeric(parts[2]).fillna(1)
+    kind, number = parts[3], pd.to_numeric(parts[4])
+    for letter, months in REPORTING_PERIOD_MONTHS.items():
+        month = month.mask(kind == letter, (number - 1) * months + 1)
+
+    starts = pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day}), errors="coerce")
+    first_day = pd.to_datetime(pd.DataFrame({"year": year, "month": 1, "day": 1}), errors="coerce")
+    starts = starts.mask(kind == "D", first_day + pd.to_timedelta(number - 1, unit="D"))
+    # ISO week 1 is the week holding 4 January
+    fourth = first_day + pd.Timedelta(days=3)
+    week_one = fourth - pd.to_timedelta(fourth.dt.dayofweek, unit="D")
+    starts = starts.mask(kind == "W", week_one + pd.to_timedelta((number - 1) * 7, unit="D"))
+
+    invalid = starts.isna() & values.notna()
+    if invalid.any():
+        raise ValueError(f"{field.name} holds {int(invalid.sum())} values that are not time periods, e.g. {values[invalid].iloc[0]!r}")
+    return pa.array(starts).cast(field.type)
+
+def _record_batches(csv_file, schema, chunk_rows):
+    """
+    Streams a CSV file as typed record batches without loading it whole.
+    Raises:
+        ValueError: If a numeric or time column holds a value of another kind.
+    """
+    encoders = {field.name: _DictionaryEncoder() for field in schema if pa.types.is_dictionary(field.type)}
+    reader = pd.read_csv(csv_file, dtype=str, keep_default_na=False, na_values=[""], chunksize=chunk_rows)
+    for chunk in reader:
+        arrays = []
+        for field in schema:
+            if field.name in encoders:
+                arrays.append(encoders[field.name].encode(chunk[field.name]))
+            elif pa.types.is_date(field.type):
+                arrays.append(_period_start_array(chunk[field.name], field))
+            elif pa.types.is_floating(field.type) or pa.types.is_integer(field.type):
+                arrays.append(_numeric_array(chunk[field.name], field))
+            else:
+                arrays.append(pa.array(chunk[field.name], type=field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def structure_column_types(metadata_file) -> dict:
+    """
+    Returns the Arrow types of the columns the structure metadata of a dataflow gives a numeric
+    text type (e.g. a Double or Integer attribute). Coded columns are left as text.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file (or its manifest).
+    Returns:
+        dict: Column name to Arrow type.
+    """
+    return {component_id: TEXT_TYPE_ARROW_TYPES[text_type]
+            for component_id, text_type in read_text_types(metadata_file).items()
+            if text_type in TEXT_TYPE_ARROW_TYPES and component_id != TIME_DIMENSION_ID}
+
+def _time_partitioning() -> ds.Partitioning:
+    return ds.partitioning(pa.schema([pa.field(TIME_DIMENSION_ID, pa.date32())]), flavor="hive")
+
+def convert_csv(csv_file, output_format="parquet", compression="zstd", partition_by_time=False, chunk_rows=200000,
+                column_types=None) -> Path:
+    """
+    Converts a downloaded SDMX-CSV file into a typed, compressed columnar file next to it.
+    Dimensions and attributes are dictionary-encoded, OBS_VALUE is stored as float64, TIME_PERIOD
+    as the date its period starts, and columns listed in column_types (see structure_column_types)
+    as numbers. The output can optionally be partitioned by TIME_PERIOD (Parquet only).
+    Args:
+        csv_file (Path): The '{agency}_{dataflow}_ALL.csv' file.
+        output_format (str): "parquet" or "feather".
+        compression (str): Codec, e.g. "zstd", "lz4" or "uncompressed" (uncompressed Feather
+            files can be memory-mapped without copying).
+        partition_by_time (bool): Write one Parquet partition per TIME_PERIOD.
+        chunk_rows (int): Number of CSV rows converted per batch.
+        column_types (dict): Arrow types of further numeric columns.
+    Returns:
+        Path: The columnar file (or partitioned directory).
+    Raises:
+        ValueError: If a numeric or time column holds a value of another kind; no output is written.
+    """
+    csv_file = Path(csv_file)
+    output_path = csv_file.with_suffix(FORMAT_SUFFIXES[output_format])
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+
+    columns = list(pd.read_csv(csv_file, dtype=str, nrows=0).columns)
+    partition_by_time = partition_by_time and output_format == "parquet" and TIME_DIMENSION_ID in columns
+    schema = _schema(columns, column_types)
+    batches = _record_batches(csv_file, schema, chunk_rows)
+    codec = None if compression == "uncompressed" else compression
+
+    try:
+        if partition_by_time:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            ds.write_dataset(
+                batches, tmp_path, schema=schema, format="parquet",
+                partitioning=_time_partitioning(),
+                file_options=ds.ParquetFileFormat().make_write_options(compression=codec or "none"),
+                max_partitions=1_000_000, existing_data_behavior="overwrite_or_ignore",
+            )
+        elif output_format == "parquet":
+            with pq.ParquetWriter(tmp_path, schema, compression=codec or "none") as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=codec, emit_dictionary_deltas=True)
+            with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+    except Exception:
+        # Leave no partial output behind; the CSV stays the only copy
+        if tmp_path.is_dir():
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            tmp_path.unlink(missing_ok=True)
+        raise
+
+    # Replace any previous conversion, which may be a file or a partitioned directory
+    if output_path.is_dir():
+        shutil.rmtree(output_path)
+    elif tmp_path.is_dir():
+        output_path.unlink(missing_ok=True)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def read_columnar(path, columns=None) -> pd.DataFrame:
+    """
+    Loads a converted dataflow, memory-mapping the file(s) instead of copying them into memory.
+    Args:
+        path (Path): Columnar file or partitioned directory written by convert_csv.
+        columns (list): Columns to load (all by default).
+    """
+    path = Path(path)
+    if path.suffix == ".feather":
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            return (table.select(columns) if columns else table).to_pandas()
+    partitioning = _time_partitioning() if path.is_dir() else None
+    return pq.read_table(path, columns=columns, memory_map=True, partitioning=partitioning).to_pandas()
+
+def run_columnar_stage(ctx) -> bool:
+    """
+    Pipeline stage: converts the CSV files downloaded or refreshed in this run into columnar files.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    columnar_config = ctx.config.get("COLUMNAR", {})
+    if not columnar_config.get("ENABLED", False):
+        logger.info("Columnar conversion disabled.")
+        return True
+
+    csv_files = [Path(path) for path in dict.fromkeys(ctx.downloaded_files) if Path(path).exists()]
+    if not csv_files:
+        logger.info("No downloaded files to convert.")
+        return True
+
+    output_format = columnar_config.get("FORMAT", "parquet")
+    compression = columnar_config.get("COMPRESSION", "zstd")
+    partition_by_time = columnar_config.get("PARTITION_BY_TIME_PERIOD", False)
+    chunk_rows = columnar_config.get("CHUNK_ROWS", 200000)
+    keep_csv = columnar_config.get("KEEP_CSV", True)
+    workers = columnar_config.get("WORKERS", 2)
+
+    # Numeric attributes and measures are typed from the structure metadata when it was downloaded
+    column_types = {}
+    for csv_file in csv_files:
+        metadata_file = metadata_file_for(csv_file)
+        try:
+            column_types[csv_file] = structure_column_types(metadata_file) if metadata_available(metadata_file) else {}
+        except Exception as e:
+            logger.warning(f"Could not read the column types of {csv_file.name} from its structure metadata: {e}")
+            column_types[csv_file] = {}
+
+    logger.info(f"Converting {len(csv_files)} files to {output_format} with {workers} processes...")
+    converted = 0
+    with child_process_logging() as pool_logging, ProcessPoolExecutor(max_workers=workers, **pool_logging) as executor:
+        futures = {
+            executor.submit(convert_csv, csv_file, output_format, compression, partition_by_time, chunk_rows, column_types[csv_file]): csv_file
+            for csv_file in csv_files
+        }
+        for future in as_completed(futures):
+            csv_file = Path(futures[future])
+            try:
+                output_path = future.result()
+            except Exception as e:
+                logger.error(f"Error converting {csv_file}, keeping the CSV: {e}")
+                continue
+
+            converted += 1
+            files = output_path.rglob("*") if output_path.is_dir() else [output_path]
+            metrics.increment("write_bytes", sum(path.stat().st_size for path in files if path.is_file()), format=output_format)
+            logger.info(f"Converted {csv_file.name} to {output_path.name}")
+            if not keep_csv:
+                csv_file.unlink()
+
+    logger.info(f"Converted {converted} of {len(csv_files)} files successfully.")
+    return True
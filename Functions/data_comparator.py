@@ -1,12 +1,22 @@
 import pandas as pd
-from pathlib import Path
-from yaml import safe_load
-import os
 from datetime import datetime
 from Functions.logger import get_logger
+from Functions import metrics
+from Functions.run_context import RunContext
+from Functions.data_fetcher import run_fetch_stage, CATALOG_UNMODIFIED_CHECKPOINT
+from Functions.http_cache import invalidate
+from Functions.snapshot_store import load_snapshot, save_snapshot, snapshot_exists, export_excel
+from Functions.change_history import history_enabled, record_context_run
+from Functions.diff_engine import diff_tables, CHANGE_TYPE_COLUMN, NEW_INSERT, DELETED, UPDATED
 
 logger = get_logger()
 
+# Columns identifying a dataflow in the catalog snapshots
+DATAFLOW_KEY_COLUMNS = ["Agency ID", "Dataflow ID"]
+
+# Run journal checkpoint recorded once the changes of the run are saved, before the old snapshot is replaced
+CHANGES_SAVED_CHECKPOINT = "changes saved"
+
 def archive_file(file_path, archive_folder, prefix):
     """
     Archives the given file by moving it to the archive folder with a timestamp.
@@ -22,134 +32,220 @@ def archive_file(file_path, archive_folder, prefix):
         file_path.rename(archived_file)
         logger.info(f"Archived {file_path.name} to {archived_file}")
 
-def identify_changes(old_file, new_file, result_file):
+def retire_file(file_path, archive_folder, prefix, keep_archive=True):
+    """
+    Archives the given file, or deletes it when its content is kept in the change history instead.
+    Args:
+        file_path (Path): The file to be retired.
+        archive_folder (Path): The folder where the file should be archived.
+        prefix (str): Prefix for the archived file name.
+        keep_archive (bool): Archive the file rather than deleting it.
+    """
+    if keep_archive:
+        archive_file(file_path, archive_folder, prefix)
+    elif file_path.exists():
+        file_path.unlink()
+        logger.info(f"Removed {file_path.name}; its content is kept in the change history.")
+
+def load_previous_catalog(ctx, old_file) -> pd.DataFrame:
+    """
+    Returns the previous catalog snapshot, from memory when the service kept it from its last
+    run and OLD_FILE has not changed on disk since, otherwise from OLD_FILE.
+    Args:
+        ctx (RunContext): Shared run context.
+        old_file (Path): The previous snapshot file.
+    """
+    if ctx.previous_catalog is not None and old_file.exists() and old_file.stat().st_mtime_ns == ctx.previous_catalog_mtime:
+        logger.info("Using previous catalog snapshot held in memory.")
+        return ctx.previous_catalog
+
+    logger.info(f"Loading old data file: {old_file}")
+    return load_snapshot(old_file)
+
+def replace_previous_catalog(ctx, catalog, old_file) -> None:
     """
-    Compares two Excel files (old and new) to identify changes:
+    Saves the catalog as the previous snapshot (OLD_FILE) and keeps it in memory for the next run.
+    Args:
+        ctx (RunContext): Shared run context.
+        catalog (pd.DataFrame): The catalog fetched in this run.
+        old_file (Path): The previous snapshot file.
+    """
+    save_snapshot(catalog, old_file)
+    ctx.previous_catalog = catalog
+    ctx.previous_catalog_mtime = old_file.stat().st_mtime_ns
+
+def compare_catalogs(old_df, new_df):
+    """
+    Compares two catalog snapshots to identify changes:
     - New Inserts
     - Deleted Records
+    - Updated Records (with the names of the changed fields)
+    Args:
+        old_df (pd.DataFrame): Previous catalog snapshot.
+        new_df (pd.DataFrame): Latest catalog snapshot.
+    Returns:
+        pd.DataFrame: The changed dataflows, or None if the snapshots have different columns.
+    """
+    # Check for column mismatch
+    if list(old_df.columns) != list(new_df.columns):
+        logger.error("Column mismatch detected! Ensure both files have the same structure.")
+        return None
+
+    # Classify inserts, deletions and updates keyed on the dataflow identity
+    logger.info("Diffing old and new data on Agency ID and Dataflow ID...")
+    with metrics.timer("diff_seconds", table="catalog"):
+        changes_df = diff_tables(old_df, new_df, key_columns=DATAFLOW_KEY_COLUMNS)
+    counts = changes_df[CHANGE_TYPE_COLUMN].value_counts()
+    for change_type in (NEW_INSERT, DELETED, UPDATED):
+        metrics.increment("catalog_changes", int(counts.get(change_type, 0)), change_type=change_type)
+    logger.info(f"Detected {counts.get(NEW_INSERT, 0)} new inserts, {counts.get(DELETED, 0)} deletions "
+                f"and {counts.get(UPDATED, 0)} updates.")
+    return changes_df
+
+def save_changes(changes_df, result_file, export_to_excel=False, keep_archive=True):
+    """
+    Archives the previous result file and saves the detected changes in its place.
+    Args:
+        changes_df (pd.DataFrame): The changed dataflows.
+        result_file (Path): Snapshot file the changes are written to.
+        export_to_excel (bool): Also write an '.xlsx' copy of the changes for human review.
+        keep_archive (bool): Archive the previous result file (False when the change history holds it).
+    """
+    # Archive the existing result file before saving the new one
+    archive_folder = result_file.parent / "archive"
+    retire_file(result_file, archive_folder, "data_changes", keep_archive)
+    retire_file(result_file.with_suffix(".xlsx"), archive_folder, "data_changes", keep_archive)
+
+    # Save the results to the result file
+    if not changes_df.empty:
+        save_snapshot(changes_df, result_file)
+        logger.info(f"Changes saved successfully to {result_file}")
+        if export_to_excel:
+            excel_file = export_excel(changes_df, result_file)
+            logger.info(f"Changes exported to {excel_file}")
+    else:
+        logger.info("No changes detected. No result file created.")
+
+def identify_changes(old_file, new_file, result_file, export_to_excel=False):
+    """
+    Compares two snapshot files (old and new) and saves the changes to the result file.
+    Args:
+        old_file (Path): Previous catalog snapshot.
+        new_file (Path): Latest catalog snapshot.
+        result_file (Path): Snapshot file the changes are written to.
+        export_to_excel (bool): Also write an '.xlsx' copy of the changes for human review.
     """
     try:
-        # Load old and new Excel files
+        # Load old and new snapshots
         logger.info(f"Loading old data file: {old_file}")
-        old_df = pd.read_excel(old_file)
+        old_df = load_snapshot(old_file)
         logger.info(f"Loading new data file: {new_file}")
-        new_df = pd.read_excel(new_file)
-
-        # Check for column mismatch
-        if not all(old_df.columns == new_df.columns):
-            logger.error("Column mismatch detected! Ensure both files have the same structure.")
-            return
-
-        # Reset index for proper comparison
-        old_df.reset_index(drop=True, inplace=True)
-        new_df.reset_index(drop=True, inplace=True)
-
-        # Merge old and new DataFrames
-        logger.info("Merging old and new data for comparison...")
-        combined_df = old_df.merge(new_df, how="outer", indicator=True, suffixes=("_old", "_new"))
-
-        # Initialize Change_Type column
-        combined_df["Change_Type"] = None
-
-        # Identify Deleted Records
-        combined_df.loc[combined_df["_merge"] == "left_only", "Change_Type"] = "Deleted"
-
-        # Identify New Inserts
-        combined_df.loc[combined_df["_merge"] == "right_only", "Change_Type"] = "New Insert"
-
-        # Identify Updated Records (version or is_final changes)
-        logger.info("Identifying updated records...")
-        for column in ["version", "is_final"]:
-            column_old = f"{column}_old"
-            column_new = f"{column}_new"
-
-            if column_old in combined_df.columns and column_new in combined_df.columns:
-                updated_mask = (
-                    (combined_df["_merge"] == "both") &
-                    (combined_df[column_old] != combined_df[column_new])
-                )
-                combined_df.loc[updated_mask, "Change_Type"] = "Updated"
-
-        # Remove rows with no changes
-        logger.info("Filtering rows with no changes...")
-        combined_df = combined_df[combined_df["Change_Type"].notna()]
-
-        # Drop the '_merge' column
-        if "_merge" in combined_df.columns:
-            combined_df.drop(columns=["_merge"], inplace=True)
-
-        # Sort the changes by specific columns (1, 2, 5, 6)
-        logger.info("Sorting records by columns...")
-        sort_columns = combined_df.columns[[0, 1, 4, 5]].tolist()
-        combined_df.sort_values(by=sort_columns, inplace=True)
-
-        # Archive the existing result file before saving the new one
-        archive_folder = result_file.parent / "archive"
-        archive_file(result_file, archive_folder, "data_changes")
-
-        # Save the results to the result file
-        if not combined_df.empty:
-            combined_df.to_excel(result_file, index=False)
-            logger.info(f"Changes saved successfully to {result_file}")
-        else:
-            logger.info("No changes detected. No result file created.")
+        new_df = load_snapshot(new_file)
+
+        changes_df = compare_catalogs(old_df, new_df)
+        if changes_df is not None:
+            save_changes(changes_df, result_file, export_to_excel)
 
     except Exception as e:
         logger.error(f"Error during comparison: {e}")
 
-def fetch_and_identify_changes():
+def run_compare_stage(ctx) -> bool:
     """
-    Fetches new data using the fetcher script and compares it with the existing data.
-    Updates the old file with the new one if successful.
+    Pipeline stage: compares the catalog fetched in this run with the previous snapshot,
+    saves the changes, and replaces the previous snapshot with the new catalog.
+    The changes are handed to the download stage through the run context.
+    When resuming an interrupted run, the fetched catalog is reloaded from NEW_FILE and changes
+    already saved are reused, so replacing the old snapshot never hides them.
+    With HISTORY enabled, the changes are appended to the change history instead of archiving
+    the previous snapshot and result file on every run.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
     """
-    try:
-        # Dynamically determine project root
-        current_dir = Path(__file__).resolve().parent
-        project_root = current_dir.parent
+    old_file = ctx.path("OLD_FILE")
+    result_file = ctx.path("RESULT_FILE")
+    archive_folder = ctx.path("ARCHIVE_FOLDER")
+    journal = ctx.journal
+    keep_archive = not history_enabled(ctx)
+
+    # In a resumed run the fetch stage finished before the interruption; reload its output
+    if journal is not None and journal.resumed and ctx.catalog is None and ctx.catalog_modified:
+        ctx.catalog_modified = not journal.has_checkpoint(CATALOG_UNMODIFIED_CHECKPOINT)
+        if ctx.catalog_modified:
+            ctx.catalog = load_snapshot(ctx.path("NEW_FILE"))
+
+    # The fetch stage returns no catalog when it was not modified since the last run
+    if not ctx.catalog_modified:
+        logger.info("Dataflow catalog unchanged since the last run. Skipping comparison.")
+        retire_file(result_file, result_file.parent / "archive", "data_changes", keep_archive)
+        retire_file(result_file.with_suffix(".xlsx"), result_file.parent / "archive", "data_changes", keep_archive)
+        ctx.changes = pd.DataFrame()
+        return True
 
-        # Resolve the path to config.yaml
-        config_path = project_root / "config.yaml"
+    try:
+        if journal is not None and journal.has_checkpoint(CHANGES_SAVED_CHECKPOINT):
+            # Interrupted after saving the changes: the old file may already hold the new catalog
+            logger.info(f"Reusing changes saved before the interruption: {result_file}")
+            ctx.changes = load_snapshot(result_file) if snapshot_exists(result_file) else pd.DataFrame()
+        elif snapshot_exists(old_file):
+            # Compare old and new data
+            old_df = load_previous_catalog(ctx, old_file)
+            changes_df = compare_catalogs(old_df, ctx.catalog)
+            if changes_df is None:
+                raise ValueError("Catalog snapshots could not be compared.")
+
+            export_to_excel = ctx.config.get("SNAPSHOT", {}).get("EXPORT_EXCEL", False)
+            save_changes(changes_df, result_file, export_to_excel, keep_archive)
+            ctx.changes = changes_df
+            if journal is not None:
+                journal.checkpoint(CHANGES_SAVED_CHECKPOINT)
+        else:
+            logger.info("Old file not found. Creating baseline...")
+            replace_previous_catalog(ctx, ctx.catalog, old_file)
+            ctx.changes = pd.DataFrame()
+            if not keep_archive:
+                record_context_run(ctx, ctx.changes, force_base=True)
+            logger.info("Baseline file created successfully.")
+            return True
 
-        # Load configurations
-        with open(config_path, "r") as f:
-            config = safe_load(f)
-        
-        old_file = project_root / config["PATHS"]["OLD_FILE"]
-        new_file = project_root / config["PATHS"]["NEW_FILE"]
-        result_file = project_root / config["PATHS"]["RESULT_FILE"]
+        # Replace old file with new data after comparison (including a legacy Excel snapshot).
+        # With the change history, the run is recorded instead; a resumed run records it only once
+        if keep_archive:
+            archive_file(old_file, archive_folder, "old_data")
+            archive_file(old_file.with_suffix(".xlsx"), archive_folder, "old_data")
+        else:
+            record_context_run(ctx, ctx.changes)
+        replace_previous_catalog(ctx, ctx.catalog, old_file)
+        logger.info("Old file successfully updated with new data.")
+        return True
 
-        # Dynamically resolve the path to data_fetcher.py
-        fetch_and_save_path = project_root / "Functions" / "data_fetcher.py"
+    except Exception as e:
+        # Make the next run fetch the catalog again rather than treating it as unchanged
+        invalidate(ctx.config["API"]["DATAFLOW_INFO"], ctx.path("HTTP_CACHE_FOLDER"))
+        logger.error(f"Error during comparison: {e}")
+        return False
 
-        # Verify data_fetcher.py exists
-        if not fetch_and_save_path.exists():
-            logger.error(f"data_fetcher.py not found at: {fetch_and_save_path}")
-            return
+def fetch_and_identify_changes(ctx=None):
+    """
+    Fetches new data and compares it with the existing data in-process.
+    Updates the old file with the new one if successful.
+    Args:
+        ctx (RunContext): Shared run context (created from config.yaml if omitted).
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    try:
+        ctx = ctx or RunContext()
 
         # Fetch new data
-        logger.info(f"Running data_fetcher.py from: {fetch_and_save_path}")
-        result = os.system(f'python "{fetch_and_save_path}"')
-
-        if result == 0:
-            logger.info("New data fetched successfully. Proceeding to compare changes...")
-        else:
-            logger.error("Error running data_fetcher.py. Stopping the comparison process.")
-            return
-
-        # Compare old and new data
-        if old_file.exists():
-            logger.info("Comparing old and new data files...")
-            identify_changes(old_file, new_file, result_file)
+        if not run_fetch_stage(ctx):
+            logger.error("Error fetching new data. Stopping the comparison process.")
+            return False
+        logger.info("New data fetched successfully. Proceeding to compare changes...")
 
-            # Replace old file with new file after comparison
-            archive_folder = project_root / config["PATHS"]["ARCHIVE_FOLDER"]
-            archive_file(old_file, archive_folder, "old_data")
-            new_file.rename(old_file)
-            logger.info("Old file successfully updated with new data.")
-        else:
-            logger.info("Old file not found. Creating baseline...")
-            new_file.rename(old_file)
-            logger.info("Baseline file created successfully.")
+        return run_compare_stage(ctx)
 
     except Exception as e:
         logger.error(f"Error during fetch and identify changes: {e}")
+        return False
@@ -1,43 +1,53 @@
-import requests
-import xml.etree.ElementTree as ET
+from lxml import etree
 import pandas as pd
 from pathlib import Path
-from yaml import safe_load
 import shutil
 import sys
+from datetime import datetime
 
 # Dynamically add the project root to Python's module search path
 project_root = Path(__file__).resolve().parents[1]  # Go two levels up to the root
 sys.path.insert(0, str(project_root))
 
-def archive_existing_file():
+from Functions.http_cache import conditional_get, invalidate
+from Functions.snapshot_store import save_snapshot, snapshot_exists
+from Functions.run_context import RunContext
+from Functions.sdmx_structure import STRUCTURE_NS, COMMON_NS, XML_LANG
+from Functions.logger import get_logger
+from Functions import metrics
+
+logger = get_logger()
+
+DATAFLOW_COLUMNS = ["Dataflow ID", "Agency ID", "Version", "Is Final", "Name (en)", "Ref ID"]
+
+# Run journal checkpoint recorded when the catalog was not modified since the last run
+CATALOG_UNMODIFIED_CHECKPOINT = "catalog unmodified"
+
+def archive_existing_file(ctx=None):
     """
     Archives the existing file to the archive folder before starting the process.
+    Args:
+        ctx (RunContext): Shared run context (created from config.yaml if omitted).
     """
     try:
-        config_path = project_root / "config.yaml"
-        if not config_path.exists():
-            return False
-
-        with open(config_path, "r") as f:
-            config = safe_load(f)
+        ctx = ctx or RunContext()
 
         # Define paths
-        output_file = project_root / config["PATHS"]["NEW_FILE"]
-        archive_folder = project_root / config["PATHS"]["ARCHIVE_FOLDER"]
+        output_file = ctx.path("NEW_FILE")
+        archive_folder = ctx.path("ARCHIVE_FOLDER")
 
         if output_file.exists():
             # Ensure archive folder exists
             archive_folder.mkdir(parents=True, exist_ok=True)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            archived_file = archive_folder / f"all_dataflows_{timestamp}.xlsx"
+            archived_file = archive_folder / f"all_dataflows_{timestamp}{output_file.suffix}"
 
             # Copy the file to the archive folder
             shutil.copy2(output_file, archived_file)
 
             # Verify the archive file exists and matches original
             if not archived_file.exists() or archived_file.stat().st_size != output_file.stat().st_size:
-                print("Error: Archived file verification failed.")
+                logger.error("Archived file verification failed.")
                 return False
 
             # Ensure the original file remains in place
@@ -46,101 +56,134 @@ def archive_existing_file():
             return True
 
     except Exception as e:
-        print(f"Error during archival: {e}")
+        logger.error(f"Error during archival: {e}")
         return False
 
+def iter_dataflows(source):
+    """
+    Incrementally parses an SDMX dataflow catalog and yields one record per Dataflow element.
+    Each element is cleared once read, together with its already processed siblings, so memory
+    use depends on the number of records rather than on the size of the XML document.
+    Args:
+        source: Path or binary file object containing the SDMX-ML structure message.
+    Yields:
+        dict: Dataflow information keyed by DATAFLOW_COLUMNS.
+    """
+    context = etree.iterparse(source, events=("end",), tag=f"{{{STRUCTURE_NS}}}Dataflow")
+    for _, dataflow in context:
+        name_en = None
+        for name_elem in dataflow.iterchildren(f"{{{COMMON_NS}}}Name"):
+            if name_elem.get(XML_LANG) == "en":
+                name_en = name_elem.text
+                break
+
+        ref_id = None
+        structure_elem = dataflow.find(f"{{{STRUCTURE_NS}}}Structure")
+        if structure_elem is not None:
+            ref_elem = structure_elem.find(".//Ref")
+            if ref_elem is not None:
+                ref_id = ref_elem.get("id")
+
+        yield {
+            "Dataflow ID": dataflow.get("id"),
+            "Agency ID": dataflow.get("agencyID"),
+            "Version": dataflow.get("version"),
+            "Is Final": dataflow.get("isFinal"),
+            "Name (en)": name_en,
+            "Ref ID": ref_id
+        }
+
+        # Release the parsed element and every sibling processed before it
+        dataflow.clear()
+        while dataflow.getprevious() is not None:
+            del dataflow.getparent()[0]
+    del context
+
+def fetch_dataflows(ctx):
+    """
+    Fetches the dataflow catalog from the OECD API and parses it into a DataFrame.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        pd.DataFrame: The catalog, or None if it has not been modified since the last run.
+    Raises:
+        RuntimeError: If the API returns an unexpected status code.
+    """
+    # Fetch dataflow API, revalidating the cached catalog from the previous run
+    dataflow_api = ctx.config["API"]["DATAFLOW_INFO"]
+    cache_folder = ctx.path("HTTP_CACHE_FOLDER")
+    response = conditional_get(dataflow_api, cache_folder)
+
+    # An unchanged catalog cannot produce any changes, so skip parsing and comparison.
+    # Without a baseline the cached body is still parsed to create one.
+    if response.not_modified and snapshot_exists(ctx.path("OLD_FILE")):
+        logger.info("Dataflow catalog not modified since the last run. Skipping parse.")
+        return None
+
+    if response.status_code not in (200, 304):
+        raise RuntimeError(f"Failed to fetch dataflow API: {dataflow_api}, Status code: {response.status_code}")
+
+    try:
+        # Stream-parse the catalog into a DataFrame
+        with metrics.timer("parse_seconds", document="catalog"):
+            df = pd.DataFrame(iter_dataflows(str(response.path)), columns=DATAFLOW_COLUMNS)
+    except Exception:
+        # Drop the cached validators so the next run downloads the catalog again
+        invalidate(dataflow_api, cache_folder)
+        raise
 
-def fetch_and_save_api_data() -> bool:
+    metrics.increment("parsed_rows", len(df), document="catalog")
+    logger.info(f"Fetched {len(df)} dataflows from {dataflow_api}")
+    return df
+
+def run_fetch_stage(ctx) -> bool:
     """
-    Fetches data from the OECD API (Dataflow), parses XML, and saves it to an Excel file.
+    Pipeline stage: fetches the catalog and hands it to the next stage through the run context.
+    The catalog is also saved as NEW_FILE, from which a resumed run reloads it.
+    Args:
+        ctx (RunContext): Shared run context.
     Returns:
         bool: True if successful, False otherwise.
     """
     try:
-        # Load configuration file
-        config_path = project_root / "config.yaml"
-        if not config_path.exists():
-            return False
-
-        with open(config_path, "r") as f:
-            config = safe_load(f)
-
-        # Define output file path
-        output_file = project_root / config["PATHS"]["NEW_FILE"]
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-
-        # Fetch dataflow API
-        dataflow_api = config["API"]["DATAFLOW_INFO"]
-        response = requests.get(dataflow_api)
-
-        if response.status_code == 200:
-            try:
-                # Parse XML data
-                root = ET.fromstring(response.content)
-                ns = {
-                    "structure": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
-                    "message": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
-                    "common": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
-                    "xml": "http://www.w3.org/XML/1998/namespace"
-                }
-
-                # Find all Dataflow elements
-                dataflows = root.findall("message:Structures/structure:Dataflows/structure:Dataflow", ns)
-
-                # Extract dataflow information
-                data = []
-                for dataflow in dataflows:
-                    dataflow_id = dataflow.attrib.get("id")
-                    agency_id = dataflow.attrib.get("agencyID")
-                    version = dataflow.attrib.get("version")
-                    is_final = dataflow.attrib.get("isFinal")
-                    name_elem = dataflow.find("common:Name[@xml:lang='en']", ns)
-                    name_en = name_elem.text if name_elem is not None else None
-
-                    structure_elem = dataflow.find("structure:Structure", ns)
-                    ref_id = None
-                    if structure_elem is not None:
-                        ref_elem = structure_elem.find(".//Ref")
-                        if ref_elem is not None:
-                            ref_id = ref_elem.attrib.get("id")
-
-                    data.append({
-                        "Dataflow ID": dataflow_id,
-                        "Agency ID": agency_id,
-                        "Version": version,
-                        "Is Final": is_final,
-                        "Name (en)": name_en,
-                        "Ref ID": ref_id
-                    })
-
-                # Convert to DataFrame
-                df = pd.DataFrame(data)
-
-                # Save DataFrame to Excel
-                df.to_excel(output_file, index=False)
-
-            except ET.ParseError:
-                return False
-        else:
-            return False
-
+        ctx.catalog = fetch_dataflows(ctx)
+        ctx.catalog_modified = ctx.catalog is not None
+        if ctx.catalog_modified:
+            save_snapshot(ctx.catalog, ctx.path("NEW_FILE"))
+        elif ctx.journal is not None:
+            ctx.journal.checkpoint(CATALOG_UNMODIFIED_CHECKPOINT)
         return True
+    except Exception as e:
+        logger.error(f"Error fetching dataflow catalog: {e}")
+        return False
 
-    except Exception:
+def fetch_and_save_api_data(ctx=None) -> bool:
+    """
+    Fetches data from the OECD API (Dataflow), parses XML, and saves it as a snapshot file.
+    Args:
+        ctx (RunContext): Shared run context (created from config.yaml if omitted).
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    try:
+        ctx = ctx or RunContext()
+        return run_fetch_stage(ctx)
+
+    except Exception as e:
+        logger.error(f"Error saving dataflow catalog: {e}")
         return False
 
 if __name__ == "__main__":
-    # Archive the existing file before starting the process
-    if not archive_existing_file():
-        print("Error archiving existing file.")
-        sys.exit(1)
+    ctx = RunContext()
 
-    output_file = sys.argv[1] if len(sys.argv) > 1 else "all_dataflows_previous_1.xlsx"
+    # Optionally write the snapshot to a different file
+    if len(sys.argv) > 1:
+        ctx.config["PATHS"]["NEW_FILE"] = sys.argv[1]
 
-    config_path = project_root / "config.yaml"
-    if config_path.exists():
-        with open(config_path, "r") as f:
-            config = safe_load(f)
-        config["PATHS"]["NEW_FILE"] = output_file
+    # Archive the existing file before starting the process
+    if not archive_existing_file(ctx):
+        logger.error("Error archiving existing file.")
+        sys.exit(1)
 
-    fetch_and_save_api_data()
+    if not fetch_and_save_api_data(ctx):
+        sys.exit(1)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+# Values written to the Change_Type column
+NEW_INSERT = "New Insert"
+DELETED = "Deleted"
+UPDATED = "Updated"
+
+CHANGE_TYPE_COLUMN = "Change_Type"
+CHANGED_FIELDS_COLUMN = "Changed_Fields"
+
+def _align_dtypes(old_df, new_df, columns):
+    """
+    Returns copies of the given columns where each column has the same dtype in both frames.
+    Columns whose dtypes differ (e.g. a version read as float from a legacy file and as text
+    from the API) are compared as strings so equal values hash identically.
+    """
+    old_part = old_df[columns]
+    new_part = new_df[columns]
+    mismatched = [c for c in columns if old_part[c].dtype != new_part[c].dtype]
+    if mismatched:
+        old_part = old_part.astype({c: str for c in mismatched})
+        new_part = new_part.astype({c: str for c in mismatched})
+    return old_part, new_part
+
+def _row_hashes(df) -> np.ndarray:
+    """
+    Returns one 64-bit content hash per row of the given frame.
+    """
+    if df.shape[1] == 0:
+        return np.zeros(len(df), dtype="uint64")
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def _changed_fields(old_values, new_values, columns) -> pd.Series:
+    """
+    Lists, for each pair of rows, the columns whose values differ.
+    Args:
+        old_values (pd.DataFrame): Old rows, aligned position by position with new_values.
+        new_values (pd.DataFrame): New rows.
+        columns (list): Columns to compare.
+    Returns:
+        pd.Series: Comma separated names of the changed columns for each row.
+    """
+    if len(new_values) == 0:
+        return pd.Series([], dtype=object)
+
+    changed = pd.DataFrame(index=range(len(new_values)))
+    for column in columns:
+        old_col = old_values[column].to_numpy()
+        new_col = new_values[column].to_numpy()
+        both_missing = pd.isna(old_col) & pd.isna(new_col)
+        changed[column] = ~((old_col == new_col) | both_missing)
+    # Boolean matrix times column names concatenates the names of the changed columns
+    return changed.dot(pd.Index(columns) + ", ").str.rstrip(", ")
+
+def diff_tables(old_df, new_df, key_columns, value_columns=None) -> pd.DataFrame:
+    """
+    Classifies rows of two versions of a table as New Insert, Deleted or Updated in one pass.
+    Rows are matched on the key columns; only a 64-bit hash of each row's key and values is
+    merged, and full rows are gathered afterwards for the changed records only.
+    Args:
+        old_df (pd.DataFrame): Previous version of the table.
+        new_df (pd.DataFrame): Latest version of the table.
+        key_columns (list): Columns that identify a record.
+        value_columns (list): Columns compared for updates (defaults to all non-key columns).
+    Returns:
+        pd.DataFrame: The changed rows (old values for deletions, new values otherwise) with
+        Change_Type and Changed_Fields columns, sorted by the key columns.
+    """
+    if value_columns is None:
+        value_columns = [c for c in new_df.columns if c not in key_columns]
+
+    old_df = old_df.drop_duplicates(subset=key_columns, keep="last").reset_index(drop=True)
+    new_df = new_df.drop_duplicates(subset=key_columns, keep="last").reset_index(drop=True)
+
+    # Hash keys and row contents column-wise; dtypes are aligned so equal values hash equally
+    old_keys, new_keys = _align_dtypes(old_df, new_df, key_columns)
+    old_values, new_values = _align_dtypes(old_df, new_df, value_columns)
+    old_index = pd.DataFrame({
+        "_key": _row_hashes(old_keys),
+        "_hash": _row_hashes(old_values),
+        "_pos": np.arange(len(old_df)),
+    })
+    new_index = pd.DataFrame({
+        "_key": _row_hashes(new_keys),
+        "_hash": _row_hashes(new_values),
+        "_pos": np.arange(len(new_df)),
+    })
+
+    merged = old_index.merge(new_index, on="_key", how="outer", suffixes=("_old", "_new"), indicator=True)
+    deleted = merged.loc[merged["_merge"] == "left_only", "_pos_old"].astype("int64").to_numpy()
+    inserted = merged.loc[merged["_merge"] == "right_only", "_pos_new"].astype("int64").to_numpy()
+    updated_mask = (merged["_merge"] == "both") & (merged["_hash_old"] != merged["_hash_new"])
+    updated_old = merged.loc[updated_mask, "_pos_old"].astype("int64").to_numpy()
+    updated_new = merged.loc[updated_mask, "_pos_new"].astype("int64").to_numpy()
+
+    columns = list(new_df.columns)
+    deleted_rows = old_df.iloc[deleted].reindex(columns=columns)
+    deleted_rows[CHANGE_TYPE_COLUMN] = DELETED
+    deleted_rows[CHANGED_FIELDS_COLUMN] = None
+
+    inserted_rows = new_df.iloc[inserted]
+    inserted_rows = inserted_rows.assign(**{CHANGE_TYPE_COLUMN: NEW_INSERT, CHANGED_FIELDS_COLUMN: None})
+
+    updated_rows = new_df.iloc[updated_new]
+    updated_rows = updated_rows.assign(**{
+        CHANGE_TYPE_COLUMN: UPDATED,
+        CHANGED_FIELDS_COLUMN: _changed_fields(
+            old_values.iloc[updated_old].reset_index(drop=True),
+            new_values.iloc[updated_new].reset_index(drop=True),
+            value_columns,
+        ).to_numpy(),
+    })
+
+    changes = pd.concat([deleted_rows, inserted_rows, updated_rows], ignore_index=True)
+    return changes.sort_values(by=key_columns, kind="stable").reset_index(drop=True)
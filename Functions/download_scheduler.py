@@ -0,0 +1,105 @@
+import json
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from Functions.logger import get_logger
+from Functions import http_client
+from Functions.atomic_file import write_atomic
+from Functions.high_water_marks import dataflow_key, state_file_lock
+
+logger = get_logger()
+
+# Serialises read-modify-write cycles on the sizes file between download threads
+_sizes_lock = threading.Lock()
+
+def load_download_sizes(sizes_file) -> dict:
+    """
+    Loads the size in bytes of each dataflow's last completed data download.
+    Args:
+        sizes_file (Path): JSON file holding the sizes.
+    Returns:
+        dict: Sizes keyed by dataflow.
+    """
+    sizes_file = Path(sizes_file)
+    if not sizes_file.exists():
+        return {}
+    with open(sizes_file, "r") as f:
+        return json.load(f)
+
+def record_download_size(sizes_file, agency_id, dataflow_id, size) -> None:
+    """
+    Records the size of a completed data download for scheduling later runs.
+    Args:
+        sizes_file (Path): JSON file holding the sizes.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        size (int): Size of the downloaded file in bytes.
+    """
+    sizes_file = Path(sizes_file)
+    with state_file_lock(sizes_file, _sizes_lock):
+        sizes = load_download_sizes(sizes_file)
+        sizes[dataflow_key(agency_id, dataflow_id)] = int(size)
+        write_atomic(sizes_file, json.dumps(sizes, indent=2, sort_keys=True))
+
+def probe_size(url):
+    """
+    Asks the server for the size of a response with a HEAD request.
+    Returns:
+        int: The Content-Length, or None if the server does not report it.
+    """
+    try:
+        response = http_client.head(url)
+        content_length = response.headers.get("Content-Length", "")
+        if response.status_code == 200 and content_length.isdigit():
+            return int(content_length)
+    except Exception as e:
+        logger.warning(f"Could not probe size of {url}: {e}")
+    return None
+
+def estimate_sizes(jobs, sizes, probe_urls=None, max_workers=8) -> dict:
+    """
+    Estimates the download size of each job from earlier runs, probing unknown ones if asked.
+    Args:
+        jobs (list): (agency ID, dataflow ID, ...) tuples.
+        sizes (dict): Known sizes in bytes keyed by dataflow (from earlier runs).
+        probe_urls (dict): Job to URL to probe with HEAD when its size is unknown (optional).
+        max_workers (int): Number of concurrent HEAD requests.
+    Returns:
+        dict: Size in bytes per job, None where unknown.
+    """
+    job_sizes = {job: sizes.get(dataflow_key(job[0], job[1])) for job in jobs}
+
+    # Ask the server about dataflows never downloaded before
+    if probe_urls:
+        unknown = [job for job in jobs if job_sizes[job] is None and job in probe_urls]
+        if unknown:
+            logger.info(f"Probing sizes of {len(unknown)} dataflows...")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for job, size in zip(unknown, executor.map(probe_size, [probe_urls[job] for job in unknown])):
+                    job_sizes[job] = size
+    return job_sizes
+
+def prioritise(jobs, job_sizes, priority_keys=()) -> list:
+    """
+    Orders download jobs so important and large dataflows start first and the run does not end
+    on a long tail. The thread pool starts jobs in submission order, so the sorted list acts as
+    the priority queue.
+    Args:
+        jobs (list): (agency ID, dataflow ID, ...) tuples.
+        job_sizes (dict): Estimated size per job (see estimate_sizes), None where unknown.
+        priority_keys (iterable): "AGENCY,DATAFLOW" keys that always go first.
+    Returns:
+        list: The jobs, highest priority first.
+    """
+    priority_keys = set(priority_keys or ())
+
+    # Dataflows of unknown size are scheduled as if they had the median known size
+    known = [size for size in job_sizes.values() if size is not None]
+    default_size = statistics.median(known) if known else 0
+
+    def sort_key(job):
+        size = job_sizes[job] if job_sizes[job] is not None else default_size
+        return (dataflow_key(job[0], job[1]) not in priority_keys, -size)
+
+    return sorted(jobs, key=sort_key)
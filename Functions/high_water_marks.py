@@ -0,0 +1,96 @@
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from Functions.atomic_file import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; only threads of one process are serialised there
+    fcntl = None
+
+# Serialises read-modify-write cycles on the state file between download threads
+_state_lock = threading.Lock()
+
+@contextmanager
+def state_file_lock(state_file, thread_lock):
+    """
+    Serialises read-modify-write cycles on a JSON state file between the threads of this process
+    (thread_lock) and between processes, including sharded download workers on other hosts
+    sharing the folder (an flock on a '.lock' file next to it).
+    Args:
+        state_file (Path): The state file.
+        thread_lock (threading.Lock): Lock shared by the threads updating the file.
+    """
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(state_file.with_name(state_file.name + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def format_timestamp(moment) -> str:
+    """
+    Formats a datetime as the ISO 8601 UTC timestamp accepted by the SDMX 'updatedAfter' parameter.
+    """
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def dataflow_key(agency_id, dataflow_id) -> str:
+    """
+    Returns the key identifying a dataflow in the state file.
+    """
+    return f"{agency_id},{dataflow_id}"
+
+def load_high_water_marks(state_file) -> dict:
+    """
+    Loads the per-dataflow high-water marks.
+    Args:
+        state_file (Path): JSON file holding the marks.
+    Returns:
+        dict: Timestamp of the last successful download, keyed by dataflow.
+    """
+    state_file = Path(state_file)
+    if not state_file.exists():
+        return {}
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+def record_high_water_mark(state_file, agency_id, dataflow_id, moment) -> None:
+    """
+    Records that all observations of a dataflow changed before the given moment are stored locally.
+    Args:
+        state_file (Path): JSON file holding the marks.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        moment (datetime): Time the download request was started.
+    """
+    state_file = Path(state_file)
+    with state_file_lock(state_file, _state_lock):
+        marks = load_high_water_marks(state_file)
+        marks[dataflow_key(agency_id, dataflow_id)] = format_timestamp(moment)
+        # Written atomically so a crash never corrupts the marks
+        write_atomic(state_file, json.dumps(marks, indent=2, sort_keys=True))
+
+def get_high_water_mark(state_file, agency_id, dataflow_id, fallback_file=None):
+    """
+    Returns the high-water mark of a dataflow as an 'updatedAfter' timestamp.
+    Args:
+        state_file (Path): JSON file holding the marks.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        fallback_file (Path): Local copy whose modification time is used if no mark was recorded.
+    Returns:
+        str: The timestamp, or None if neither a mark nor the fallback file exists.
+    """
+    mark = load_high_water_marks(state_file).get(dataflow_key(agency_id, dataflow_id))
+    if mark:
+        return mark
+    if fallback_file is not None and Path(fallback_file).exists():
+        return format_timestamp(datetime.fromtimestamp(Path(fallback_file).stat().st_mtime, timezone.utc))
+    return None
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from collections import namedtuple
+from pathlib import Path
+from Functions import http_client, metrics
+from Functions.atomic_file import atomic_open, write_atomic
+
+# Result of a conditional GET: the HTTP status, whether the cached body is still current,
+# and the path of the cached body on disk (None if nothing could be cached)
+CachedResponse = namedtuple("CachedResponse", ["status_code", "not_modified", "path"])
+
+def _cache_paths(url, cache_folder):
+    """
+    Returns the metadata and body file paths used to cache the given URL.
+    Args:
+        url (str): The requested URL.
+        cache_folder (Path): Folder holding the cache entries.
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return cache_folder / f"{key}.json", cache_folder / f"{key}.body"
+
+def conditional_get(url, cache_folder, chunk_size=1024 * 1024) -> CachedResponse:
+    """
+    Performs a GET request using the ETag/Last-Modified validators stored from the previous
+    response to the same URL. A 304 response reuses the cached body; a 200 response is
+    streamed into the cache together with its new validators.
+    Args:
+        url (str): The URL to fetch.
+        cache_folder (Path): Folder holding the cache entries.
+        chunk_size (int): Number of bytes read from the socket per write.
+    Returns:
+        CachedResponse: Status code, not-modified flag and path of the cached body.
+    """
+    cache_folder = Path(cache_folder)
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    meta_file, body_file = _cache_paths(url, cache_folder)
+
+    # Send stored validators only if the cached body they belong to is still present
+    headers = {}
+    if meta_file.exists() and body_file.exists():
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with http_client.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            metrics.increment("http_cache_hits")
+            return CachedResponse(304, True, body_file)
+        if response.status_code != 200:
+            # Read the (small) error body so the connection goes back to the pool instead of being dropped
+            response.content
+            return CachedResponse(response.status_code, False, None)
+
+        # Stream the new body into the cache, then record its validators
+        with atomic_open(body_file, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                http_client.record_received(len(chunk))
+        metrics.increment("download_bytes", body_file.stat().st_size, kind="cached")
+
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        write_atomic(meta_file, json.dumps(meta))
+
+    return CachedResponse(200, False, body_file)
+
+def invalidate(url, cache_folder) -> None:
+    """
+    Removes the cache entry for a URL, e.g. when its body could not be processed, so the
+    next request downloads it again instead of receiving a 304.
+    Args:
+        url (str): The cached URL.
+        cache_folder (Path): Folder holding the cache entries.
+    """
+    meta_file, body_file = _cache_paths(url, Path(cache_folder))
+    meta_file.unlink(missing_ok=True)
+    body_file.unlink(missing_ok=True)
@@ -0,0 +1,189 @@
+import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from Functions.rate_limiter import AdaptiveRateLimiter
+from Functions import metrics
+
+# Defaults used for any HTTP setting missing from the HTTP section of config.yaml
+DEFAULT_HTTP_CONFIG = {
+    "TIMEOUT_CONNECT": 10,
+    "TIMEOUT_READ": 300,
+    "POOL_SIZE": 16,
+    "RETRIES": 5,
+    "BACKOFF_FACTOR": 2,
+    "RETRY_STATUSES": [429, 500, 502, 503, 504],
+    "USER_AGENT": "OECD-dataset-downloader",
+}
+
+# One pooled session is shared by every fetch path and every download thread
+_http_config = dict(DEFAULT_HTTP_CONFIG)
+_session = None
+_session_lock = threading.Lock()
+
+# Optional limiter every request waits on, adapted to the responses it sees
+_rate_limit_config = {}
+_rate_limiter = None
+
+# Requests waiting for their response and response bytes received so far in this process,
+# read by the lease heartbeat of sharded downloads as a sign of progress
+_in_flight = 0
+_bytes_received = 0
+_progress_lock = threading.Lock()
+
+def configure(http_config, rate_limit_config=None) -> None:
+    """
+    Applies the HTTP and RATE_LIMIT sections of config.yaml. If the settings changed, the shared
+    session is rebuilt on next use and the rate limiter starts again from its initial rate.
+    Args:
+        http_config (dict): HTTP settings (timeouts, pool size, retries, backoff).
+        rate_limit_config (dict): Token bucket settings; the limiter is off unless ENABLED.
+    """
+    global _http_config, _session, _rate_limit_config, _rate_limiter
+    with _session_lock:
+        rate_limit_config = rate_limit_config or {}
+        if rate_limit_config != _rate_limit_config:
+            _rate_limit_config = rate_limit_config
+            _rate_limiter = AdaptiveRateLimiter.from_config(rate_limit_config) if rate_limit_config.get("ENABLED") else None
+
+        new_config = {**DEFAULT_HTTP_CONFIG, **(http_config or {})}
+        if new_config == _http_config:
+            return  # Keep the warm connections of the existing session
+        _http_config = new_config
+        if _session is not None:
+            _session.close()
+        _session = None
+
+class _LimitedRetry(Retry):
+    """
+    Retry policy that sends every retried attempt through the rate limiter: a retried 429 slows
+    the limiter down at once, and each retry waits for a token after its backoff, so retries
+    count against the request rate like first attempts.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        limiter = _rate_limiter
+        if limiter is not None and response is not None and response.status == 429:
+            limiter.throttled()
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    def sleep(self, response=None) -> None:
+        super().sleep(response)
+        limiter = _rate_limiter
+        if limiter is not None:
+            limiter.acquire()
+
+def _build_session(http_config):
+    """
+    Creates a session with connection pooling, compressed transfer and retries.
+    Retries use exponential backoff, honour the Retry-After header of 429/503 responses and
+    are paced by the rate limiter.
+    """
+    retry = _LimitedRetry(
+        total=http_config["RETRIES"],
+        backoff_factor=http_config["BACKOFF_FACTOR"],
+        status_forcelist=http_config["RETRY_STATUSES"],
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=http_config["POOL_SIZE"],
+        pool_maxsize=http_config["POOL_SIZE"],
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "User-Agent": http_config["USER_AGENT"],
+    })
+    return session
+
+def get_session():
+    """
+    Returns the shared session, creating it on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session(_http_config)
+        return _session
+
+def _retry_history(response) -> tuple:
+    """
+    Returns the attempts urllib3 retried before returning the final response.
+    """
+    retries = getattr(response.raw, "retries", None)
+    return retries.history if retries is not None else ()
+
+def requests_in_flight() -> int:
+    """
+    Returns the number of requests of this process waiting for the rate limiter or their response.
+    """
+    return _in_flight
+
+def record_received(size) -> None:
+    """
+    Counts response body bytes read by a caller streaming a response.
+    """
+    global _bytes_received
+    with _progress_lock:
+        _bytes_received += size
+
+def bytes_received() -> int:
+    """
+    Returns the number of streamed response bytes recorded with record_received so far.
+    """
+    return _bytes_received
+
+def request(method, url, **kwargs):
+    """
+    Sends a request through the shared session with the configured timeouts, pacing it with
+    the rate limiter when one is enabled.
+    Args:
+        method (str): HTTP method.
+        url (str): The URL to fetch.
+        **kwargs: Passed on to requests (headers, stream, ...).
+    Returns:
+        requests.Response: The response.
+    """
+    global _in_flight
+    kwargs.setdefault("timeout", (_http_config["TIMEOUT_CONNECT"], _http_config["TIMEOUT_READ"]))
+    limiter = _rate_limiter
+    with _progress_lock:
+        _in_flight += 1
+    try:
+        if limiter is not None:
+            limiter.acquire()
+        started = time.monotonic()
+        response = get_session().request(method, url, **kwargs)
+        latency = time.monotonic() - started
+    finally:
+        with _progress_lock:
+            _in_flight -= 1
+    if limiter is not None:
+        limiter.record(response.status_code, latency)
+
+    metrics.observe("http_request_seconds", latency, method=method)
+    metrics.increment("http_requests", method=method, status=response.status_code)
+    retried = len(_retry_history(response))
+    if retried:
+        metrics.increment("http_retries", retried, method=method)
+    return response
+
+def get(url, **kwargs):
+    """
+    Sends a GET request through the shared session. See request().
+    """
+    return request("GET", url, **kwargs)
+
+def head(url, **kwargs):
+    """
+    Sends a HEAD request through the shared session. See request().
+    """
+    kwargs.setdefault("allow_redirects", True)
+    return request("HEAD", url, **kwargs)
@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from Functions.logger import get_logger
+from Functions import metrics
+from Functions.run_context import RunContext
+from Functions.api_downloader import get_host_semaphore, stream_to_file, load_changes, data_query_url, structure_downloader
+from Functions.diff_engine import CHANGED_FIELDS_COLUMN
+from Functions.chunked_download import with_query_params
+from Functions.high_water_marks import get_high_water_mark, record_high_water_mark
+from Functions.sdmx_structure import read_dimension_ids, metadata_available, TIME_DIMENSION_ID
+
+logger = get_logger()
+
+# Statuses returned by SDMX services that do not support the 'updatedAfter' parameter
+UNSUPPORTED_PARAMETER_STATUSES = {400, 422, 501}
+
+# SDMX-CSV columns that describe the message or the row operation rather than the observation
+NON_KEY_COLUMNS = {"STRUCTURE", "STRUCTURE_ID", "STRUCTURE_NAME", "ACTION", "DATAFLOW"}
+
+# Kind of run journal item recorded for each refreshed dataflow
+JOURNAL_REFRESH = "refresh"
+
+# Values of the SDMX-CSV ACTION column marking deleted observations
+DELETE_ACTION = "D"
+
+# Matches SDMX identifiers (codes) as opposed to human-readable label columns
+_SDMX_ID_PATTERN = re.compile(r"^[A-Z][A-Z0-9_@$\-]*$")
+
+def observation_key_columns(columns, dimension_ids=None) -> list:
+    """
+    Returns the columns identifying an observation in an SDMX-CSV file: its dimensions and TIME_PERIOD.
+    Args:
+        columns (list): Header of the CSV file.
+        dimension_ids (list): Dimension IDs from the structure message, if available.
+    Returns:
+        list: Key columns, in file order.
+    """
+    if dimension_ids:
+        key_columns = [c for c in columns if c in set(dimension_ids)]
+        if key_columns:
+            return key_columns
+
+    # Without structure metadata, take the code columns that precede the observation value
+    key_columns = []
+    for column in columns:
+        if column == "OBS_VALUE":
+            break
+        if column not in NON_KEY_COLUMNS and _SDMX_ID_PATTERN.match(column):
+            key_columns.append(column)
+    return key_columns
+
+def _key_hashes(df, key_columns) -> np.ndarray:
+    """
+    Returns one 64-bit hash per row of the key columns.
+    """
+    return pd.util.hash_pandas_object(df[key_columns], index=False).to_numpy()
+
+def last_time_period(csv_file, chunk_rows):
+    """
+    Returns the latest TIME_PERIOD stored in a CSV file, reading only that column in chunks.
+    Args:
+        csv_file (Path): Local copy of the dataflow.
+        chunk_rows (int): Number of rows read per chunk.
+    Returns:
+        str: The latest period, or None if the file has no TIME_PERIOD values.
+    """
+    latest = None
+    for chunk in pd.read_csv(csv_file, usecols=[TIME_DIMENSION_ID], dtype=str, chunksize=chunk_rows):
+        periods = chunk[TIME_DIMENSION_ID].dropna()
+        if not periods.empty and (latest is None or periods.max() > latest):
+            latest = periods.max()
+    return latest
+
+def merge_delta(local_file, delta_file, key_columns, chunk_rows):
+    """
+    Merges changed observations into the local copy of a dataflow.
+    The local file is streamed in chunks; rows whose key appears in the delta are replaced by the
+    delta rows, and rows the delta marks as deleted are dropped. The result replaces the local
+    file atomically.
+    Args:
+        local_file (Path): Local copy of the dataflow.
+        delta_file (Path): CSV file with the changed observations.
+        key_columns (list): Columns identifying an observation.
+        chunk_rows (int): Number of local rows processed per chunk.
+    Returns:
+        int: Number of delta rows applied, or None if the delta columns do not match the local file.
+    """
+    delta = pd.read_csv(delta_file, dtype=str, keep_default_na=False)
+    local_columns = pd.read_csv(local_file, dtype=str, nrows=0).columns
+    if list(delta.columns) != list(local_columns):
+        return None
+
+    delta_keys = _key_hashes(delta, key_columns)
+    if "ACTION" in delta.columns:
+        upserts = delta[delta["ACTION"] != DELETE_ACTION]
+    else:
+        upserts = delta
+
+    merged_file = local_file.with_name(local_file.name + ".merge")
+    header = True
+    with open(merged_file, "w", newline="", encoding="utf-8") as out:
+        for chunk in pd.read_csv(local_file, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+            kept = chunk[~np.isin(_key_hashes(chunk, key_columns), delta_keys)]
+            kept.to_csv(out, header=header, index=False)
+            header = False
+        upserts.to_csv(out, header=header, index=False)
+
+    os.replace(merged_file, local_file)
+    return len(delta)
+
+def refresh_dataflow(ctx, agency_id, dataflow_id, version=None, version_changed=False) -> bool:
+    """
+    Downloads only the observations of a locally stored dataflow that changed since its
+    high-water mark ('updatedAfter', or 'startPeriod' from the last stored period as a fallback)
+    and merges them into the local copy. When the changes cannot be merged (their columns differ
+    from the local copy, or it has no TIME_PERIOD to start from), the whole dataflow is downloaded
+    again instead. The structure metadata is downloaded again first when the version changed.
+    Args:
+        ctx (RunContext): Shared run context.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+        version (str): Current version of the dataflow.
+        version_changed (bool): The version differs from the one the local copy was downloaded with.
+    Returns:
+        bool: True if the local copy is up to date, False otherwise.
+    """
+    config = ctx.config
+    download_config = config.get("DOWNLOAD", {})
+    max_per_host = download_config.get("MAX_PER_HOST", 4)
+    chunk_size = download_config.get("CHUNK_SIZE", 1024 * 1024)
+    resume_attempts = download_config.get("RESUME_ATTEMPTS", 3)
+    chunk_rows = config.get("INCREMENTAL", {}).get("MERGE_CHUNK_ROWS", 200000)
+
+    output_folder = ctx.project_root / "output"
+    data_file = output_folder / f"{agency_id}_{dataflow_id}_ALL.csv"
+    delta_file = output_folder / f"{agency_id}_{dataflow_id}_DELTA.csv"
+    structure_file = output_folder / f"{agency_id}_{dataflow_id}_metadata.xml"
+    state_file = ctx.path("HIGH_WATER_MARKS_FILE")
+
+    def download_whole(reason):
+        logger.info(f"{reason} Downloading the whole dataflow again: {data_query_api}")
+        metrics.increment("refresh_full_downloads")
+        with get_host_semaphore(data_query_api, max_per_host):
+            status_code = stream_to_file(data_query_api, data_file, chunk_size, resume_attempts)
+        if status_code != 200:
+            logger.error(f"Failed to download data query API: {data_query_api}, Status code: {status_code}")
+            return False
+        record_high_water_mark(state_file, agency_id, dataflow_id, started_at)
+        logger.info(f"Data successfully saved to: {data_file}")
+        return True
+
+    try:
+        # A new version may come with a new data structure, which later key and label lookups read
+        if version_changed and not structure_downloader(ctx, agency_id, dataflow_id, version, structure_file)():
+            logger.error(f"Could not download the structure metadata of version {version} of {agency_id},{dataflow_id}.")
+            return False
+
+        updated_after = get_high_water_mark(state_file, agency_id, dataflow_id, fallback_file=data_file)
+        data_query_api = data_query_url(config, agency_id, dataflow_id)
+        started_at = datetime.now(timezone.utc)
+
+        # Request the observations changed since the high-water mark
+        delta_query_api = with_query_params(data_query_api, updatedAfter=updated_after)
+        logger.info(f"Downloading changes since {updated_after} from: {delta_query_api}")
+        with get_host_semaphore(delta_query_api, max_per_host):
+            status_code = stream_to_file(delta_query_api, delta_file, chunk_size, resume_attempts)
+
+        # Fall back to re-reading the latest stored period onwards
+        if status_code in UNSUPPORTED_PARAMETER_STATUSES:
+            start_period = last_time_period(data_file, chunk_rows)
+            if start_period is None:
+                return download_whole(f"updatedAfter not supported and no TIME_PERIOD in the local copy of {agency_id},{dataflow_id}.")
+            delta_query_api = with_query_params(data_query_api, startPeriod=start_period)
+            logger.info(f"updatedAfter not supported, downloading from period {start_period}: {delta_query_api}")
+            with get_host_semaphore(delta_query_api, max_per_host):
+                status_code = stream_to_file(delta_query_api, delta_file, chunk_size, resume_attempts)
+
+        # SDMX services answer 404 when no observations match the query
+        if status_code == 404:
+            logger.info(f"No changed observations for Dataflow ID: {dataflow_id}, Agency ID: {agency_id}")
+            record_high_water_mark(state_file, agency_id, dataflow_id, started_at)
+            return True
+        if status_code != 200:
+            logger.error(f"Failed to download changes: {delta_query_api}, Status code: {status_code}")
+            return False
+
+        # Merge the changes into the local copy
+        dimension_ids = read_dimension_ids(structure_file) if metadata_available(structure_file) else None
+        local_columns = pd.read_csv(data_file, dtype=str, nrows=0).columns
+        key_columns = observation_key_columns(local_columns, dimension_ids)
+        with metrics.timer("merge_seconds"):
+            applied = merge_delta(data_file, delta_file, key_columns, chunk_rows)
+        delta_file.unlink(missing_ok=True)
+        if applied is None:
+            return download_whole(f"Changes for {agency_id},{dataflow_id} do not match the local columns.")
+
+        record_high_water_mark(state_file, agency_id, dataflow_id, started_at)
+        metrics.increment("merged_rows", applied)
+        logger.info(f"Merged {applied} changed observations into: {data_file}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error refreshing Dataflow ID: {dataflow_id}, Agency ID: {agency_id}: {e}")
+        return False
+
+def run_refresh_stage(ctx) -> bool:
+    """
+    Pipeline stage: incrementally refreshes the 'Updated' dataflows that are already stored locally.
+    Dataflows downloaded again earlier in the run (e.g. by the observation diff) are skipped.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    try:
+        if not ctx.config.get("INCREMENTAL", {}).get("ENABLED", False):
+            logger.info("Incremental refresh disabled.")
+            return True
+
+        changes_df = load_changes(ctx)
+        if changes_df.empty:
+            logger.info("No changes to refresh.")
+            return True
+
+        # Only dataflows with a local copy can be refreshed incrementally
+        output_folder = ctx.project_root / "output"
+        updated = changes_df[changes_df["Change_Type"] == "Updated"]
+        if CHANGED_FIELDS_COLUMN in updated.columns:
+            version_changed = updated[CHANGED_FIELDS_COLUMN].fillna("").str.split(", ").map(lambda fields: "Version" in fields)
+        else:
+            version_changed = pd.Series(False, index=updated.index)
+        targets = [
+            (agency_id, dataflow_id, version, changed)
+            for agency_id, dataflow_id, version, changed in zip(updated["Agency ID"], updated["Dataflow ID"], updated["Version"], version_changed)
+            if (output_folder / f"{agency_id}_{dataflow_id}_ALL.csv").exists()
+            and output_folder / f"{agency_id}_{dataflow_id}_ALL.csv" not in ctx.downloaded_files
+        ]
+        # Skip dataflows already refreshed by the interrupted run being resumed
+        journal = ctx.journal
+        if journal is not None and journal.resumed:
+            finished = [target for target in targets if journal.item_done(JOURNAL_REFRESH, f"{target[0]},{target[1]}")]
+            for agency_id, dataflow_id, _, _ in finished:
+                ctx.downloaded_files.append(output_folder / f"{agency_id}_{dataflow_id}_ALL.csv")
+            targets = [target for target in targets if target not in finished]
+        if not targets:
+            logger.info("No locally stored dataflows to refresh.")
+            return True
+
+        max_workers = ctx.config.get("DOWNLOAD", {}).get("MAX_WORKERS", 8)
+        logger.info(f"Refreshing {len(targets)} updated dataflows incrementally...")
+        refreshed = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(refresh_dataflow, ctx, *target): target[:2] for target in targets}
+            for future in as_completed(futures):
+                if future.result():
+                    refreshed += 1
+                    agency_id, dataflow_id = futures[future]
+                    ctx.downloaded_files.append(output_folder / f"{agency_id}_{dataflow_id}_ALL.csv")
+                    if journal is not None:
+                        journal.complete_item(JOURNAL_REFRESH, f"{agency_id},{dataflow_id}")
+
+        logger.info(f"Refreshed {refreshed} of {len(targets)} dataflows successfully.")
+        return True
+
+    except Exception as e:
+        logger.error(f"An error occurred during incremental refresh: {e}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("Starting incremental refresh...")
+    run_refresh_stage(RunContext())
+    logger.info("Incremental refresh completed.")
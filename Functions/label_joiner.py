@@ -0,0 +1,149 @@
+import pandas as pd
+from pathlib import Path
+from Functions.logger import get_logger
+from Functions.atomic_file import atomic_open
+from Functions.columnar_converter import read_columnar
+from Functions.sdmx_structure import load_structure_message, metadata_available, metadata_file_for, find_data_structure, find_codelist, localised_name, STRUCTURE_NS
+
+logger = get_logger()
+
+# Suffix of the labelled copy written next to a compact '{agency}_{dataflow}_ALL.csv' file
+LABELLED_SUFFIX = "_labelled"
+
+def read_code_labels(metadata_file, language="en") -> dict:
+    """
+    Reads the labels of every coded dimension and attribute of a dataflow from its structure message.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file (or its manifest).
+        language (str): Preferred label language.
+    Returns:
+        dict: Component ID to (concept name, {code: label}) pairs.
+    """
+    root = load_structure_message(metadata_file)
+    structure = find_data_structure(root)
+    if structure is None:
+        return {}
+
+    # Index concepts by (agency, scheme id, scheme version, concept id)
+    concepts = {
+        (scheme.get("agencyID"), scheme.get("id"), scheme.get("version"), concept.get("id")): localised_name(concept, language)
+        for scheme in root.iter(f"{{{STRUCTURE_NS}}}ConceptScheme")
+        for concept in scheme.findall(f"{{{STRUCTURE_NS}}}Concept")
+    }
+
+    code_labels = {}
+    components = structure.findall(f".//{{{STRUCTURE_NS}}}DimensionList/{{{STRUCTURE_NS}}}Dimension")
+    components += structure.findall(f".//{{{STRUCTURE_NS}}}AttributeList/{{{STRUCTURE_NS}}}Attribute")
+    for component in components:
+        enumeration = component.find(f"{{{STRUCTURE_NS}}}LocalRepresentation/{{{STRUCTURE_NS}}}Enumeration/Ref")
+        if enumeration is None:
+            continue
+        codelist = find_codelist(root, enumeration)
+        if codelist is None:
+            continue
+        codes = {code.get("id"): localised_name(code, language) for code in codelist.findall(f"{{{STRUCTURE_NS}}}Code")}
+
+        concept_ref = component.find(f"{{{STRUCTURE_NS}}}ConceptIdentity/Ref")
+        concept_name = None
+        if concept_ref is not None:
+            concept_name = concepts.get((concept_ref.get("agencyID"), concept_ref.get("maintainableParentID"),
+                                         concept_ref.get("maintainableParentVersion"), concept_ref.get("id")))
+        code_labels[component.get("id")] = (concept_name or f"{component.get('id')} label", codes)
+    return code_labels
+
+def attach_labels(df, code_labels) -> pd.DataFrame:
+    """
+    Adds a label column after every coded column, like the 'csvfilewithlabels' format.
+    The lookup is a vectorised map; on categorical columns only the categories are mapped.
+    Args:
+        df (pd.DataFrame): Compact SDMX-CSV data.
+        code_labels (dict): Output of read_code_labels.
+    Returns:
+        pd.DataFrame: A copy of the data with label columns.
+    """
+    labelled = df.copy()
+    for column, (label_column, codes) in code_labels.items():
+        if column not in labelled.columns or label_column in labelled.columns:
+            continue
+        labels = labelled[column].map(codes)
+        labelled.insert(labelled.columns.get_loc(column) + 1, label_column, labels)
+    return labelled
+
+def labelled_file_name(csv_file) -> Path:
+    """
+    Returns the path of the labelled copy of a compact data file.
+    """
+    csv_file = Path(csv_file)
+    return csv_file.with_name(f"{csv_file.stem}{LABELLED_SUFFIX}{csv_file.suffix}")
+
+def read_labelled(data_file, metadata_file=None, language="en", columns=None) -> pd.DataFrame:
+    """
+    Loads a downloaded dataflow (CSV or columnar) with labels attached on read.
+    Args:
+        data_file (Path): The data file.
+        metadata_file (Path): Structure metadata (derived from the data file name by default).
+        language (str): Preferred label language.
+        columns (list): Columns to load (all by default).
+    Returns:
+        pd.DataFrame: The data with label columns.
+    """
+    data_file = Path(data_file)
+    metadata_file = metadata_file or metadata_file_for(data_file)
+    if data_file.suffix == ".csv":
+        df = pd.read_csv(data_file, dtype=str, usecols=columns)
+    else:
+        df = read_columnar(data_file, columns=columns)
+    return attach_labels(df, read_code_labels(metadata_file, language))
+
+def export_with_labels(csv_file, metadata_file, language="en", chunk_rows=200000) -> Path:
+    """
+    Writes a labelled copy of a compact CSV file, streaming it in chunks.
+    Args:
+        csv_file (Path): The compact '{agency}_{dataflow}_ALL.csv' file.
+        metadata_file (Path): Structure metadata of the dataflow.
+        language (str): Preferred label language.
+        chunk_rows (int): Rows processed per chunk.
+    Returns:
+        Path: The labelled file.
+    """
+    code_labels = read_code_labels(metadata_file, language)
+    output_file = labelled_file_name(csv_file)
+
+    with atomic_open(output_file, "w", newline="") as f:
+        # The header is written up front so a dataflow without observations still gets a labelled copy
+        attach_labels(pd.read_csv(csv_file, dtype=str, nrows=0), code_labels).to_csv(f, index=False)
+        for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+            attach_labels(chunk, code_labels).to_csv(f, header=False, index=False)
+    return output_file
+
+def run_label_export_stage(ctx) -> bool:
+    """
+    Pipeline stage: writes labelled copies of the compact CSV files downloaded in this run,
+    if labels are joined locally and exported.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    labels_config = ctx.config.get("LABELS", {})
+    if not (labels_config.get("JOIN_LOCALLY", False) and labels_config.get("EXPORT_WITH_LABELS", False)):
+        return True
+
+    language = labels_config.get("LANGUAGE", "en")
+    chunk_rows = labels_config.get("CHUNK_ROWS", 200000)
+    exported = 0
+    csv_files = [Path(path) for path in dict.fromkeys(ctx.downloaded_files) if Path(path).exists()]
+    for csv_file in csv_files:
+        metadata_file = metadata_file_for(csv_file)
+        if not metadata_available(metadata_file):
+            logger.warning(f"No structure metadata for {csv_file.name}; labels not exported.")
+            continue
+        try:
+            output_file = export_with_labels(csv_file, metadata_file, language, chunk_rows)
+            exported += 1
+            logger.info(f"Labelled copy written: {output_file}")
+        except Exception as e:
+            logger.error(f"Error attaching labels to {csv_file}: {e}")
+
+    logger.info(f"Exported {exported} of {len(csv_files)} files with labels.")
+    return True
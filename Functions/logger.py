@@ -1,35 +1,253 @@
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 
-def get_logger():
-    # Dynamically determine project root
-    current_dir = Path(__file__).resolve().parent
-    project_root = current_dir.parent
+LOGGER_NAME = "project_logger"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Used for any LOGGING setting missing from config.yaml
+DEFAULT_LOGGING_CONFIG = {
+    "LEVEL": "INFO",
+    "CONSOLE_LEVEL": "INFO",
+    "FILE_LEVEL": "INFO",
+    "FORMAT": "text",
+    "FILE_NAME": "job_execution.log",
+    "ROTATE_WHEN": "midnight",
+    "MAX_BYTES": 50 * 1024 * 1024,
+    "BACKUP_COUNT": 30,
+    "COMPRESS": True,
+}
+
+# Used until a RunContext passes the LOG_FOLDER of config.yaml
+DEFAULT_LOG_FOLDER = Path(__file__).resolve().parent.parent / "logs"
+
+# Handlers write from a background listener thread; callers only put records on a queue
+_listener = None
+_configure_lock = threading.Lock()
+
+# Set in pool worker processes whose records are forwarded to the parent process
+_forwarding = False
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "thread": record.threadName,
+            "process": record.process,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class RotatingLogFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    File handler rotating on a time interval and/or when the file reaches a size, optionally
+    gzip-compressing the rotated files and keeping at most backup_count of them.
+    """
+
+    def __init__(self, filename, when="midnight", max_bytes=0, backup_count=30, compress=True):
+        super().__init__(filename, when=when or "midnight", backupCount=backup_count, encoding="utf-8", delay=True)
+        self.rotate_on_time = bool(when)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.namer = self._unique_name
+        self.rotator = self._rotate
+
+    def shouldRollover(self, record):
+        if self.rotate_on_time and super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes:
+                return True
+        return False
+
+    def _unique_name(self, default_name):
+        # Several size-based rotations can happen within one time interval
+        extension = ".gz" if self.compress else ""
+        name, counter = f"{default_name}{extension}", 1
+        while os.path.exists(name):
+            name = f"{default_name}.{counter}{extension}"
+            counter += 1
+        return name
+
+    def _rotate(self, source, dest):
+        if not os.path.exists(source):
+            return
+        if self.compress:
+            with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(source)
+        else:
+            os.replace(source, dest)
+
+    def getFilesToDelete(self):
+        folder, base_name = os.path.split(self.baseFilename)
+        rotated = [os.path.join(folder, name) for name in os.listdir(folder) if name.startswith(base_name + ".")]
+        if len(rotated) <= self.backupCount:
+            return []
+        rotated.sort(key=os.path.getmtime)
+        return rotated[:len(rotated) - self.backupCount]
 
-    # Define log folder and log file path relative to project root
-    log_folder = project_root / "logs"
+def _configure(logger, logging_config=None, log_folder=None):
+    """
+    Attaches a QueueHandler to the logger and starts the listener that feeds the file and
+    console handlers from a background thread.
+    """
+    global _listener
+    logging_config = {**DEFAULT_LOGGING_CONFIG, **(logging_config or {})}
+    log_folder = Path(log_folder) if log_folder else DEFAULT_LOG_FOLDER
     log_folder.mkdir(parents=True, exist_ok=True)  # Create log folder if it doesn't exist
-    log_file = log_folder / f"job_execution_{datetime.now().strftime('%Y%m%d')}.log"
 
-    # Create a logger
-    logger = logging.getLogger("project_logger")
-    logger.setLevel(logging.INFO)
+    if str(logging_config["FORMAT"]).lower() == "json":
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = logging.Formatter(LOG_FORMAT)
 
-    # Avoid adding duplicate handlers
-    if not logger.hasHandlers():
-        # File Handler
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    file_handler = RotatingLogFileHandler(
+        log_folder / logging_config["FILE_NAME"],
+        when=logging_config["ROTATE_WHEN"],
+        max_bytes=int(logging_config["MAX_BYTES"] or 0),
+        backup_count=int(logging_config["BACKUP_COUNT"]),
+        compress=bool(logging_config["COMPRESS"]),
+    )
+    file_handler.setLevel(logging_config["FILE_LEVEL"])
+    file_handler.setFormatter(file_formatter)
 
-        # Console Handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging_config["CONSOLE_LEVEL"])
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 
-        # Add handlers to the logger
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+    log_queue = queue.SimpleQueue()
+    logger.setLevel(logging_config["LEVEL"])
+    logger.propagate = False
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def configure(logging_config, log_folder=None) -> None:
+    """
+    Reconfigures the project logger from the LOGGING section of the configuration, replacing the
+    defaults used before the configuration was loaded. Records already queued are written first.
+    Worker processes forwarding their records to the parent process are left unchanged.
+    Args:
+        logging_config (dict): The LOGGING section of config.yaml; missing settings use the defaults.
+        log_folder (Path): Folder of the log file (the project's 'logs' folder by default).
+    """
+    with _configure_lock:
+        if _forwarding:
+            return
+        logger = logging.getLogger(LOGGER_NAME)
+        _stop_listener()
+        logger.handlers.clear()
+        _configure(logger, logging_config, log_folder)
+
+def shutdown_logging() -> None:
+    """
+    Stops the listener after it has written every queued record. Runs automatically at exit.
+    """
+    with _configure_lock:
+        _stop_listener()
+
+def _reset_after_fork() -> None:
+    # The listener thread does not survive fork(); child processes configure their own
+    global _listener, _configure_lock, _forwarding
+    _listener = None
+    _configure_lock = threading.Lock()
+    _forwarding = False
+    logging.getLogger(LOGGER_NAME).handlers.clear()
+
+class _ParentHandler(logging.Handler):
+    """
+    Hands records received from child processes to the project logger of this process.
+    """
+
+    def __init__(self, logger):
+        super().__init__()
+        self.logger = logger
+
+    def emit(self, record):
+        self.logger.handle(record)
+
+def _forward_to_parent(log_queue, level) -> None:
+    """
+    Pool initializer: sends every record of the worker process to the parent through log_queue,
+    instead of the worker writing the log files itself.
+    """
+    global _listener, _forwarding
+    with _configure_lock:
+        if _listener is not None:
+            # Spawned workers configure logging while importing the project modules
+            _listener.stop()
+            _listener = None
+        _forwarding = True
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.handlers.clear()
+        logger.setLevel(level)
+        logger.propagate = False
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+@contextmanager
+def child_process_logging():
+    """
+    Forwards the records logged by worker processes to this process's log handlers. Records of
+    a forked worker would otherwise sit in its own listener queue and be lost when it exits.
+    Yields the initializer arguments to pass to the pool, e.g.:
+        with child_process_logging() as pool_logging, ProcessPoolExecutor(4, **pool_logging) as executor:
+    """
+    logger = get_logger()
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _ParentHandler(logger))
+    listener.start()
+    try:
+        yield {"initializer": _forward_to_parent, "initargs": (log_queue, logger.level)}
+    finally:
+        # Workers have exited here, so every record they sent is already in the queue
+        listener.stop()
+        log_queue.close()
+        log_queue.join_thread()
+
+def get_logger():
+    """
+    Returns the project logger, configuring it with the default settings on first use until
+    configure() is called with the LOGGING section of config.yaml.
+    Records are handed to a background thread, so logging never waits on file or console I/O.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if _listener is None and not _forwarding:
+        with _configure_lock:
+            if _listener is None and not _forwarding:
+                logger.handlers.clear()
+                _configure(logger)
     return logger
+
+atexit.register(shutdown_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,365 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# Dynamically add the project root to Python's module search path when run as a script
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from Functions.logger import get_logger, child_process_logging
+from Functions import metrics
+from Functions.run_context import RunContext
+from Functions.sdmx_structure import load_structure_message, find_data_structure, find_codelist, localised_name, STRUCTURE_NS
+
+logger = get_logger()
+
+# Structure metadata is saved as '{agency}_{dataflow}_metadata.xml', or as a manifest by the artefact store
+METADATA_SUFFIX = "_metadata.xml"
+MANIFEST_SUFFIX = "_metadata.refs.json"
+
+# Kinds of entries in the full-text search table
+DATAFLOW = "dataflow"
+DIMENSION = "dimension"
+CODELIST = "codelist"
+CODE = "code"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_files (
+    metadata_file TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS dataflows (
+    agency_id TEXT NOT NULL, dataflow_id TEXT NOT NULL, version TEXT, name TEXT,
+    dsd_agency_id TEXT, dsd_id TEXT, dsd_version TEXT, metadata_file TEXT NOT NULL,
+    PRIMARY KEY (agency_id, dataflow_id));
+CREATE TABLE IF NOT EXISTS dimensions (
+    agency_id TEXT NOT NULL, dataflow_id TEXT NOT NULL, dimension_id TEXT NOT NULL, position INTEGER,
+    concept_name TEXT, codelist_agency_id TEXT, codelist_id TEXT, codelist_version TEXT, metadata_file TEXT NOT NULL,
+    PRIMARY KEY (agency_id, dataflow_id, dimension_id));
+CREATE INDEX IF NOT EXISTS dimensions_by_id ON dimensions (dimension_id);
+CREATE TABLE IF NOT EXISTS codelists (
+    agency_id TEXT NOT NULL, codelist_id TEXT NOT NULL, version TEXT NOT NULL, name TEXT, content_hash TEXT,
+    PRIMARY KEY (agency_id, codelist_id, version));
+CREATE TABLE IF NOT EXISTS codes (
+    agency_id TEXT NOT NULL, codelist_id TEXT NOT NULL, version TEXT NOT NULL, code_id TEXT NOT NULL, name TEXT,
+    PRIMARY KEY (agency_id, codelist_id, version, code_id));
+CREATE INDEX IF NOT EXISTS codes_by_id ON codes (code_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+    kind UNINDEXED, agency_id UNINDEXED, artefact_id, version UNINDEXED, code_id, name, metadata_file UNINDEXED);
+"""
+
+def _ref_ids(ref) -> tuple:
+    """
+    Returns the (agency, id, version) of an SDMX Ref element, or Nones when it is missing.
+    """
+    if ref is None:
+        return None, None, None
+    return ref.get("agencyID"), ref.get("id"), ref.get("version")
+
+def parse_metadata_file(metadata_file, language="en") -> dict:
+    """
+    Parses a dataflow's structure message into rows for the index. Runs in worker processes,
+    so it only returns plain tuples.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file (or its manifest).
+        language (str): Preferred name language.
+    Returns:
+        dict: 'dataflows', 'dimensions', 'codelists' and 'codes' row lists.
+    """
+    root = load_structure_message(metadata_file)
+    rows = {"dataflows": [], "dimensions": [], "codelists": [], "codes": []}
+    dataflow = root.find(f".//{{{STRUCTURE_NS}}}Dataflow")
+    structure = find_data_structure(root)
+    if dataflow is None or structure is None:
+        return rows
+
+    agency_id, dataflow_id = dataflow.get("agencyID"), dataflow.get("id")
+    dsd_ref = _ref_ids(dataflow.find(f"{{{STRUCTURE_NS}}}Structure/Ref"))
+    rows["dataflows"].append((agency_id, dataflow_id, dataflow.get("version"), localised_name(dataflow, language), *dsd_ref))
+
+    concepts = {
+        (scheme.get("agencyID"), scheme.get("id"), scheme.get("version"), concept.get("id")): localised_name(concept, language)
+        for scheme in root.iter(f"{{{STRUCTURE_NS}}}ConceptScheme")
+        for concept in scheme.findall(f"{{{STRUCTURE_NS}}}Concept")
+    }
+
+    dimensions = structure.findall(f".//{{{STRUCTURE_NS}}}DimensionList/{{{STRUCTURE_NS}}}Dimension")
+    dimensions += structure.findall(f".//{{{STRUCTURE_NS}}}DimensionList/{{{STRUCTURE_NS}}}TimeDimension")
+    codelists = {}
+    for dimension in dimensions:
+        concept_ref = dimension.find(f"{{{STRUCTURE_NS}}}ConceptIdentity/Ref")
+        concept_name = None
+        if concept_ref is not None:
+            concept_name = concepts.get((concept_ref.get("agencyID"), concept_ref.get("maintainableParentID"),
+                                         concept_ref.get("maintainableParentVersion"), concept_ref.get("id")))
+
+        enumeration = dimension.find(f"{{{STRUCTURE_NS}}}LocalRepresentation/{{{STRUCTURE_NS}}}Enumeration/Ref")
+        codelist = find_codelist(root, enumeration) if enumeration is not None else None
+        codelist_ref = _ref_ids(codelist)
+        if codelist is not None:
+            codelists[codelist_ref] = codelist
+        rows["dimensions"].append((agency_id, dataflow_id, dimension.get("id"), int(dimension.get("position", 0)), concept_name, *codelist_ref))
+
+    for (cl_agency_id, codelist_id, version), codelist in codelists.items():
+        name = localised_name(codelist, language)
+        codes = [(code.get("id"), localised_name(code, language)) for code in codelist.findall(f"{{{STRUCTURE_NS}}}Code")]
+        # Non-final codelists can change under the same version; the hash tells when they did
+        content_hash = hashlib.sha1(json.dumps([name, codes]).encode("utf-8")).hexdigest()
+        rows["codelists"].append((cl_agency_id, codelist_id, version, name, content_hash))
+        rows["codes"].extend((cl_agency_id, codelist_id, version, code_id, code_name) for code_id, code_name in codes)
+    return rows
+
+def connect(index_file) -> sqlite3.Connection:
+    """
+    Opens the index, creating its tables on first use. WAL mode lets lookups run while it is updated.
+    """
+    Path(index_file).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(index_file)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    if "content_hash" not in [column[1] for column in conn.execute("PRAGMA table_info(codelists)")]:
+        # Indexes created before codelists were keyed on their content; they are re-indexed on first change
+        conn.execute("ALTER TABLE codelists ADD COLUMN content_hash TEXT")
+    return conn
+
+def _forget_file(conn, metadata_file) -> None:
+    """
+    Removes the dataflow and dimension rows indexed from a metadata file. Codelists are kept:
+    they are shared between dataflows and dropped once no dimension references them.
+    """
+    conn.execute("DELETE FROM dataflows WHERE metadata_file = ?", (metadata_file,))
+    conn.execute("DELETE FROM dimensions WHERE metadata_file = ?", (metadata_file,))
+    conn.execute("DELETE FROM search WHERE metadata_file = ?", (metadata_file,))
+    conn.execute("DELETE FROM indexed_files WHERE metadata_file = ?", (metadata_file,))
+
+def _forget_codelist(conn, codelist_key) -> None:
+    """
+    Removes a codelist version, its codes and their search entries.
+    """
+    agency_id, codelist_id, version = codelist_key
+    conn.execute("DELETE FROM codes WHERE agency_id = ? AND codelist_id = ? AND version = ?", codelist_key)
+    conn.execute("DELETE FROM codelists WHERE agency_id = ? AND codelist_id = ? AND version = ?", codelist_key)
+    # Search rows of shared codelists have no metadata file; find them through the full-text index
+    conn.execute(
+        "DELETE FROM search WHERE rowid IN (SELECT rowid FROM search WHERE search MATCH ? "
+        "AND kind IN (?, ?) AND agency_id = ? AND artefact_id = ? AND version = ?)",
+        ('artefact_id:"' + codelist_id.replace('"', '""') + '"', CODELIST, CODE, agency_id, codelist_id, version),
+    )
+
+def _drop_unreferenced_codelists(conn) -> None:
+    """
+    Removes the codelists no indexed dimension references any more.
+    """
+    unreferenced = conn.execute(
+        "SELECT agency_id, codelist_id, version FROM codelists c WHERE NOT EXISTS ("
+        "SELECT 1 FROM dimensions d WHERE d.codelist_agency_id = c.agency_id "
+        "AND d.codelist_id = c.codelist_id AND d.codelist_version = c.version)"
+    ).fetchall()
+    for codelist_key in unreferenced:
+        _forget_codelist(conn, codelist_key)
+
+def _store_rows(conn, metadata_file, stat, rows) -> None:
+    """
+    Replaces the rows of one metadata file in a single transaction. A codelist it references is
+    (re)indexed when it is new or its content differs from the indexed version.
+    """
+    with conn:
+        _forget_file(conn, metadata_file)
+        for row in rows["dataflows"]:
+            conn.execute("INSERT OR REPLACE INTO dataflows VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (*row, metadata_file))
+            conn.execute("INSERT INTO search VALUES (?, ?, ?, ?, NULL, ?, ?)", (DATAFLOW, row[0], row[1], row[2], row[3], metadata_file))
+        for row in rows["dimensions"]:
+            conn.execute("INSERT OR REPLACE INTO dimensions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (*row, metadata_file))
+            conn.execute("INSERT INTO search VALUES (?, ?, ?, NULL, ?, ?, ?)", (DIMENSION, row[0], row[1], row[2], row[4], metadata_file))
+
+        changed_codelists = set()
+        for row in rows["codelists"]:
+            codelist_key = row[:3]
+            indexed = conn.execute("SELECT content_hash FROM codelists WHERE agency_id = ? AND codelist_id = ? AND version = ?",
+                                   codelist_key).fetchone()
+            if indexed is not None and indexed[0] == row[4]:
+                continue
+            if indexed is not None:
+                _forget_codelist(conn, codelist_key)
+            changed_codelists.add(codelist_key)
+            conn.execute("INSERT INTO codelists VALUES (?, ?, ?, ?, ?)", row)
+            conn.execute("INSERT INTO search VALUES (?, ?, ?, ?, NULL, ?, NULL)", (CODELIST, *row[:4]))
+        codes = [row for row in rows["codes"] if row[:3] in changed_codelists]
+        conn.executemany("INSERT OR REPLACE INTO codes VALUES (?, ?, ?, ?, ?)", codes)
+        conn.executemany("INSERT INTO search VALUES (?, ?, ?, ?, ?, ?, NULL)", [(CODE, *row) for row in codes])
+        conn.execute("INSERT INTO indexed_files VALUES (?, ?, ?)", (metadata_file, stat.st_mtime_ns, stat.st_size))
+
+def find_metadata_files(output_folder) -> dict:
+    """
+    Lists the structure metadata in a folder, saved either as XML or as an artefact store manifest.
+    Returns:
+        dict: Metadata file path (as text) to the stat of the file actually on disk.
+    """
+    output_folder = Path(output_folder)
+    files = {}
+    for manifest_file in output_folder.glob(f"*{MANIFEST_SUFFIX}"):
+        metadata_file = manifest_file.with_name(manifest_file.name[:-len(MANIFEST_SUFFIX)] + METADATA_SUFFIX)
+        files[str(metadata_file)] = manifest_file.stat()
+    for metadata_file in output_folder.glob(f"*{METADATA_SUFFIX}"):
+        files[str(metadata_file)] = metadata_file.stat()
+    return files
+
+def update_index(index_file, output_folder, language="en", workers=4) -> int:
+    """
+    Brings the index up to date with the metadata files in a folder: new and modified files are
+    parsed in parallel worker processes, and rows of deleted files are removed.
+    Args:
+        index_file (Path): The SQLite index.
+        output_folder (Path): Folder holding the '{agency}_{dataflow}_metadata.xml' files.
+        language (str): Preferred name language.
+        workers (int): Number of parsing processes.
+    Returns:
+        int: Number of metadata files (re)indexed.
+    """
+    conn = connect(index_file)
+    try:
+        on_disk = find_metadata_files(output_folder)
+        indexed = {path: (mtime_ns, size) for path, mtime_ns, size in conn.execute("SELECT * FROM indexed_files")}
+
+        removed = indexed.keys() - on_disk.keys()
+        with conn:
+            for metadata_file in removed:
+                _forget_file(conn, metadata_file)
+            if removed:
+                _drop_unreferenced_codelists(conn)
+        pending = [path for path, stat in on_disk.items() if indexed.get(path) != (stat.st_mtime_ns, stat.st_size)]
+        if not pending:
+            return 0
+
+        logger.info(f"Indexing {len(pending)} metadata files with {workers} processes...")
+        updated = 0
+        with child_process_logging() as pool_logging, ProcessPoolExecutor(max_workers=workers, **pool_logging) as executor:
+            futures = {executor.submit(parse_metadata_file, path, language): path for path in pending}
+            for future in as_completed(futures):
+                metadata_file = futures[future]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    logger.error(f"Error parsing {metadata_file}: {e}")
+                    continue
+                _store_rows(conn, metadata_file, on_disk[metadata_file], rows)
+                updated += 1
+        with conn:
+            _drop_unreferenced_codelists(conn)
+        return updated
+    finally:
+        conn.close()
+
+def search(index_file, query, kind=None, limit=50) -> list:
+    """
+    Full-text search over dataflow, dimension, codelist and code IDs and names.
+    Args:
+        index_file (Path): The SQLite index.
+        query (str): FTS5 query, e.g. 'unemployment' or 'name:"gross domestic"'.
+        kind (str): Restrict results to 'dataflow', 'dimension', 'codelist' or 'code'.
+        limit (int): Maximum number of results.
+    Returns:
+        list: Matching entries as dicts, best matches first.
+    """
+    conn = connect(index_file)
+    conn.row_factory = sqlite3.Row
+    try:
+        sql = "SELECT kind, agency_id, artefact_id, version, code_id, name FROM search WHERE search MATCH ?"
+        params = [query]
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+def dataflows_using_dimension(index_file, dimension_id) -> list:
+    """
+    Lists the dataflows whose data structure has the given dimension.
+    Returns:
+        list: Dicts with the dataflow agency, ID, name and the dimension's codelist.
+    """
+    conn = connect(index_file)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            "SELECT f.agency_id, f.dataflow_id, f.name, d.codelist_id, d.codelist_version "
+            "FROM dimensions d JOIN dataflows f USING (agency_id, dataflow_id) "
+            "WHERE d.dimension_id = ? ORDER BY f.agency_id, f.dataflow_id",
+            (dimension_id,),
+        )
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def code_labels(index_file, code_id, codelist_id=None) -> list:
+    """
+    Looks up the meaning of a code, in every codelist holding it or in one codelist.
+    Returns:
+        list: Dicts with the codelist agency, ID, version, code and name.
+    """
+    conn = connect(index_file)
+    conn.row_factory = sqlite3.Row
+    try:
+        sql = "SELECT agency_id, codelist_id, version, code_id, name FROM codes WHERE code_id = ?"
+        params = [code_id]
+        if codelist_id:
+            sql += " AND codelist_id = ?"
+            params.append(codelist_id)
+        return [dict(row) for row in conn.execute(sql + " ORDER BY agency_id, codelist_id, version", params)]
+    finally:
+        conn.close()
+
+def run_metadata_index_stage(ctx) -> bool:
+    """
+    Pipeline stage: adds the structure metadata downloaded so far to the local search index.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    index_config = ctx.config.get("METADATA_INDEX", {})
+    if not index_config.get("ENABLED", False):
+        logger.info("Metadata indexing disabled.")
+        return True
+
+    try:
+        with metrics.timer("index_seconds"):
+            updated = update_index(
+                ctx.path("METADATA_INDEX_FILE"),
+                ctx.project_root / "output",
+                ctx.config.get("LABELS", {}).get("LANGUAGE", "en"),
+                index_config.get("WORKERS", 4),
+            )
+        metrics.increment("indexed_metadata_files", updated)
+        logger.info(f"Metadata index up to date ({updated} files indexed).")
+        return True
+    except Exception as e:
+        logger.error(f"Error updating the metadata index: {e}")
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Updates or queries the local index of downloaded structure metadata.")
+    parser.add_argument("--search", help="Full-text query over dataflow, dimension, codelist and code names")
+    parser.add_argument("--kind", choices=[DATAFLOW, DIMENSION, CODELIST, CODE], help="Restrict --search to one kind of entry")
+    parser.add_argument("--dimension", help="List the dataflows using this dimension ID")
+    parser.add_argument("--code", help="Show the labels of this code ID")
+    args = parser.parse_args()
+
+    ctx = RunContext()
+    index_file = ctx.path("METADATA_INDEX_FILE")
+    if args.search:
+        results = search(index_file, args.search, args.kind)
+    elif args.dimension:
+        results = dataflows_using_dimension(index_file, args.dimension)
+    elif args.code:
+        results = code_labels(index_file, args.code)
+    else:
+        ctx.config.setdefault("METADATA_INDEX", {})["ENABLED"] = True
+        sys.exit(0 if run_metadata_index_stage(ctx) else 1)
+
+    for result in results:
+        print("\t".join("" if value is None else str(value) for value in result.values()))
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from Functions.atomic_file import write_atomic
+
+# In-process registry of run metrics. Counters add up values (bytes, rows, requests); timers keep
+# the count, total and maximum of observed durations. Each metric series is identified by its
+# name and labels. Recording is a dictionary update under one lock, and a no-op when disabled.
+
+# Prefix of every metric name in the Prometheus textfile
+PROMETHEUS_PREFIX = "oecd_pipeline_"
+
+_enabled = True
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+_events = []
+_started_at = datetime.now(timezone.utc)
+
+def configure(metrics_config) -> None:
+    """
+    Applies the METRICS section of config.yaml.
+    Args:
+        metrics_config (dict): Settings; collection is on unless ENABLED is false.
+    """
+    global _enabled
+    _enabled = (metrics_config or {}).get("ENABLED", True)
+
+def reset() -> None:
+    """
+    Clears every metric, e.g. at the start of a run.
+    """
+    global _started_at
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _events.clear()
+        _started_at = datetime.now(timezone.utc)
+
+def _series(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def increment(name, value=1, **labels) -> None:
+    """
+    Adds a value to a counter.
+    Args:
+        name (str): Metric name, e.g. "download_bytes".
+        value (float): Amount to add.
+        **labels: Labels identifying the series, e.g. stage="data fetching".
+    """
+    if not _enabled:
+        return
+    key = _series(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels) -> None:
+    """
+    Records one duration in a timer.
+    Args:
+        name (str): Metric name, e.g. "stage_seconds".
+        seconds (float): Observed duration.
+        **labels: Labels identifying the series.
+    """
+    if not _enabled:
+        return
+    key = _series(name, labels)
+    with _lock:
+        count, total, maximum = _timers.get(key, (0, 0.0, 0.0))
+        _timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Times the enclosed block, including when it raises.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def record_event(kind, **fields) -> None:
+    """
+    Records one detailed event (e.g. a single download) for the JSON summary only, so that
+    per-dataflow details do not create a Prometheus series each.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _events.append({"kind": kind, **fields})
+
+def summary() -> dict:
+    """
+    Returns every metric collected since the last reset.
+    """
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in _counters.items()]
+        timers = [
+            {"name": name, "labels": dict(labels), "count": count, "sum": round(total, 6), "max": round(maximum, 6)}
+            for (name, labels), (count, total, maximum) in _timers.items()
+        ]
+        events = list(_events)
+    return {
+        "started_at": _started_at.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "counters": sorted(counters, key=lambda m: (m["name"], sorted(m["labels"].items()))),
+        "timers": sorted(timers, key=lambda m: (m["name"], sorted(m["labels"].items()))),
+        "events": events,
+    }
+
+def _prometheus_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def to_prometheus(run_summary) -> str:
+    """
+    Formats a summary in the Prometheus text exposition format (counters as '_total',
+    timers as '_count', '_sum' and '_max' series).
+    """
+    lines = []
+    typed = set()
+
+    def declare(metric, metric_type):
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} {metric_type}")
+
+    for counter in run_summary["counters"]:
+        metric = f"{PROMETHEUS_PREFIX}{counter['name']}_total"
+        declare(metric, "counter")
+        lines.append(f"{metric}{_prometheus_labels(counter['labels'])} {counter['value']}")
+    for timer_metric in run_summary["timers"]:
+        base = f"{PROMETHEUS_PREFIX}{timer_metric['name']}"
+        labels = _prometheus_labels(timer_metric["labels"])
+        declare(f"{base}_count", "counter")
+        lines.append(f"{base}_count{labels} {timer_metric['count']}")
+        declare(f"{base}_sum", "counter")
+        lines.append(f"{base}_sum{labels} {timer_metric['sum']}")
+        declare(f"{base}_max", "gauge")
+        lines.append(f"{base}_max{labels} {timer_metric['max']}")
+
+    finished = datetime.fromisoformat(run_summary["finished_at"]).timestamp()
+    declare(f"{PROMETHEUS_PREFIX}last_run_timestamp_seconds", "gauge")
+    lines.append(f"{PROMETHEUS_PREFIX}last_run_timestamp_seconds {finished}")
+    return "\n".join(lines) + "\n"
+
+def write_reports(ctx) -> None:
+    """
+    Writes the metrics of the run as a JSON summary (METRICS_FILE) and a Prometheus
+    textfile (PROMETHEUS_FILE).
+    Args:
+        ctx (RunContext): Shared run context.
+    """
+    if not _enabled:
+        return
+    run_summary = summary()
+    paths = ctx.config.get("PATHS", {})
+    if paths.get("METRICS_FILE"):
+        write_atomic(ctx.path("METRICS_FILE"), json.dumps(run_summary, indent=2))
+    if paths.get("PROMETHEUS_FILE"):
+        write_atomic(ctx.path("PROMETHEUS_FILE"), to_prometheus(run_summary))
@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from Functions.logger import get_logger
+from Functions import metrics
+from Functions.run_context import RunContext
+from Functions.api_downloader import get_host_semaphore, stream_to_file, load_changes, data_query_url
+from Functions.incremental_refresh import observation_key_columns
+from Functions.high_water_marks import record_high_water_mark, dataflow_key
+from Functions.sdmx_structure import read_dimension_ids, metadata_available, TIME_DIMENSION_ID
+from Functions.diff_engine import diff_tables, CHANGE_TYPE_COLUMN, CHANGED_FIELDS_COLUMN, NEW_INSERT, DELETED, UPDATED
+
+logger = get_logger()
+
+# Kind of run journal item recorded for each diffed dataflow
+JOURNAL_OBSERVATION_DIFF = "observation diff"
+
+# Output file written per change type: '{agency}_{dataflow}_{name}.parquet'
+CHANGE_FILES = {NEW_INSERT: "added", DELETED: "removed", UPDATED: "changed"}
+
+def _partition_csv(csv_file, columns, key_columns, partitions, folder, chunk_rows) -> None:
+    """
+    Streams a CSV file in chunks and splits its rows into Parquet partition files by the hash of
+    their observation key, so rows with the same key land in the same partition in both versions.
+    Every column is kept as text, and columns missing from the file are filled with ''.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    schema = pa.schema([pa.field(column, pa.string()) for column in columns])
+    writers = {}
+    try:
+        for chunk in pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+            chunk = chunk.reindex(columns=columns, fill_value="")
+            buckets = pd.util.hash_pandas_object(chunk[key_columns], index=False).to_numpy() % partitions
+            for bucket in np.unique(buckets):
+                if bucket not in writers:
+                    writers[bucket] = pq.ParquetWriter(folder / f"{bucket:05d}.parquet", schema)
+                table = pa.Table.from_pandas(chunk[buckets == bucket], schema=schema, preserve_index=False)
+                writers[bucket].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+def _read_partition(path, columns) -> pd.DataFrame:
+    """
+    Reads one partition file, or returns an empty frame when no row hashed to it.
+    """
+    if not path.exists():
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    return pq.read_table(path).to_pandas()
+
+def diff_observations(old_file, new_file, key_columns, output_prefix, partitions=32, chunk_rows=200000, compression="zstd") -> dict:
+    """
+    Diffs two versions of a dataflow's observations without loading either file whole.
+    Both files are hash-partitioned on the observation key into temporary Parquet files; each pair
+    of partitions (about 1/partitions of the data) is then diffed in memory with diff_tables.
+    Added and changed observations carry their new values, removed ones their old values, and
+    changed ones list the differing columns in Changed_Fields. Rows are sorted by key within each
+    partition only.
+    Args:
+        old_file (Path): Previously stored CSV copy of the dataflow.
+        new_file (Path): Freshly downloaded CSV copy.
+        key_columns (list): Columns identifying an observation (dimensions and TIME_PERIOD).
+        output_prefix (Path): Output files are '{output_prefix}_added.parquet', '_removed' and '_changed'.
+        partitions (int): Number of hash partitions; raise it for datasets far larger than RAM.
+        chunk_rows (int): Number of CSV rows read per chunk.
+        compression (str): Parquet compression codec of the output files.
+    Returns:
+        dict: Number of observations per change type.
+    """
+    old_columns = list(pd.read_csv(old_file, dtype=str, nrows=0).columns)
+    new_columns = list(pd.read_csv(new_file, dtype=str, nrows=0).columns)
+    columns = new_columns + [c for c in old_columns if c not in new_columns]
+    output_files = {change_type: Path(f"{output_prefix}_{name}.parquet") for change_type, name in CHANGE_FILES.items()}
+    output_files[UPDATED].parent.mkdir(parents=True, exist_ok=True)
+    counts = dict.fromkeys(CHANGE_FILES, 0)
+    writers = {}
+
+    try:
+        with tempfile.TemporaryDirectory(prefix=".observation_diff_", dir=output_files[UPDATED].parent) as temp_folder:
+            old_folder, new_folder = Path(temp_folder) / "old", Path(temp_folder) / "new"
+            _partition_csv(old_file, columns, key_columns, partitions, old_folder, chunk_rows)
+            _partition_csv(new_file, columns, key_columns, partitions, new_folder, chunk_rows)
+
+            for bucket in range(partitions):
+                name = f"{bucket:05d}.parquet"
+                if not (old_folder / name).exists() and not (new_folder / name).exists():
+                    continue
+                changes = diff_tables(_read_partition(old_folder / name, columns), _read_partition(new_folder / name, columns), key_columns)
+                for change_type, rows in changes.groupby(CHANGE_TYPE_COLUMN, sort=False):
+                    rows = rows.drop(columns=[CHANGE_TYPE_COLUMN] if change_type == UPDATED else [CHANGE_TYPE_COLUMN, CHANGED_FIELDS_COLUMN])
+                    table = pa.Table.from_pandas(rows, preserve_index=False).cast(pa.schema([pa.field(c, pa.string()) for c in rows.columns]))
+                    if change_type not in writers:
+                        part_file = output_files[change_type].with_name(output_files[change_type].name + ".part")
+                        writers[change_type] = pq.ParquetWriter(part_file, table.schema, compression=compression)
+                    writers[change_type].write_table(table)
+                    counts[change_type] += len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Replace the files of the previous diff; change types without observations get no file
+    for change_type, output_file in output_files.items():
+        part_file = output_file.with_name(output_file.name + ".part")
+        if change_type in writers:
+            os.replace(part_file, output_file)
+        else:
+            output_file.unlink(missing_ok=True)
+    return counts
+
+def diff_dataflow(ctx, agency_id, dataflow_id) -> bool:
+    """
+    Downloads an 'Updated' dataflow again, diffs it against the stored copy at observation level,
+    writes the added, removed and changed observations to output/observation_changes/, and
+    replaces the stored copy with the new download.
+    Args:
+        ctx (RunContext): Shared run context.
+        agency_id (str): Agency of the dataflow.
+        dataflow_id (str): ID of the dataflow.
+    Returns:
+        bool: True if the diff was written, False otherwise.
+    """
+    config = ctx.config
+    download_config = config.get("DOWNLOAD", {})
+    diff_config = config.get("OBSERVATION_DIFF", {})
+    output_folder = ctx.project_root / "output"
+    data_file = output_folder / f"{agency_id}_{dataflow_id}_ALL.csv"
+    new_file = output_folder / f"{agency_id}_{dataflow_id}_NEW.csv"
+    structure_file = output_folder / f"{agency_id}_{dataflow_id}_metadata.xml"
+
+    try:
+        url = data_query_url(config, agency_id, dataflow_id)
+        started_at = datetime.now(timezone.utc)
+        logger.info(f"Downloading data for observation diff from: {url}")
+        with get_host_semaphore(url, download_config.get("MAX_PER_HOST", 4)):
+            status_code = stream_to_file(url, new_file, download_config.get("CHUNK_SIZE", 1024 * 1024),
+                                         download_config.get("RESUME_ATTEMPTS", 3))
+        if status_code != 200:
+            logger.error(f"Failed to download data for observation diff: {url}, Status code: {status_code}")
+            return False
+
+        dimension_ids = read_dimension_ids(structure_file) if metadata_available(structure_file) else None
+        key_columns = observation_key_columns(pd.read_csv(new_file, dtype=str, nrows=0).columns, dimension_ids)
+        if TIME_DIMENSION_ID not in key_columns:
+            key_columns.append(TIME_DIMENSION_ID)
+
+        with metrics.timer("observation_diff_seconds"):
+            counts = diff_observations(
+                data_file,
+                new_file,
+                key_columns,
+                output_folder / "observation_changes" / f"{agency_id}_{dataflow_id}",
+                partitions=diff_config.get("PARTITIONS", 32),
+                chunk_rows=diff_config.get("CHUNK_ROWS", 200000),
+                compression=diff_config.get("COMPRESSION", "zstd"),
+            )
+
+        # The new download becomes the stored copy
+        os.replace(new_file, data_file)
+        record_high_water_mark(ctx.path("HIGH_WATER_MARKS_FILE"), agency_id, dataflow_id, started_at)
+        for change_type, count in counts.items():
+            metrics.increment("observation_changes", count, change_type=change_type)
+        logger.info(f"Observation diff for {agency_id},{dataflow_id}: {counts[NEW_INSERT]} added, "
+                    f"{counts[DELETED]} removed, {counts[UPDATED]} changed.")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error diffing observations of Dataflow ID: {dataflow_id}, Agency ID: {agency_id}: {e}")
+        return False
+    finally:
+        new_file.unlink(missing_ok=True)
+
+def run_observation_diff_stage(ctx) -> bool:
+    """
+    Pipeline stage: diffs the 'Updated' dataflows that are stored locally at observation level.
+    Dataflows diffed here are already up to date, so the incremental refresh skips them.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    try:
+        diff_config = ctx.config.get("OBSERVATION_DIFF", {})
+        if not diff_config.get("ENABLED", False):
+            logger.info("Observation diff disabled.")
+            return True
+
+        changes_df = load_changes(ctx)
+        if changes_df.empty:
+            logger.info("No changes to diff.")
+            return True
+
+        output_folder = ctx.project_root / "output"
+        updated = changes_df[changes_df["Change_Type"] == UPDATED]
+        targets = [
+            (agency_id, dataflow_id)
+            for agency_id, dataflow_id in zip(updated["Agency ID"], updated["Dataflow ID"])
+            if (output_folder / f"{agency_id}_{dataflow_id}_ALL.csv").exists()
+        ]
+        # Skip dataflows already diffed by the interrupted run being resumed
+        journal = ctx.journal
+        if journal is not None and journal.resumed:
+            finished = [target for target in targets if journal.item_done(JOURNAL_OBSERVATION_DIFF, dataflow_key(*target))]
+            for agency_id, dataflow_id in finished:
+                ctx.downloaded_files.append(output_folder / f"{agency_id}_{dataflow_id}_ALL.csv")
+            targets = [target for target in targets if target not in finished]
+        if not targets:
+            logger.info("No locally stored dataflows to diff.")
+            return True
+
+        workers = diff_config.get("WORKERS", 2)
+        logger.info(f"Diffing observations of {len(targets)} updated dataflows...")
+        diffed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(diff_dataflow, ctx, agency_id, dataflow_id): (agency_id, dataflow_id) for agency_id, dataflow_id in targets}
+            for future in as_completed(futures):
+                if future.result():
+                    diffed += 1
+                    agency_id, dataflow_id = futures[future]
+                    ctx.downloaded_files.append(output_folder / f"{agency_id}_{dataflow_id}_ALL.csv")
+                    if journal is not None:
+                        journal.complete_item(JOURNAL_OBSERVATION_DIFF, dataflow_key(agency_id, dataflow_id))
+
+        logger.info(f"Diffed {diffed} of {len(targets)} dataflows successfully.")
+        return True
+
+    except Exception as e:
+        logger.error(f"An error occurred during the observation diff: {e}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("Starting observation diff...")
+    run_observation_diff_stage(RunContext())
+    logger.info("Observation diff completed.")
@@ -0,0 +1,119 @@
+import pandas as pd
+from Functions.logger import get_logger
+from Functions import metrics
+from Functions.run_context import RunContext
+from Functions.run_journal import RunJournal
+from Functions.data_fetcher import run_fetch_stage
+from Functions.data_comparator import run_compare_stage
+from Functions.sharded_download import run_sharded_download_stage
+from Functions.metadata_index import run_metadata_index_stage
+from Functions.observation_diff import run_observation_diff_stage
+from Functions.incremental_refresh import run_refresh_stage
+from Functions.label_joiner import run_label_export_stage
+from Functions.columnar_converter import run_columnar_stage
+from Functions.snapshot_store import save_snapshot
+from Functions.change_history import history_enabled, record_context_run
+
+logger = get_logger()
+
+def run_baseline_stage(ctx) -> bool:
+    """
+    Pipeline stage: saves the fetched catalog as the baseline snapshot (OLD_FILE).
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    old_file = ctx.path("OLD_FILE")
+    if ctx.catalog is None:
+        logger.info(f"Dataflow catalog unchanged. Keeping existing baseline: {old_file}")
+        return True
+
+    save_snapshot(ctx.catalog, old_file)
+    if history_enabled(ctx):
+        record_context_run(ctx, pd.DataFrame(), force_base=True)
+    logger.info(f"Baseline file created successfully: {old_file}")
+    return True
+
+# Stages run by main.py: fetch the catalog, find changes, download new dataflows, index their
+# metadata, diff or refresh the updated ones already stored locally, then convert the new files
+# to columnar form
+PIPELINE_STAGES = [
+    ("data fetching", run_fetch_stage),
+    ("data comparison", run_compare_stage),
+    ("API data download", run_sharded_download_stage),
+    ("metadata indexing", run_metadata_index_stage),
+    ("observation diff", run_observation_diff_stage),
+    ("incremental refresh", run_refresh_stage),
+    ("label export", run_label_export_stage),
+    ("columnar conversion", run_columnar_stage),
+]
+
+# Stages run by base_run.py: fetch the catalog and store it as the first snapshot
+BASELINE_STAGES = [
+    ("data fetching", run_fetch_stage),
+    ("baseline creation", run_baseline_stage),
+]
+
+def run_stages(stages, ctx=None) -> bool:
+    """
+    Runs pipeline stages in order within the current process, sharing one run context.
+    Stops at the first stage that fails. The metrics of the run are written once it ends.
+    Progress is recorded in the run journal (RUN_JOURNAL_FILE), so a run that was interrupted or
+    failed resumes after its last completed stage and download the next time the same stages run.
+    Args:
+        stages (list): (name, stage function) pairs; each function takes the run context.
+        ctx (RunContext): Shared run context (created from config.yaml if omitted).
+    Returns:
+        bool: True if every stage succeeded, False otherwise.
+    """
+    ctx = ctx or RunContext()
+    metrics.reset()
+    if ctx.config.get("PATHS", {}).get("RUN_JOURNAL_FILE"):
+        ctx.journal = RunJournal(ctx.path("RUN_JOURNAL_FILE"))
+        if ctx.journal.start_run([name for name, _ in stages]):
+            logger.info(f"Resuming interrupted run {ctx.journal.run_id}.")
+
+    try:
+        for name, stage in stages:
+            if ctx.journal is not None and ctx.journal.stage_done(name):
+                logger.info(f"Skipping {name} job, completed before the interruption.")
+                continue
+
+            logger.info(f"Executing {name} job...")
+            try:
+                with metrics.timer("stage_seconds", stage=name):
+                    succeeded = stage(ctx)
+            except Exception as e:
+                logger.error(f"Error during {name} job: {e}", exc_info=True)
+                metrics.increment("stage_failures", stage=name)
+                return False
+
+            if not succeeded:
+                logger.error(f"The {name} job failed. Stopping the pipeline.")
+                metrics.increment("stage_failures", stage=name)
+                return False
+
+            if ctx.journal is not None:
+                ctx.journal.complete_stage(name)
+
+        if ctx.journal is not None:
+            ctx.journal.finish_run()
+        return True
+    finally:
+        try:
+            metrics.write_reports(ctx)
+        except Exception as e:
+            logger.warning(f"Could not write run metrics: {e}")
+
+def run_pipeline(ctx=None) -> bool:
+    """
+    Runs the regular fetch, compare and download workflow.
+    """
+    return run_stages(PIPELINE_STAGES, ctx)
+
+def run_baseline(ctx=None) -> bool:
+    """
+    Runs the first-time workflow that creates the baseline snapshot.
+    """
+    return run_stages(BASELINE_STAGES, ctx)
@@ -0,0 +1,94 @@
+import threading
+import time
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiting the rate of requests sent to the API.
+    The rate adapts to the server: it backs off multiplicatively when requests are throttled
+    (429) or slower than the target latency, and recovers additively while requests succeed.
+    """
+
+    # Multiplicative decrease applied on throttling and on slow responses
+    THROTTLE_FACTOR = 0.5
+    SLOW_FACTOR = 0.9
+
+    def __init__(self, initial_rate=2.0, min_rate=0.2, max_rate=10.0, burst=4, target_latency=30.0, increase_step=0.1):
+        """
+        Args:
+            initial_rate (float): Requests per second to start with.
+            min_rate (float): Lowest rate the limiter backs off to.
+            max_rate (float): Highest rate the limiter recovers to.
+            burst (int): Number of requests that may be sent back to back.
+            target_latency (float): Seconds to the response headers above which the rate is reduced.
+            increase_step (float): Requests per second added after each fast, successful request.
+        """
+        self.rate = float(initial_rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self.target_latency = float(target_latency)
+        self.increase_step = float(increase_step)
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, rate_limit_config):
+        """
+        Creates a limiter from the RATE_LIMIT section of config.yaml.
+        """
+        return cls(
+            initial_rate=rate_limit_config.get("INITIAL_RATE", 2.0),
+            min_rate=rate_limit_config.get("MIN_RATE", 0.2),
+            max_rate=rate_limit_config.get("MAX_RATE", 10.0),
+            burst=rate_limit_config.get("BURST", 4),
+            target_latency=rate_limit_config.get("TARGET_LATENCY", 30.0),
+            increase_step=rate_limit_config.get("INCREASE_STEP", 0.1),
+        )
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _throttle(self) -> None:
+        self.rate = max(self.min_rate, self.rate * self.THROTTLE_FACTOR)
+        self._tokens = min(self._tokens, 0)
+
+    def throttled(self) -> None:
+        """
+        Backs off after a 429 response, e.g. one that is about to be retried.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._throttle()
+
+    def record(self, status_code, latency) -> None:
+        """
+        Adapts the rate to the outcome of a request.
+        Args:
+            status_code (int): Final HTTP status of the request.
+            latency (float): Seconds until the response headers arrived (including retries).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if status_code == 429:
+                self._throttle()
+            elif latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate * self.SLOW_FACTOR)
+            elif status_code < 500:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
@@ -0,0 +1,75 @@
+from pathlib import Path
+from yaml import safe_load
+from Functions import http_client, logger, metrics
+
+# Project root is the folder containing config.yaml, one level above Functions/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+def load_config(config_path=None) -> dict:
+    """
+    Load the configuration file.
+    Args:
+        config_path (Path): Location of config.yaml (defaults to the project root).
+    Returns:
+        dict: Configuration data.
+    """
+    config_path = Path(config_path) if config_path else PROJECT_ROOT / "config.yaml"
+    if not config_path.exists():
+        raise FileNotFoundError(f"Configuration file not found at: {config_path}")
+
+    with open(config_path, "r") as f:
+        return safe_load(f)
+
+class RunContext:
+    """
+    State shared by the stages of a single pipeline run.
+    The configuration is loaded once, and each stage hands its output to the next one
+    through this object instead of through files on disk. A long-running service reuses one
+    context for many runs, calling new_run() before each.
+    """
+
+    def __init__(self, config=None, project_root=None):
+        self.project_root = Path(project_root) if project_root else PROJECT_ROOT
+        self.config = config if config is not None else load_config(self.project_root / "config.yaml")
+
+        # Every fetch path shares one pooled, rate-limited HTTP session configured from config.yaml
+        http_client.configure(self.config.get("HTTP", {}), self.config.get("RATE_LIMIT", {}))
+        metrics.configure(self.config.get("METRICS", {}))
+        logger.configure(self.config.get("LOGGING") or {},
+                         self.project_root / self.config.get("PATHS", {}).get("LOG_FOLDER", "logs"))
+
+        # Previous catalog snapshot kept in memory between runs of the service, with the
+        # modification time of the OLD_FILE it matches
+        self.previous_catalog = None
+        self.previous_catalog_mtime = None
+
+        self.new_run()
+
+    def new_run(self) -> None:
+        """
+        Clears the outputs of the previous run, keeping the configuration and the in-memory snapshot.
+        """
+        # Output of the fetch stage: the latest dataflow catalog, or None if it was not fetched.
+        # catalog_modified is False when the catalog endpoint reported no change since the last run.
+        self.catalog = None
+        self.catalog_modified = True
+
+        # Output of the compare stage: the changed dataflows, or None to load them from disk
+        self.changes = None
+
+        # Data files written by the download and refresh stages, for the stages that post-process them
+        self.downloaded_files = []
+
+        # (agency ID, dataflow ID, version) of the new dataflows the download stage could not download
+        self.failed_downloads = []
+
+        # Progress journal of the run, set by run_stages when RUN_JOURNAL_FILE is configured
+        self.journal = None
+
+    def path(self, key) -> Path:
+        """
+        Resolves one of the PATHS entries of config.yaml against the project root.
+        Args:
+            key (str): Name of the entry, e.g. "OLD_FILE".
+        """
+        return self.project_root / self.config["PATHS"][key]
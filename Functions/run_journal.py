@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from Functions.logger import get_logger
+
+logger = get_logger()
+
+class RunJournal:
+    """
+    Append-only journal of the progress of a pipeline run, so an interrupted run can resume.
+    Each record is one JSON line, flushed and fsynced before the work it records is considered
+    done. The journal holds a single run: it is cleared when a new run starts after a finished one.
+    Records:
+        run_started    - stages of the run
+        stage_done     - a stage completed
+        checkpoint     - a named step inside a stage completed (e.g. changes saved)
+        item_done      - one unit of work completed (e.g. one dataflow downloaded)
+        run_resumed    - an interrupted or failed run was started again
+        run_finished   - every stage completed
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = Path(journal_file)
+        self.run_id = None
+        self.resumed = False
+        # Number of times the run has been started, counting the first start
+        self.attempt = 1
+        self._stages = set()
+        self._checkpoints = set()
+        self._items = set()
+        self._lock = threading.Lock()
+
+    def _read(self) -> list:
+        """
+        Reads the journal records, ignoring a last line torn by a crash.
+        """
+        if not self.journal_file.exists():
+            return []
+        records = []
+        with open(self.journal_file, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def _append(self, record) -> None:
+        record = {"at": datetime.now(timezone.utc).isoformat(), **record}
+        with self._lock:
+            with open(self.journal_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start_run(self, stage_names) -> bool:
+        """
+        Resumes the unfinished run of the same stages, or starts a new run.
+        Args:
+            stage_names (list): Names of the stages about to run.
+        Returns:
+            bool: True if an interrupted run is resumed.
+        """
+        self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+        records = self._read()
+        started = next((r for r in records if r["event"] == "run_started"), None)
+        finished = any(r["event"] == "run_finished" for r in records)
+
+        if started is not None and not finished and started.get("stages") == list(stage_names):
+            self.run_id = started["run_id"]
+            self.resumed = True
+            self.attempt = 2 + sum(1 for r in records if r["event"] == "run_resumed")
+            for record in records:
+                if record["event"] == "stage_done":
+                    self._stages.add(record["stage"])
+                elif record["event"] == "checkpoint":
+                    self._checkpoints.add(record["name"])
+                elif record["event"] == "item_done":
+                    self._items.add((record["kind"], record["key"]))
+            self._append({"event": "run_resumed", "run_id": self.run_id})
+            return True
+
+        if started is not None and not finished:
+            logger.warning(f"Discarding unfinished run {started['run_id']} of different stages from the run journal.")
+
+        # Start a fresh journal for the new run
+        self.run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        self.resumed = False
+        self.attempt = 1
+        self.journal_file.unlink(missing_ok=True)
+        self._append({"event": "run_started", "run_id": self.run_id, "stages": list(stage_names)})
+        return False
+
+    def stage_done(self, stage) -> bool:
+        return stage in self._stages
+
+    def complete_stage(self, stage) -> None:
+        self._append({"event": "stage_done", "stage": stage})
+        self._stages.add(stage)
+
+    def has_checkpoint(self, name) -> bool:
+        return name in self._checkpoints
+
+    def checkpoint(self, name) -> None:
+        self._append({"event": "checkpoint", "name": name})
+        self._checkpoints.add(name)
+
+    def item_done(self, kind, key) -> bool:
+        return (kind, key) in self._items
+
+    def complete_item(self, kind, key) -> None:
+        """
+        Records one completed unit of work. Safe to call from worker threads.
+        Args:
+            kind (str): Type of work, e.g. "download".
+            key (str): Identity of the unit, e.g. "AGENCY,DATAFLOW,VERSION".
+        """
+        self._append({"event": "item_done", "kind": kind, "key": key})
+        with self._lock:
+            self._items.add((kind, key))
+
+    def finish_run(self) -> None:
+        self._append({"event": "run_finished", "run_id": self.run_id})
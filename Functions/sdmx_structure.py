@@ -0,0 +1,204 @@
+from lxml import etree
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+
+# SDMX-ML 2.1 namespaces used in structure messages
+MESSAGE_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message"
+STRUCTURE_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure"
+COMMON_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+TIME_DIMENSION_ID = "TIME_PERIOD"
+
+# Container element of each maintainable artefact class, in the order required by the
+# SDMX-ML 2.1 Structures schema
+STRUCTURE_CONTAINERS = [
+    ("OrganisationSchemes", {"AgencyScheme", "DataProviderScheme", "DataConsumerScheme", "OrganisationUnitScheme"}),
+    ("Dataflows", {"Dataflow"}),
+    ("CategorySchemes", {"CategoryScheme"}),
+    ("Categorisations", {"Categorisation"}),
+    ("Codelists", {"Codelist"}),
+    ("HierarchicalCodelists", {"HierarchicalCodelist"}),
+    ("Concepts", {"ConceptScheme"}),
+    ("DataStructures", {"DataStructure"}),
+    ("Constraints", {"ContentConstraint"}),
+]
+
+def manifest_path(metadata_file) -> Path:
+    """
+    Returns the reference manifest stored in place of a metadata file by the artefact store.
+    """
+    return Path(metadata_file).with_suffix(".refs.json")
+
+def metadata_file_for(data_file) -> Path:
+    """
+    Returns the structure metadata file belonging to an '{agency}_{dataflow}_ALL.*' data file.
+    """
+    data_file = Path(data_file)
+    return data_file.with_name(data_file.stem.removesuffix("_ALL") + "_metadata.xml")
+
+def metadata_available(metadata_file) -> bool:
+    """
+    Checks whether a dataflow's structure metadata exists, either as XML or as a reference manifest.
+    """
+    return Path(metadata_file).exists() or manifest_path(metadata_file).exists()
+
+def build_structure_message(artefacts):
+    """
+    Assembles an SDMX-ML structure message from stored artefacts.
+    Args:
+        artefacts (list): (artefact class, path of the file holding the artefact element) pairs.
+    Returns:
+        lxml.etree._Element: The message:Structure root element.
+    """
+    nsmap = {"message": MESSAGE_NS, "structure": STRUCTURE_NS, "common": COMMON_NS}
+    root = etree.Element(f"{{{MESSAGE_NS}}}Structure", nsmap=nsmap)
+
+    header = etree.SubElement(root, f"{{{MESSAGE_NS}}}Header")
+    etree.SubElement(header, f"{{{MESSAGE_NS}}}ID").text = "IREF_LOCAL"
+    etree.SubElement(header, f"{{{MESSAGE_NS}}}Test").text = "false"
+    etree.SubElement(header, f"{{{MESSAGE_NS}}}Prepared").text = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    etree.SubElement(header, f"{{{MESSAGE_NS}}}Sender", id="LOCAL")
+
+    structures = etree.SubElement(root, f"{{{MESSAGE_NS}}}Structures")
+    for container_name, classes in STRUCTURE_CONTAINERS:
+        files = [path for artefact_class, path in artefacts if artefact_class in classes]
+        if not files:
+            continue
+        container = etree.SubElement(structures, f"{{{STRUCTURE_NS}}}{container_name}")
+        for path in files:
+            container.append(etree.parse(str(path)).getroot())
+    return root
+
+def load_structure_message(metadata_file):
+    """
+    Loads a dataflow's structure message, rebuilding it from the artefact store when only a
+    reference manifest was saved.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file.
+    Returns:
+        lxml.etree._Element: The message:Structure root element.
+    """
+    metadata_file = Path(metadata_file)
+    if metadata_file.exists():
+        return etree.parse(str(metadata_file)).getroot()
+
+    manifest_file = manifest_path(metadata_file)
+    with open(manifest_file, "r") as f:
+        manifest = json.load(f)
+    artefacts = [(entry["class"], manifest_file.parent / entry["file"]) for entry in manifest["artefacts"]]
+    return build_structure_message(artefacts)
+
+def localised_name(element, language) -> str:
+    """
+    Returns the common:Name of an artefact in the requested language, falling back to the first name.
+    """
+    names = element.findall(f"{{{COMMON_NS}}}Name")
+    for name in names:
+        if name.get(XML_LANG) == language:
+            return name.text
+    return names[0].text if names else None
+
+def find_data_structure(root):
+    """
+    Returns the DataStructure element used by the dataflow in a structure message.
+    Falls back to the first DataStructure when the dataflow reference cannot be resolved.
+    """
+    structures = root.findall(f".//{{{STRUCTURE_NS}}}DataStructure")
+    if not structures:
+        return None
+
+    ref = root.find(f".//{{{STRUCTURE_NS}}}Dataflow/{{{STRUCTURE_NS}}}Structure/Ref")
+    if ref is not None:
+        for structure in structures:
+            if structure.get("id") == ref.get("id") and structure.get("agencyID") == ref.get("agencyID"):
+                return structure
+    return structures[0]
+
+def read_dimension_ids(metadata_file) -> list:
+    """
+    Reads the dimension IDs of a dataflow from its structure message, in key order,
+    followed by the time dimension.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file (or its manifest).
+    Returns:
+        list: Dimension IDs, empty if the message holds no data structure.
+    """
+    root = load_structure_message(metadata_file)
+    structure = find_data_structure(root)
+    if structure is None:
+        return []
+
+    dimensions = structure.findall(f".//{{{STRUCTURE_NS}}}DimensionList/{{{STRUCTURE_NS}}}Dimension")
+    dimensions.sort(key=lambda d: int(d.get("position", 0)))
+    dimension_ids = [d.get("id") for d in dimensions]
+
+    time_dimension = structure.find(f".//{{{STRUCTURE_NS}}}DimensionList/{{{STRUCTURE_NS}}}TimeDimension")
+    if time_dimension is not None:
+        dimension_ids.append(time_dimension.get("id"))
+    return dimension_ids
+
+def find_codelist(root, enumeration_ref):
+    """
+    Returns the Codelist element an enumeration reference points to.
+    Falls back to any stored version of the codelist when the referenced version is missing.
+    Args:
+        root (lxml.etree._Element): The structure message.
+        enumeration_ref (lxml.etree._Element): The Ref element of a LocalRepresentation/Enumeration.
+    Returns:
+        lxml.etree._Element: The Codelist, or None if the message does not hold it.
+    """
+    fallback = None
+    for codelist in root.iter(f"{{{STRUCTURE_NS}}}Codelist"):
+        if codelist.get("id") != enumeration_ref.get("id") or codelist.get("agencyID") != enumeration_ref.get("agencyID"):
+            continue
+        if codelist.get("version") == enumeration_ref.get("version"):
+            return codelist
+        fallback = fallback if fallback is not None else codelist
+    return fallback
+
+def read_dimension_codes(metadata_file) -> list:
+    """
+    Reads the codes each coded dimension of a dataflow can take, in key order.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file (or its manifest).
+    Returns:
+        list: (dimension ID, list of codes) pairs; dimensions without a codelist have no codes.
+    """
+    root = load_structure_message(metadata_file)
+    structure = find_data_structure(root)
+    if structure is None:
+        return []
+
+    dimensions = structure.findall(f".//{{{STRUCTURE_NS}}}DimensionList/{{{STRUCTURE_NS}}}Dimension")
+    dimensions.sort(key=lambda d: int(d.get("position", 0)))
+    dimension_codes = []
+    for dimension in dimensions:
+        enumeration = dimension.find(f"{{{STRUCTURE_NS}}}LocalRepresentation/{{{STRUCTURE_NS}}}Enumeration/Ref")
+        codelist = find_codelist(root, enumeration) if enumeration is not None else None
+        codes = [code.get("id") for code in codelist.findall(f"{{{STRUCTURE_NS}}}Code")] if codelist is not None else []
+        dimension_codes.append((dimension.get("id"), codes))
+    return dimension_codes
+
+def read_text_types(metadata_file) -> dict:
+    """
+    Reads the SDMX text type (e.g. 'Double', 'Integer', 'String') of every dimension, attribute
+    and measure of a dataflow that is represented by a text format rather than a codelist.
+    Args:
+        metadata_file (Path): The '{agency}_{dataflow}_metadata.xml' file (or its manifest).
+    Returns:
+        dict: Component ID to text type.
+    """
+    root = load_structure_message(metadata_file)
+    structure = find_data_structure(root)
+    if structure is None:
+        return {}
+
+    text_types = {}
+    for component in structure.iter(f"{{{STRUCTURE_NS}}}Dimension", f"{{{STRUCTURE_NS}}}TimeDimension",
+                                    f"{{{STRUCTURE_NS}}}Attribute", f"{{{STRUCTURE_NS}}}PrimaryMeasure"):
+        text_format = component.find(f"{{{STRUCTURE_NS}}}LocalRepresentation/{{{STRUCTURE_NS}}}TextFormat")
+        if text_format is not None and text_format.get("textType"):
+            text_types[component.get("id")] = text_format.get("textType")
+    return text_types
@@ -0,0 +1,474 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+import pandas as pd
+from Functions.logger import get_logger
+from Functions import metrics
+from Functions.atomic_file import write_atomic
+from Functions.snapshot_store import load_snapshot
+from Functions.api_downloader import download_new_inserts, new_insert_jobs, run_download_stage, downloads_incomplete, set_temp_tag
+from Functions.http_client import bytes_received, requests_in_flight
+
+logger = get_logger()
+
+# Ways of spreading the downloads over several workers (SHARDING.MODE)
+SHARD_BY_HASH = "hash"
+SHARD_BY_QUEUE = "queue"
+
+# States of a dataflow in the work queue
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    generation TEXT NOT NULL, agency_id TEXT NOT NULL, dataflow_id TEXT NOT NULL, version TEXT NOT NULL,
+    status TEXT NOT NULL, worker_id TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, updated_at REAL,
+    PRIMARY KEY (generation, agency_id, dataflow_id, version));
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (generation, status);
+"""
+
+def default_worker_id() -> str:
+    """
+    Returns an ID unique to this process across the hosts sharing the work queue.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def validate_shard(shard_index, shard_count) -> None:
+    """
+    Raises ValueError unless shard_index is one of the shard_count partitions.
+    """
+    if not isinstance(shard_index, int) or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard {shard_index} is not in 0 .. {shard_count - 1} (SHARDING.SHARD_COUNT = {shard_count})")
+
+def shard_of(agency_id, dataflow_id, shard_count) -> int:
+    """
+    Returns the shard a dataflow belongs to. The hash is stable across processes and hosts
+    (unlike hash()), so every worker computes the same partition.
+    """
+    digest = hashlib.sha1(f"{agency_id},{dataflow_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+class WorkQueue:
+    """
+    SQLite work queue of dataflows to download, shared by workers through a common folder.
+    A worker leases a batch of dataflows for lease_seconds and extends the lease with heartbeats
+    while its downloads progress; leases that expire (the worker crashed, hung or stalled) are
+    handed to another worker.
+    Every state change is a short IMMEDIATE transaction, so two workers never lease the same dataflow.
+    Jobs belong to a generation (a hash of the data_changes file they come from), so each run has its own queue.
+    """
+
+    def __init__(self, queue_file, lease_seconds=900, max_attempts=3):
+        self.queue_file = Path(queue_file)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.queue_file.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(QUEUE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Rollback journal rather than WAL: WAL needs shared memory, which network filesystems lack
+        return sqlite3.connect(self.queue_file, timeout=60, isolation_level=None)
+
+    def enqueue(self, generation, jobs) -> int:
+        """
+        Adds the jobs of a generation; jobs already queued are left as they are, so every worker may
+        enqueue the same changes. Every job of other generations is removed, including leased ones:
+        their workers find the lease gone when they finish.
+        Args:
+            generation (str): Identifier of the changes the jobs come from.
+            jobs (list): (agency ID, dataflow ID, version) tuples.
+        Returns:
+            int: Number of jobs added.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM jobs WHERE generation != ?", (generation,))
+                added = 0
+                for agency_id, dataflow_id, version in jobs:
+                    added += conn.execute(
+                        "INSERT OR IGNORE INTO jobs (generation, agency_id, dataflow_id, version, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (generation, agency_id, dataflow_id, str(version), PENDING, now),
+                    ).rowcount
+                conn.execute("COMMIT")
+                return added
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def claim(self, generation, worker_id, batch_size=1) -> list:
+        """
+        Leases up to batch_size pending jobs, or jobs whose lease expired, to a worker.
+        Jobs that already used max_attempts leases are marked failed instead.
+        Returns:
+            list: The leased (agency ID, dataflow ID, version) tuples.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = NULL, updated_at = ? "
+                    "WHERE generation = ? AND status = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, now, generation, LEASED, now, self.max_attempts),
+                )
+                rows = conn.execute(
+                    "SELECT agency_id, dataflow_id, version, status, worker_id FROM jobs "
+                    "WHERE generation = ? AND (status = ? OR (status = ? AND lease_expires < ?)) "
+                    "ORDER BY attempts, rowid LIMIT ?",
+                    (generation, PENDING, LEASED, now, batch_size),
+                ).fetchall()
+                for agency_id, dataflow_id, version, status, previous_worker in rows:
+                    if status == LEASED:
+                        logger.warning(f"Reclaiming expired lease of {agency_id},{dataflow_id} from worker {previous_worker}.")
+                        metrics.increment("reclaimed_leases")
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                        "WHERE generation = ? AND agency_id = ? AND dataflow_id = ? AND version = ?",
+                        (LEASED, worker_id, now + self.lease_seconds, now, generation, agency_id, dataflow_id, version),
+                    )
+                conn.execute("COMMIT")
+                return [(agency_id, dataflow_id, version) for agency_id, dataflow_id, version, _, _ in rows]
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, generation, worker_id) -> int:
+        """
+        Extends the leases held by a worker.
+        Returns:
+            int: Number of leases extended.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE generation = ? AND status = ? AND worker_id = ?",
+                (now + self.lease_seconds, now, generation, LEASED, worker_id),
+            ).rowcount
+
+    def finish(self, generation, worker_id, job, succeeded) -> bool:
+        """
+        Marks a leased job as done, or returns it to the queue (failed after max_attempts).
+        Nothing changes if the lease expired and was handed to another worker meanwhile.
+        Returns:
+            bool: True if the worker still held the lease.
+        """
+        agency_id, dataflow_id, version = job
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT attempts FROM jobs WHERE generation = ? AND agency_id = ? AND dataflow_id = ? AND version = ? "
+                    "AND status = ? AND worker_id = ?",
+                    (generation, agency_id, dataflow_id, str(version), LEASED, worker_id),
+                ).fetchone()
+                if row is not None:
+                    if succeeded:
+                        status = DONE
+                    else:
+                        status = FAILED if row[0] >= self.max_attempts else PENDING
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? "
+                        "WHERE generation = ? AND agency_id = ? AND dataflow_id = ? AND version = ?",
+                        (status, time.time(), generation, agency_id, dataflow_id, str(version)),
+                    )
+                conn.execute("COMMIT")
+                return row is not None
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def retry_failed(self, generation) -> int:
+        """
+        Returns the failed jobs of a generation to the queue with fresh attempts, e.g. when the
+        run that produced the generation is resumed.
+        Returns:
+            int: Number of jobs returned to the queue.
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, updated_at = ? WHERE generation = ? AND status = ?",
+                (PENDING, time.time(), generation, FAILED),
+            ).rowcount
+
+    def failed_jobs(self, generation) -> list:
+        """
+        Returns the (agency ID, dataflow ID, version) tuples of the failed jobs of a generation.
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT agency_id, dataflow_id, version FROM jobs WHERE generation = ? AND status = ? ORDER BY rowid",
+                                (generation, FAILED))
+            return rows.fetchall()
+
+    def counts(self, generation) -> dict:
+        """
+        Returns the number of jobs of a generation in each state.
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs WHERE generation = ? GROUP BY status", (generation,))
+            return {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0, **dict(rows.fetchall())}
+
+def _heartbeat_loop(queue, generation, worker_id, interval, stop) -> None:
+    """
+    Extends the worker's leases every interval seconds until stop is set, as long as the worker
+    makes progress: response bytes were received since the last beat, or a request is waiting
+    for its response (which the HTTP read timeout bounds), so slow queries and structure fetches
+    keep their leases. A worker that is alive but stuck stops renewing, so its leases expire and
+    other workers take the dataflows over.
+    """
+    last_received = bytes_received()
+    while not stop.wait(interval):
+        received = bytes_received()
+        if received == last_received and not requests_in_flight():
+            continue
+        last_received = received
+        try:
+            queue.heartbeat(generation, worker_id)
+        except Exception as e:
+            logger.warning(f"Heartbeat of worker {worker_id} failed: {e}")
+
+def load_changes_with_generation(ctx) -> tuple:
+    """
+    Loads the changes to download together with a hash of their content identifying the
+    generation. Both come from one copy of DATA_CHANGES_FILE, so a worker never pairs the rows
+    of one run with the generation of another when the coordinator replaces the file meanwhile.
+    Every worker loading the same file computes the same generation.
+    Args:
+        ctx (RunContext): Shared run context.
+    Returns:
+        tuple: (changes DataFrame, generation), or an empty DataFrame and None without changes.
+    """
+    if ctx.changes is not None and ctx.changes.empty:
+        return ctx.changes, None
+    data_changes_file = ctx.path("DATA_CHANGES_FILE")
+    if not data_changes_file.exists():
+        logger.info(f"No data changes file found: '{data_changes_file}'")
+        return pd.DataFrame(), None
+
+    with tempfile.TemporaryDirectory(prefix=".changes_") as temp_folder:
+        changes_copy = Path(temp_folder) / data_changes_file.name
+        shutil.copyfile(data_changes_file, changes_copy)
+        digest = hashlib.sha256()
+        with open(changes_copy, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        ctx.changes = load_snapshot(changes_copy)
+    return ctx.changes, digest.hexdigest()[:16]
+
+def work_queue(ctx, changes_df, generation, worker_id=None) -> int:
+    """
+    Downloads dataflows leased from the work queue until none are left. The 'New Insert' records
+    of the changes are enqueued first (a no-op when another worker already did), so the
+    coordinator and any number of download_worker.py processes can work the same queue.
+    A worker whose queue is empty keeps polling while other workers hold leases, so it picks up
+    their dataflows if their leases expire. Once the queue is worked through, ctx.failed_downloads
+    holds the jobs no worker could download; a resumed run returns them to the queue first.
+    Args:
+        ctx (RunContext): Shared run context.
+        changes_df (pd.DataFrame): Changed dataflows produced by the compare stage.
+        generation (str): Identifier of the changes (see load_changes_with_generation).
+        worker_id (str): ID of this worker (host name and process ID if omitted).
+    Returns:
+        int: Number of dataflows downloaded by this worker.
+    """
+    sharding_config = ctx.config.get("SHARDING", {})
+    worker_id = worker_id or default_worker_id()
+    set_temp_tag(worker_id)
+    batch_size = sharding_config.get("BATCH_SIZE", 4)
+    poll_seconds = sharding_config.get("POLL_SECONDS", 15)
+    queue = WorkQueue(ctx.path("WORK_QUEUE_FILE"), sharding_config.get("LEASE_SECONDS", 900), sharding_config.get("MAX_ATTEMPTS", 3))
+    output_folder = ctx.project_root / "output"
+
+    if not changes_df.empty:
+        added = queue.enqueue(generation, new_insert_jobs(changes_df))
+        logger.info(f"Worker {worker_id}: {added} dataflows added to the work queue.")
+    if ctx.journal is not None and ctx.journal.resumed:
+        retried = queue.retry_failed(generation)
+        if retried:
+            logger.info(f"Worker {worker_id}: {retried} failed dataflows returned to the work queue.")
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_loop, name="lease-heartbeat", daemon=True,
+                                 args=(queue, generation, worker_id, sharding_config.get("HEARTBEAT_SECONDS", 60), stop))
+    heartbeat.start()
+    downloaded = 0
+    try:
+        while True:
+            batch = queue.claim(generation, worker_id, batch_size)
+            if not batch:
+                counts = queue.counts(generation)
+                if counts[LEASED] == 0:
+                    break
+                logger.info(f"Worker {worker_id}: waiting for {counts[LEASED]} dataflows leased by other workers...")
+                time.sleep(poll_seconds)
+                continue
+
+            logger.info(f"Worker {worker_id}: leased {len(batch)} dataflows.")
+            first_new = len(ctx.downloaded_files)
+            leased = set(batch)
+            download_new_inserts(ctx, changes_df, job_filter=lambda job: (job[0], job[1], str(job[2])) in leased)
+            completed = set(ctx.downloaded_files[first_new:])
+            for job in batch:
+                data_file = output_folder / f"{job[0]}_{job[1]}_ALL.csv"
+                succeeded = data_file in completed
+                if not queue.finish(generation, worker_id, job, succeeded):
+                    logger.warning(f"Worker {worker_id}: lease of {job[0]},{job[1]} was reclaimed before it finished.")
+                elif succeeded:
+                    # Still the lease holder: temporary files of this dataflow are left over from
+                    # workers that lost its lease
+                    for stale_file in output_folder.glob(f"{data_file.name}.*"):
+                        stale_file.unlink(missing_ok=True)
+                downloaded += succeeded
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    ctx.failed_downloads = queue.failed_jobs(generation)
+    counts = queue.counts(generation)
+    logger.info(f"Worker {worker_id}: downloaded {downloaded} dataflows. Queue: {counts[DONE]} done, {counts[FAILED]} failed.")
+    return downloaded
+
+def _shard_marker(marker_folder, generation, shard_index) -> Path:
+    return Path(marker_folder) / f"{generation}_shard{shard_index}.json"
+
+def mark_shard_done(marker_folder, generation, shard_index, worker_id, jobs, downloaded, failed) -> None:
+    """
+    Records in the shared folder that a shard of a generation has been worked through, and
+    removes the markers of other generations.
+    Args:
+        marker_folder (Path): Folder shared by the workers.
+        generation (str): Identifier of the changes.
+        shard_index (int): The finished shard.
+        worker_id (str): ID of the worker that downloaded the shard.
+        jobs (int): Number of dataflows in the shard.
+        downloaded (int): Number of them downloaded by this attempt of the run.
+        failed (int): Number of them that could not be downloaded.
+    """
+    marker_folder = Path(marker_folder)
+    marker_folder.mkdir(parents=True, exist_ok=True)
+    for stale in marker_folder.glob("*_shard*.json"):
+        if not stale.name.startswith(f"{generation}_"):
+            stale.unlink(missing_ok=True)
+
+    marker = _shard_marker(marker_folder, generation, shard_index)
+    write_atomic(marker, json.dumps({"generation": generation, "shard": shard_index, "worker_id": worker_id,
+                                     "jobs": jobs, "downloaded": downloaded, "failed": failed,
+                                     "finished_at": time.time()}))
+
+def wait_for_shards(marker_folder, generation, shard_count, timeout, poll_seconds) -> list:
+    """
+    Waits until every shard of a generation has a done marker, or timeout seconds passed.
+    Args:
+        marker_folder (Path): Folder shared by the workers.
+        generation (str): Identifier of the changes.
+        shard_count (int): Number of shards.
+        timeout (float): Seconds to wait at most.
+        poll_seconds (float): Seconds between checks.
+    Returns:
+        list: Markers of the finished shards (dicts), in shard order.
+    Raises:
+        TimeoutError: If some shards are still unfinished after timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        missing = [i for i in range(shard_count) if not _shard_marker(marker_folder, generation, i).exists()]
+        if not missing:
+            break
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Shards {', '.join(map(str, missing))} of {shard_count} did not finish within {timeout}s")
+        logger.info(f"Waiting for shards {', '.join(map(str, missing))} to finish...")
+        time.sleep(poll_seconds)
+
+    markers = []
+    for i in range(shard_count):
+        with open(_shard_marker(marker_folder, generation, i), "r") as f:
+            markers.append(json.load(f))
+    return markers
+
+def hash_shard(ctx, changes_df, generation, shard_index, worker_id=None) -> int:
+    """
+    Downloads the hash partition of one worker and marks it done in SHARD_MARKER_FOLDER.
+    Args:
+        ctx (RunContext): Shared run context.
+        changes_df (pd.DataFrame): Changed dataflows produced by the compare stage.
+        generation (str): Identifier of the changes (see load_changes_with_generation).
+        shard_index (int): Partition to download.
+        worker_id (str): ID of this worker, recorded in the marker.
+    Returns:
+        int: Number of dataflows downloaded.
+    """
+    shard_count = ctx.config.get("SHARDING", {}).get("SHARD_COUNT", 1)
+    validate_shard(shard_index, shard_count)
+    in_shard = lambda job: shard_of(job[0], job[1], shard_count) == shard_index
+    jobs = sum(1 for job in new_insert_jobs(changes_df) if in_shard(job))
+
+    logger.info(f"Downloading shard {shard_index} of {shard_count} ({jobs} dataflows)...")
+    downloaded = download_new_inserts(ctx, changes_df, job_filter=in_shard)
+    mark_shard_done(ctx.path("SHARD_MARKER_FOLDER"), generation, shard_index, worker_id or default_worker_id(),
+                    jobs, downloaded, len(ctx.failed_downloads))
+    return downloaded
+
+def run_sharded_download_stage(ctx, worker_id=None, shard_index=None) -> bool:
+    """
+    Pipeline stage: downloads the new dataflows found by the compare stage, either all of them
+    (SHARDING.MODE none), the hash partition of this worker (hash), or those leased from the
+    shared work queue (queue).
+    In hash mode the coordinator (no shard_index given) then waits for the other shards, so the
+    stages after it see every dataflow; the stage fails if a shard does not finish within
+    SHARDING.BARRIER_SECONDS. Like run_download_stage, the stage fails when dataflows could not
+    be downloaded (in this worker's shard, in any shard for the coordinator, or by any worker
+    in queue mode), so the run is resumed and downloads them again.
+    Args:
+        ctx (RunContext): Shared run context.
+        worker_id (str): ID of this worker.
+        shard_index (int): Partition downloaded by a hash mode worker (the coordinator downloads
+            SHARDING.SHARD_INDEX).
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    sharding_config = ctx.config.get("SHARDING", {})
+    mode = sharding_config.get("MODE")
+    if mode not in (SHARD_BY_HASH, SHARD_BY_QUEUE):
+        return run_download_stage(ctx)
+
+    try:
+        changes_df, generation = load_changes_with_generation(ctx)
+        if changes_df.empty:
+            logger.info("No changes to download.")
+            return True
+        if mode == SHARD_BY_QUEUE:
+            work_queue(ctx, changes_df, generation, worker_id)
+            return not downloads_incomplete(ctx, len(ctx.failed_downloads))
+
+        coordinator = shard_index is None
+        shard_index = sharding_config.get("SHARD_INDEX", 0) if coordinator else shard_index
+        hash_shard(ctx, changes_df, generation, shard_index, worker_id)
+        if not coordinator:
+            return not downloads_incomplete(ctx, len(ctx.failed_downloads))
+
+        markers = wait_for_shards(ctx.path("SHARD_MARKER_FOLDER"), generation, sharding_config.get("SHARD_COUNT", 1),
+                                  sharding_config.get("BARRIER_SECONDS", 3600), sharding_config.get("POLL_SECONDS", 15))
+        for marker in markers:
+            if marker["failed"]:
+                logger.warning(f"Shard {marker['shard']} ({marker['worker_id']}) failed to download {marker['failed']} "
+                               f"of {marker['jobs']} dataflows.")
+        failed = sum(m["failed"] for m in markers)
+        logger.info(f"All {len(markers)} shards finished: {sum(m['jobs'] for m in markers) - failed} of "
+                    f"{sum(m['jobs'] for m in markers)} dataflows downloaded.")
+        return not downloads_incomplete(ctx, failed)
+
+    except Exception as e:
+        logger.error(f"An error occurred during the sharded download: {e}")
+        return False
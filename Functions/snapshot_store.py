@@ -0,0 +1,101 @@
+import pandas as pd
+import sqlite3
+import os
+import time
+from pathlib import Path
+from Functions import metrics
+
+# File suffixes handled by each snapshot backend
+PARQUET_SUFFIXES = {".parquet"}
+FEATHER_SUFFIXES = {".feather", ".arrow"}
+SQLITE_SUFFIXES = {".sqlite", ".db"}
+EXCEL_SUFFIXES = {".xlsx"}
+
+SQLITE_TABLE = "snapshot"
+
+def _legacy_excel_path(path):
+    """
+    Returns the Excel file a snapshot was stored in before the columnar backends were introduced.
+    """
+    return path.with_suffix(".xlsx")
+
+def snapshot_exists(path) -> bool:
+    """
+    Checks whether a snapshot exists at the given path, or as a legacy Excel file next to it.
+    Args:
+        path (Path): Snapshot path from config.yaml.
+    """
+    path = Path(path)
+    return path.exists() or _legacy_excel_path(path).exists()
+
+def load_snapshot(path) -> pd.DataFrame:
+    """
+    Loads a snapshot DataFrame, choosing the backend from the file suffix.
+    Falls back to a legacy '.xlsx' file with the same name so existing workspaces keep working.
+    Args:
+        path (Path): Snapshot path from config.yaml.
+    Returns:
+        pd.DataFrame: The stored snapshot.
+    """
+    path = Path(path)
+    if not path.exists() and _legacy_excel_path(path).exists():
+        path = _legacy_excel_path(path)
+
+    suffix = path.suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        return pd.read_parquet(path)
+    if suffix in FEATHER_SUFFIXES:
+        return pd.read_feather(path)
+    if suffix in SQLITE_SUFFIXES:
+        with sqlite3.connect(path) as conn:
+            return pd.read_sql_query(f"SELECT * FROM {SQLITE_TABLE}", conn)
+    if suffix in EXCEL_SUFFIXES:
+        return pd.read_excel(path)
+    raise ValueError(f"Unsupported snapshot format: {path}")
+
+def save_snapshot(df, path) -> None:
+    """
+    Saves a snapshot DataFrame, choosing the backend from the file suffix.
+    The file is written under a temporary name and renamed, so a crash never leaves a partial snapshot.
+    Args:
+        df (pd.DataFrame): Snapshot to store.
+        path (Path): Snapshot path from config.yaml.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    df = df.reset_index(drop=True)
+
+    suffix = path.suffix.lower()
+    started = time.perf_counter()
+    if suffix in PARQUET_SUFFIXES:
+        df.to_parquet(tmp_path, index=False)
+    elif suffix in FEATHER_SUFFIXES:
+        df.to_feather(tmp_path)
+    elif suffix in SQLITE_SUFFIXES:
+        tmp_path.unlink(missing_ok=True)
+        with sqlite3.connect(tmp_path) as conn:
+            df.to_sql(SQLITE_TABLE, conn, index=False)
+        conn.close()
+    elif suffix in EXCEL_SUFFIXES:
+        df.to_excel(tmp_path, index=False, engine="openpyxl")
+    else:
+        raise ValueError(f"Unsupported snapshot format: {path}")
+
+    os.replace(tmp_path, path)
+    metrics.observe("write_seconds", time.perf_counter() - started, format=suffix.lstrip("."))
+    metrics.increment("write_bytes", path.stat().st_size, format=suffix.lstrip("."))
+    metrics.increment("write_rows", len(df), format=suffix.lstrip("."))
+
+def export_excel(df, path) -> Path:
+    """
+    Writes a human-readable Excel copy of a snapshot next to it.
+    Args:
+        df (pd.DataFrame): Snapshot to export.
+        path (Path): Snapshot path; the export uses the same name with an '.xlsx' suffix.
+    Returns:
+        Path: The exported Excel file.
+    """
+    excel_path = Path(path).with_suffix(".xlsx")
+    df.to_excel(excel_path, index=False)
+    return excel_path
@@ -0,0 +1,190 @@
+import argparse
+import copy
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Dynamically add the project root to Python's module search path
+project_root = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(project_root))
+
+from Functions.run_context import RunContext, load_config
+from Functions.pipeline import PIPELINE_STAGES, BASELINE_STAGES, run_stages
+from benchmarks.stub_server import serve
+
+# Seconds between two memory samples taken while a stage runs
+RSS_SAMPLE_SECONDS = 0.01
+
+def _rss_bytes(pid="self"):
+    """
+    Current resident set size of a process in bytes, read from /proc (None if unavailable).
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size over the lifetime of this process and of its finished child processes, in MB.
+    Used where /proc is not available to sample the current size.
+    """
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, KB on Linux
+    return max(self_peak, children_peak) / divisor
+
+class RssSampler:
+    """
+    Samples the resident set size of this process and of its live worker processes in a background
+    thread while a stage runs, so each stage reports its own peak rather than the lifetime maximum.
+    Pages a forked worker still shares with this process count in both, so pool stages report an upper bound.
+    """
+    def __init__(self, exclude_pids=()):
+        self.exclude_pids = set(exclude_pids)
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        current = _rss_bytes()
+        if current is None:
+            return
+        for child in multiprocessing.active_children():
+            if child.pid not in self.exclude_pids:
+                current += _rss_bytes(child.pid) or 0
+        self.peak = max(self.peak, current)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def peak_mb(self) -> float:
+        return self.peak / (1024 * 1024) if self.peak else peak_rss_mb()
+
+def stub_config(config, base_url) -> dict:
+    """
+    Returns a copy of the configuration with every API endpoint pointed at the stub server
+    and retry backoff shortened so injected errors do not dominate the timings.
+    """
+    config = copy.deepcopy(config)
+    for key, url in config["API"].items():
+        config["API"][key] = url.replace("https://sdmx.oecd.org", base_url)
+    config.setdefault("HTTP", {})["BACKOFF_FACTOR"] = 0.05
+    return config
+
+def timed_stages(stages, results, cycle, bytes_served, exclude_pids=()):
+    """
+    Wraps pipeline stages so each records its wall time, peak RSS and bytes received.
+    The stub server's process (exclude_pids) is left out of the memory samples.
+    """
+    def wrap(name, stage):
+        def timed(ctx):
+            bytes_before = bytes_served.value
+            started = time.perf_counter()
+            succeeded = False
+            sampler = RssSampler(exclude_pids)
+            try:
+                with sampler:
+                    succeeded = stage(ctx)
+                return succeeded
+            finally:
+                elapsed = time.perf_counter() - started
+                received = bytes_served.value - bytes_before
+                results.append({
+                    "cycle": cycle,
+                    "stage": name,
+                    "succeeded": bool(succeeded),
+                    "wall_time_s": round(elapsed, 3),
+                    "peak_rss_mb": round(sampler.peak_mb(), 1),
+                    "bytes_received": received,
+                    "throughput_mb_s": round(received / elapsed / 1e6, 2) if elapsed > 0 else 0.0,
+                })
+        return timed
+    return [(name, wrap(name, stage)) for name, stage in stages]
+
+def print_report(results) -> None:
+    print(f"{'cycle':<10}{'stage':<24}{'ok':<5}{'wall s':>9}{'peak RSS MB':>13}{'MB recv':>10}{'MB/s':>8}")
+    for row in results:
+        print(f"{row['cycle']:<10}{row['stage']:<24}{'yes' if row['succeeded'] else 'NO':<5}{row['wall_time_s']:>9.3f}"
+              f"{row['peak_rss_mb']:>13.1f}{row['bytes_received'] / 1e6:>10.2f}{row['throughput_mb_s']:>8.2f}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Runs the pipeline end to end against a local SDMX stub server.")
+    parser.add_argument("--dataflows", type=int, default=200, help="Dataflows in the baseline catalog")
+    parser.add_argument("--new", type=int, default=20, help="Dataflows added per catalog generation")
+    parser.add_argument("--updated", type=int, default=10, help="Dataflows updated per catalog generation")
+    parser.add_argument("--rows", type=int, default=5000, help="Typical observations per dataflow")
+    parser.add_argument("--dimensions", type=int, default=4, help="Dimensions per dataflow")
+    parser.add_argument("--cycles", type=int, default=2, help="Pipeline runs after the baseline run")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean seconds added to each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--recordings", help="Folder of recorded responses served instead of synthetic ones")
+    parser.add_argument("--config", help="config.yaml to benchmark (defaults to the project's)")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    api_options = {
+        "dataflows": args.dataflows,
+        "new_per_generation": args.new,
+        "updated_per_generation": args.updated,
+        "rows": args.rows,
+        "dimensions": args.dimensions,
+    }
+    port_queue = multiprocessing.Queue()
+    generation = multiprocessing.Value("i", 0)
+    bytes_served = multiprocessing.Value("q", 0)
+    requests_served = multiprocessing.Value("q", 0)
+    server = multiprocessing.Process(
+        target=serve, daemon=True,
+        args=(port_queue, generation, bytes_served, requests_served, api_options, args.latency, args.error_rate, args.recordings),
+    )
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+    results = []
+    started = time.perf_counter()
+    try:
+        with tempfile.TemporaryDirectory(prefix="oecd_benchmark_") as work_dir:
+            config = stub_config(load_config(args.config), base_url)
+            ctx = RunContext(config=config, project_root=work_dir)
+            run_stages(timed_stages(BASELINE_STAGES, results, "baseline", bytes_served, [server.pid]), ctx)
+
+            for cycle in range(1, args.cycles + 1):
+                generation.value = cycle
+                ctx = RunContext(config=config, project_root=work_dir)
+                run_stages(timed_stages(PIPELINE_STAGES, results, f"run {cycle}", bytes_served, [server.pid]), ctx)
+    finally:
+        server.terminate()
+        server.join()
+
+    total = time.perf_counter() - started
+    print_report(results)
+    print(f"Total {total:.2f} s, {requests_served.value} requests, {bytes_served.value / 1e6:.2f} MB served, "
+          f"peak stage RSS {max((row['peak_rss_mb'] for row in results), default=0.0):.1f} MB")
+
+    if args.json:
+        summary = {"options": vars(args), "total_wall_time_s": round(total, 3),
+                   "requests": requests_served.value, "bytes_served": bytes_served.value, "stages": results}
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0 if all(row["succeeded"] for row in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import hashlib
+import random
+import re
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+
+# Local stand-in for the OECD SDMX REST API. It serves a synthetic dataflow catalog, data and
+# structure messages (or recorded responses) with configurable sizes, latency and error rate.
+
+MESSAGE_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message"
+STRUCTURE_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure"
+COMMON_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common"
+
+AGENCY_ID = "BENCH"
+DSD_ID = "DSD_BENCH"
+CONCEPT_SCHEME_ID = "CS_BENCH"
+TIME_PERIODS = [str(year) for year in range(2000, 2024)]
+
+# Relative sizes cycled through the dataflows, so downloads are skewed like the real catalog
+SIZE_SKEW = [0.1, 0.2, 0.5, 1.0, 1.0, 2.0, 5.0]
+
+DATA_PATH = re.compile(r"^/public/rest/data/(?P<agency>[^,/]+),(?P<dataflow>[^/]+)(?:/(?P<key>[^/]*))?$")
+STRUCTURE_PATH = re.compile(r"^/public/rest/(?P<resource>[a-z]+)/(?P<agency>[^/]+)/(?P<artefact>[^/]+)/(?P<version>[^/]+)$")
+
+class SyntheticApi:
+    """
+    Deterministic synthetic SDMX content. Each catalog generation adds new dataflows and renames
+    (updates) some existing ones; the data of updated dataflows changes with them.
+    """
+
+    def __init__(self, dataflows=100, new_per_generation=10, updated_per_generation=5, rows=1000,
+                 dimensions=4, codes_per_dimension=8):
+        self.dataflows = dataflows
+        self.new_per_generation = new_per_generation
+        self.updated_per_generation = updated_per_generation
+        self.rows = rows
+        self.dimensions = dimensions
+        self.codes_per_dimension = codes_per_dimension
+
+    def dataflow_count(self, generation) -> int:
+        return self.dataflows + generation * self.new_per_generation
+
+    def updated_at(self, generation) -> set:
+        """
+        Dataflows updated in a generation: the first ones added by the previous generation,
+        so later runs exercise the incremental refresh of files downloaded earlier.
+        """
+        if generation <= 0:
+            return set()
+        first = self.dataflow_count(generation - 2) if generation >= 2 else 0
+        return set(range(first, min(first + self.updated_per_generation, self.dataflow_count(generation - 1))))
+
+    def revision(self, index, generation) -> int:
+        return sum(index in self.updated_at(g) for g in range(1, generation + 1))
+
+    def dataflow_rows(self, index) -> int:
+        return max(1, int(self.rows * SIZE_SKEW[index % len(SIZE_SKEW)]))
+
+    @staticmethod
+    def dataflow_id(index) -> str:
+        return f"DF_{index:05d}"
+
+    @staticmethod
+    def dataflow_index(dataflow_id):
+        match = re.fullmatch(r"DF_(\d+)", dataflow_id)
+        return int(match.group(1)) if match else None
+
+    def _dataflow_xml(self, index, generation) -> str:
+        revision = self.revision(index, generation)
+        name = f"Benchmark dataflow {index}" + (f" rev {revision}" if revision else "")
+        return (
+            f'<structure:Dataflow id="{self.dataflow_id(index)}" agencyID="{AGENCY_ID}" version="1.0" isFinal="true">'
+            f'<common:Name xml:lang="en">{name}</common:Name>'
+            f'<structure:Structure><Ref id="{DSD_ID}" agencyID="{AGENCY_ID}" version="1.0" package="datastructure" class="DataStructure"/></structure:Structure>'
+            f'</structure:Dataflow>'
+        )
+
+    def _component_ids(self):
+        return [f"DIM_{k}" for k in range(self.dimensions)]
+
+    def _codelists_xml(self) -> str:
+        codelists = []
+        for component_id in self._component_ids() + ["UNIT_MULT"]:
+            codes = "".join(
+                f'<structure:Code id="C{c:02d}"><common:Name xml:lang="en">{component_id} code {c}</common:Name></structure:Code>'
+                for c in range(self.codes_per_dimension)
+            )
+            codelists.append(
+                f'<structure:Codelist id="CL_{component_id}" agencyID="{AGENCY_ID}" version="1.0" isFinal="true">'
+                f'<common:Name xml:lang="en">{component_id} codes</common:Name>{codes}</structure:Codelist>'
+            )
+        return "".join(codelists)
+
+    def _concepts_xml(self) -> str:
+        concepts = "".join(
+            f'<structure:Concept id="{component_id}"><common:Name xml:lang="en">Concept {component_id}</common:Name></structure:Concept>'
+            for component_id in self._component_ids() + ["TIME_PERIOD", "OBS_VALUE", "UNIT_MULT"]
+        )
+        return (
+            f'<structure:ConceptScheme id="{CONCEPT_SCHEME_ID}" agencyID="{AGENCY_ID}" version="1.0" isFinal="true">'
+            f'<common:Name xml:lang="en">Benchmark concepts</common:Name>{concepts}</structure:ConceptScheme>'
+        )
+
+    def _concept_ref(self, component_id) -> str:
+        return (f'<structure:ConceptIdentity><Ref id="{component_id}" maintainableParentID="{CONCEPT_SCHEME_ID}" '
+                f'maintainableParentVersion="1.0" agencyID="{AGENCY_ID}" package="conceptscheme" class="Concept"/></structure:ConceptIdentity>')
+
+    def _enumeration(self, component_id) -> str:
+        return (f'<structure:LocalRepresentation><structure:Enumeration><Ref id="CL_{component_id}" agencyID="{AGENCY_ID}" '
+                f'version="1.0" package="codelist" class="Codelist"/></structure:Enumeration></structure:LocalRepresentation>')
+
+    def _data_structure_xml(self) -> str:
+        dimensions = "".join(
+            f'<structure:Dimension id="{component_id}" position="{position + 1}">'
+            f'{self._concept_ref(component_id)}{self._enumeration(component_id)}</structure:Dimension>'
+            for position, component_id in enumerate(self._component_ids())
+        )
+        time_dimension = (f'<structure:TimeDimension id="TIME_PERIOD" position="{self.dimensions + 1}">'
+                          f'{self._concept_ref("TIME_PERIOD")}</structure:TimeDimension>')
+        attribute = (f'<structure:Attribute id="UNIT_MULT" assignmentStatus="Conditional">'
+                     f'{self._concept_ref("UNIT_MULT")}{self._enumeration("UNIT_MULT")}</structure:Attribute>')
+        measure = f'<structure:PrimaryMeasure id="OBS_VALUE">{self._concept_ref("OBS_VALUE")}</structure:PrimaryMeasure>'
+        return (
+            f'<structure:DataStructure id="{DSD_ID}" agencyID="{AGENCY_ID}" version="1.0" isFinal="true">'
+            f'<common:Name xml:lang="en">Benchmark structure</common:Name><structure:DataStructureComponents>'
+            f'<structure:DimensionList id="DimensionDescriptor">{dimensions}{time_dimension}</structure:DimensionList>'
+            f'<structure:AttributeList id="AttributeDescriptor">{attribute}</structure:AttributeList>'
+            f'<structure:MeasureList id="MeasureDescriptor">{measure}</structure:MeasureList>'
+            f'</structure:DataStructureComponents></structure:DataStructure>'
+        )
+
+    @staticmethod
+    def _message(containers) -> bytes:
+        body = "".join(f"<structure:{name}>{content}</structure:{name}>" for name, content in containers if content)
+        return (
+            f'<?xml version="1.0" encoding="utf-8"?>'
+            f'<message:Structure xmlns:message="{MESSAGE_NS}" xmlns:structure="{STRUCTURE_NS}" xmlns:common="{COMMON_NS}">'
+            f'<message:Header><message:ID>BENCH</message:ID><message:Test>true</message:Test>'
+            f'<message:Prepared>2024-01-01T00:00:00Z</message:Prepared><message:Sender id="BENCH"/></message:Header>'
+            f'<message:Structures>{body}</message:Structures></message:Structure>'
+        ).encode("utf-8")
+
+    @lru_cache(maxsize=8)
+    def catalog(self, generation) -> bytes:
+        dataflows = "".join(self._dataflow_xml(index, generation) for index in range(self.dataflow_count(generation)))
+        return self._message([("Dataflows", dataflows)])
+
+    @lru_cache(maxsize=256)
+    def structure(self, resource, artefact_id, generation, references) -> bytes:
+        """
+        Structure message for a dataflow with all references, or a single artefact.
+        Dataflow parent queries answer 404 like the API when nothing references the dataflow.
+        """
+        if resource == "dataflow":
+            index = self.dataflow_index(artefact_id)
+            if index is None:
+                return None
+            dataflow = self._dataflow_xml(index, generation)
+            if references == "none":
+                return self._message([("Dataflows", dataflow)])
+            if references == "parents":
+                return None  # Synthetic dataflows are neither categorised nor constrained
+            return self._message([("Dataflows", dataflow), ("Codelists", self._codelists_xml()),
+                                  ("Concepts", self._concepts_xml()), ("DataStructures", self._data_structure_xml())])
+        if resource == "datastructure":
+            return self._message([("DataStructures", self._data_structure_xml())])
+        if resource == "conceptscheme":
+            return self._message([("Concepts", self._concepts_xml())])
+        if resource == "codelist":
+            return self._message([("Codelists", self._codelists_xml())])
+        return None
+
+    def data(self, index, generation, with_labels, delta, key=None, start_period=None, end_period=None, series_keys_only=False) -> bytes:
+        """
+        SDMX-CSV data of a dataflow, filtered by a series key ('C00+C01..') and period range.
+        With series_keys_only, lists the matching series without observations or attributes.
+        Returns None when no observation matches, like the API's 404.
+        """
+        if not (key or start_period or end_period or series_keys_only):
+            return self._csv(index, generation, with_labels, delta)
+
+        frame = self._frame(index, generation, with_labels, delta)
+        if key:
+            for component_id, codes in zip(self._component_ids(), key.split(".")):
+                if codes:
+                    frame = frame[frame[component_id].isin(codes.split("+"))]
+        if start_period:
+            frame = frame[frame["TIME_PERIOD"].str[:4] >= start_period[:4]]
+        if end_period:
+            frame = frame[frame["TIME_PERIOD"].str[:4] <= end_period[:4]]
+        if frame.empty:
+            return None
+        if series_keys_only:
+            frame = frame.drop(columns=["TIME_PERIOD", "OBS_VALUE", "UNIT_MULT"]).drop_duplicates()
+        return frame.to_csv(index=False).encode("utf-8")
+
+    @lru_cache(maxsize=64)
+    def _csv(self, index, generation, with_labels, delta) -> bytes:
+        return self._frame(index, generation, with_labels, delta).to_csv(index=False).encode("utf-8")
+
+    @lru_cache(maxsize=64)
+    def _frame(self, index, generation, with_labels, delta):
+        """
+        SDMX-CSV data of a dataflow. Observations of updated dataflows change with each revision;
+        a delta holds only the observations changed by the latest revision.
+        """
+        revision = self.revision(index, generation)
+        rows = np.arange(self.dataflow_rows(index))
+        if delta:
+            rows = rows[: max(1, len(rows) // 100)]
+
+        series = rows // len(TIME_PERIODS)
+        columns = {"STRUCTURE": "DATAFLOW", "STRUCTURE_ID": f"{AGENCY_ID}:{self.dataflow_id(index)}(1.0)", "ACTION": "I"}
+        frame = pd.DataFrame(columns, index=rows)
+        for k, component_id in enumerate(self._component_ids()):
+            codes = (series // self.codes_per_dimension ** k) % self.codes_per_dimension
+            frame[component_id] = [f"C{code:02d}" for code in codes]
+            if with_labels:
+                frame[f"Concept {component_id}"] = [f"{component_id} code {code}" for code in codes]
+        frame["TIME_PERIOD"] = np.array(TIME_PERIODS)[rows % len(TIME_PERIODS)]
+        changed = rows < max(1, len(rows) // 100)
+        frame["OBS_VALUE"] = ((rows * 7919 + index * 31) % 100000) / 100 + np.where(changed, revision, 0)
+        frame["UNIT_MULT"] = "C00"
+        return frame
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(head=True)
+
+    def do_GET(self):
+        self._respond(head=False)
+
+    def _send(self, status, body=b"", headers=None, head=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head and body:
+            self.wfile.write(body)
+            with self.server.bytes_served.get_lock():
+                self.server.bytes_served.value += len(body)
+
+    def _respond(self, head):
+        server = self.server
+        with server.requests_served.get_lock():
+            server.requests_served.value += 1
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+        if server.error_rate and random.random() < server.error_rate:
+            self._send(503, b"Service unavailable", {"Retry-After": "0"}, head)
+            return
+
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        generation = server.generation.value
+
+        body = self._recorded(parts.path)
+        content_type = "application/xml"
+        if body is None:
+            body, content_type = self._synthetic(parts.path, query, generation)
+        if body is None:
+            self._send(404, b"NoResultsFound", head=head)
+            return
+
+        headers = {"Content-Type": content_type}
+        if parts.path == "/public/rest/dataflow/all":
+            etag = f'"generation-{generation}"'
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, headers={"ETag": etag}, head=True)
+                return
+        else:
+            headers["ETag"] = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+
+        # Resumed downloads ask for the rest of the body, unless it changed since (If-Range)
+        range_match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if range_match and int(range_match.group(1)) < len(body) and if_range in (None, headers["ETag"]):
+            start = int(range_match.group(1))
+            headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            self._send(206, body[start:], headers, head)
+            return
+        self._send(200, body, headers, head)
+
+    def _recorded(self, path):
+        if self.server.recordings is None:
+            return None
+        recorded_file = self.server.recordings / re.sub(r"[^A-Za-z0-9.]+", "_", path.strip("/"))
+        return recorded_file.read_bytes() if recorded_file.exists() else None
+
+    def _synthetic(self, path, query, generation):
+        api = self.server.api
+        if path == "/public/rest/dataflow/all":
+            return api.catalog(generation), "application/xml"
+
+        match = DATA_PATH.match(path)
+        if match:
+            index = api.dataflow_index(match.group("dataflow"))
+            if index is None or index >= api.dataflow_count(generation):
+                return None, None
+            delta = "updatedAfter" in query
+            if delta and index not in api.updated_at(generation):
+                return None, None  # No changed observations
+            with_labels = query.get("format") == "csvfilewithlabels"
+            return api.data(index, generation, with_labels, delta, match.group("key"),
+                            query.get("startPeriod"), query.get("endPeriod"),
+                            query.get("detail") == "serieskeysonly"), "text/csv"
+
+        match = STRUCTURE_PATH.match(path)
+        if match:
+            return api.structure(match.group("resource"), match.group("artefact"), generation,
+                                 query.get("references", "none")), "application/xml"
+        return None, None
+
+def serve(port_queue, generation, bytes_served, requests_served, api_options, latency=0.0, error_rate=0.0, recordings=None):
+    """
+    Runs the stub server until the process is terminated. Meant as a multiprocessing target so
+    that serving does not compete with the measured pipeline for the interpreter.
+    Args:
+        port_queue (multiprocessing.Queue): Receives the port the server listens on.
+        generation (multiprocessing.Value): Catalog generation to serve; changed by the benchmark.
+        bytes_served (multiprocessing.Value): Counter of response body bytes sent.
+        requests_served (multiprocessing.Value): Counter of requests received.
+        api_options (dict): SyntheticApi arguments.
+        latency (float): Mean seconds added before each response.
+        error_rate (float): Share of requests answered with 503.
+        recordings (str): Folder of recorded responses served instead of synthetic ones.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.api = SyntheticApi(**api_options)
+    server.generation = generation
+    server.bytes_served = bytes_served
+    server.requests_served = requests_served
+    server.latency = latency
+    server.error_rate = error_rate
+    server.recordings = Path(recordings) if recordings else None
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
@@ -0,0 +1,82 @@
+import argparse
+import sys
+from pathlib import Path
+
+# Dynamically add the project root to Python's module search path
+current_dir = Path(__file__).resolve().parent  # Path to the current script
+project_root = current_dir  # download_worker.py sits in the project root
+sys.path.insert(0, str(project_root))  # Add project root to the module search path
+
+try:
+    from Functions.run_context import RunContext
+    from Functions.pipeline import run_stages
+    from Functions.sharded_download import run_sharded_download_stage, default_worker_id, validate_shard, SHARD_BY_HASH, SHARD_BY_QUEUE
+    from Functions.label_joiner import run_label_export_stage
+    from Functions.columnar_converter import run_columnar_stage
+    from Functions.logger import get_logger
+except ImportError as e:
+    print(f"Failed to import required modules: {e}")
+    sys.exit(1)
+
+# Initialize logger
+logger = get_logger()
+
+def _worker_path(path, worker_id) -> str:
+    """
+    Returns a per-worker variant of a PATHS entry, e.g. './data/run_journal_host-42.jsonl'.
+    """
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}_{worker_id}{path.suffix}"))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Downloads a share of the new dataflows listed in the data_changes file.")
+    parser.add_argument("--mode", choices=[SHARD_BY_HASH, SHARD_BY_QUEUE], help="Overrides SHARDING.MODE")
+    parser.add_argument("--shard", type=int, help="Shard downloaded in hash mode (0 to SHARDING.SHARD_COUNT - 1)")
+    parser.add_argument("--worker-id", help="Worker ID in queue mode (defaults to host name and process ID)")
+    args = parser.parse_args()
+
+    try:
+        ctx = RunContext()
+    except Exception as e:
+        logger.error(f"Error loading configuration: {e}", exc_info=True)
+        sys.exit(1)
+
+    sharding_config = ctx.config.setdefault("SHARDING", {})
+    if args.mode:
+        sharding_config["MODE"] = args.mode
+    if sharding_config.get("MODE") not in (SHARD_BY_HASH, SHARD_BY_QUEUE):
+        logger.error("Set SHARDING.MODE to 'hash' or 'queue' (or pass --mode) to run download workers.")
+        sys.exit(1)
+    if sharding_config["MODE"] == SHARD_BY_HASH:
+        if args.shard is None:
+            logger.error("Pass --shard in hash mode.")
+            sys.exit(1)
+        try:
+            validate_shard(args.shard, sharding_config.get("SHARD_COUNT", 1))
+        except ValueError as e:
+            logger.error(f"Invalid --shard: {e}")
+            sys.exit(1)
+        if args.shard == sharding_config.get("SHARD_INDEX", 0):
+            logger.warning(f"Shard {args.shard} is SHARDING.SHARD_INDEX, which main.py downloads as well.")
+
+    # Workers share the data folder, so each keeps its own run journal and metrics summary
+    worker_id = args.worker_id or (f"shard{args.shard}" if sharding_config["MODE"] == SHARD_BY_HASH else default_worker_id())
+    paths = ctx.config["PATHS"]
+    for key in ("RUN_JOURNAL_FILE", "METRICS_FILE"):
+        if paths.get(key):
+            paths[key] = _worker_path(paths[key], worker_id)
+    paths["PROMETHEUS_FILE"] = None
+
+    logger.info(f"Starting download worker {worker_id} ({sharding_config['MODE']} mode)...")
+    stages = [
+        ("API data download", lambda ctx: run_sharded_download_stage(ctx, worker_id, args.shard)),
+        ("label export", run_label_export_stage),
+        ("columnar conversion", run_columnar_stage),
+    ]
+    if not run_stages(stages, ctx):
+        logger.error(f"Download worker {worker_id} failed.")
+        sys.exit(1)
+    logger.info(f"Download worker {worker_id} complete.")
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,34 @@
-import os
 import sys
 from pathlib import Path
 
+# Dynamically add the project root to Python's module search path
+current_dir = Path(__file__).resolve().parent  # Path to the current script
+project_root = current_dir  # main.py sits in the project root
+sys.path.insert(0, str(project_root))  # Add project root to the module search path
+
 try:
-    from Functions.data_fetcher import fetch_and_save_api_data
-    from Functions.data_comparator import fetch_and_identify_changes
-    from Functions.api_downloader import generate_and_save_api_data
+    from Functions.run_context import RunContext
+    from Functions.pipeline import run_pipeline
     from Functions.logger import get_logger
 except ImportError as e:
     print(f"Failed to import required modules: {e}")
     sys.exit(1)
 
-# Dynamically add the project root to Python's module search path
-current_dir = Path(__file__).resolve().parent  # Path to the current script
-project_root = current_dir.parent  # Assuming the main.py is one level below the root
-sys.path.insert(0, str(project_root))  # Add project root to the module search path
-
 # Initialize logger
 logger = get_logger()
 
 def main() -> None:
     logger.info("Starting main job orchestration...")
 
-    # Track if an error occurred
-    error_occurred = False
-
-
-    # Compare old and new files to find changes
-    if not error_occurred:
-        logger.info("Executing data comparison job...")
-        try:
-            fetch_and_identify_changes()
-        except Exception as e:
-            logger.error(f"Error during data comparison job: {e}", exc_info=True)
-            error_occurred = True
-
-    # Process 'New Insert' entries if changes exist
-    if not error_occurred:
-        logger.info("Executing API data download for New Inserts...")
-        try:
-            generate_and_save_api_data()
-        except Exception as e:
-            logger.error(f"Error during API data download job: {e}", exc_info=True)
-            error_occurred = True
+    # Load configuration once for every stage of the run
+    try:
+        ctx = RunContext()
+    except Exception as e:
+        logger.error(f"Error loading configuration: {e}", exc_info=True)
+        sys.exit(1)
 
-    # Final check for errors
-    if error_occurred:
+    # Fetch the catalog, compare it with the previous one and download new dataflows
+    if not run_pipeline(ctx):
         logger.error("Job orchestration failed due to earlier errors.")
         sys.exit(1)  # Exit with failure status
     else:
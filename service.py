@@ -0,0 +1,86 @@
+import signal
+import sys
+import time
+from pathlib import Path
+
+# Dynamically add the project root to Python's module search path
+current_dir = Path(__file__).resolve().parent  # Path to the current script
+project_root = current_dir  # service.py sits in the project root
+sys.path.insert(0, str(project_root))  # Add project root to the module search path
+
+try:
+    import schedule
+    from Functions.run_context import RunContext
+    from Functions.pipeline import run_pipeline
+    from Functions.logger import get_logger
+except ImportError as e:
+    print(f"Failed to import required modules: {e}")
+    sys.exit(1)
+
+# Initialize logger
+logger = get_logger()
+
+# Set by SIGTERM/SIGINT; the service stops once the current cycle has finished
+_stop_requested = False
+
+def _request_stop(signum, frame) -> None:
+    global _stop_requested
+    logger.info(f"Received signal {signum}. Stopping after the current cycle...")
+    _stop_requested = True
+
+def run_cycle(ctx) -> bool:
+    """
+    Runs one fetch/compare/download cycle in the warm process. The run context, the previous
+    catalog held in memory and the pooled HTTP connections are reused from the last cycle.
+    Args:
+        ctx (RunContext): Run context kept for the lifetime of the service.
+    Returns:
+        bool: True if the cycle succeeded, False otherwise.
+    """
+    logger.info("Starting scheduled pipeline cycle...")
+    started = time.monotonic()
+    try:
+        ctx.new_run()
+        succeeded = run_pipeline(ctx)
+    except Exception as e:
+        logger.error(f"Pipeline cycle crashed: {e}", exc_info=True)
+        succeeded = False
+
+    elapsed = time.monotonic() - started
+    if succeeded:
+        logger.info(f"Pipeline cycle complete in {elapsed:.1f} s.")
+    else:
+        logger.error(f"Pipeline cycle failed after {elapsed:.1f} s. It resumes on the next cycle.")
+    return succeeded
+
+def main() -> None:
+    logger.info("Starting OECD pipeline service...")
+
+    # Load configuration once for the lifetime of the service
+    try:
+        ctx = RunContext()
+    except Exception as e:
+        logger.error(f"Error loading configuration: {e}", exc_info=True)
+        sys.exit(1)
+
+    service_config = ctx.config.get("SERVICE", {})
+    interval = service_config.get("INTERVAL_MINUTES", 15)
+    schedule.every(interval).minutes.do(run_cycle, ctx)
+    logger.info(f"Pipeline scheduled every {interval} minutes.")
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    if service_config.get("RUN_ON_START", True):
+        run_cycle(ctx)
+
+    while not _stop_requested:
+        schedule.run_pending()
+        idle = schedule.idle_seconds()
+        time.sleep(1 if idle is None else min(max(idle, 0), 1))
+
+    schedule.clear()
+    logger.info("OECD pipeline service stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Make the Functions package importable when pytest runs from any folder
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,160 @@
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+from Functions.api_downloader import run_download_stage, stream_to_file, temp_path
+from Functions.pipeline import run_stages
+from Functions.run_context import RunContext
+from Functions.snapshot_store import save_snapshot
+
+STAGES = [("API data download", run_download_stage)]
+
+class _Handler(BaseHTTPRequestHandler):
+    requests_seen = Counter()
+    failures = {}
+
+    def do_GET(self):
+        self.requests_seen[self.path] += 1
+        if self.failures.get(self.path, 0) > 0:
+            self.failures[self.path] -= 1
+            body, status = b"unavailable", 503
+        elif self.path.startswith("/data/"):
+            body, status = b"REF_AREA,TIME_PERIOD,OBS_VALUE\nAUS,2020,1\n", 200
+        else:
+            body, status = b"<Structure/>", 200
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    _Handler.requests_seen = Counter()
+    _Handler.failures = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def project(tmp_path):
+    changes = pd.DataFrame({
+        "Agency ID": ["OECD", "OECD"],
+        "Dataflow ID": ["DF_A", "DF_B"],
+        "Version": ["1.0", "1.0"],
+        "Change_Type": ["New Insert", "New Insert"],
+        "Is Final": ["true", "true"],
+    })
+    save_snapshot(changes, tmp_path / "data" / "data_changes.parquet")
+    return tmp_path
+
+def _context(project, url, run_attempts=3):
+    config = {
+        "PATHS": {
+            "DATA_CHANGES_FILE": "data/data_changes.parquet",
+            "RUN_JOURNAL_FILE": "data/run_journal.jsonl",
+            "HTTP_CACHE_FOLDER": "data/http_cache",
+            "HIGH_WATER_MARKS_FILE": "data/high_water_marks.json",
+            "DOWNLOAD_SIZES_FILE": "data/download_sizes.json",
+        },
+        "API": {
+            "DATA_QUERY": url + "/data/{agency_id},{dataflow_id}",
+            "STRUCTURE_QUERY": url + "/dataflow/{agency_id}/{dataflow_id}/{version}",
+        },
+        "HTTP": {"RETRIES": 0},
+        "DOWNLOAD": {"MAX_WORKERS": 2, "RESUME_ATTEMPTS": 0, "RUN_ATTEMPTS": run_attempts},
+    }
+    return RunContext(config, project)
+
+def test_failed_download_is_retried_by_the_next_run(server, project):
+    _Handler.failures["/data/OECD,DF_B"] = 1
+
+    first = _context(project, server)
+    assert run_stages(STAGES, first) is False
+    assert first.failed_downloads == [("OECD", "DF_B", "1.0")]
+    assert not (project / "output" / "OECD_DF_B_ALL.csv").exists()
+
+    second = _context(project, server)
+    assert run_stages(STAGES, second) is True
+    assert second.journal.resumed
+    assert (project / "output" / "OECD_DF_B_ALL.csv").exists()
+    assert _Handler.requests_seen["/data/OECD,DF_B"] == 2
+    assert _Handler.requests_seen["/data/OECD,DF_A"] == 1
+
+def test_gives_up_after_the_run_attempts(server, project):
+    _Handler.failures["/data/OECD,DF_B"] = 10
+
+    assert run_stages(STAGES, _context(project, server, run_attempts=2)) is False
+    assert run_stages(STAGES, _context(project, server, run_attempts=2)) is True
+    assert _Handler.requests_seen["/data/OECD,DF_B"] == 2
+
+    # The finished run is not resumed again
+    assert run_stages(STAGES, _context(project, server, run_attempts=2)) is False
+    assert _Handler.requests_seen["/data/OECD,DF_A"] == 2
+
+BODY = b"REF_AREA,TIME_PERIOD,OBS_VALUE\nAUS,2020,1\nAUS,2021,2\n"
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    etag = '"v2"'
+    range_requests = []
+
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        self.range_requests.append((requested, self.headers.get("If-Range")))
+        if requested and self.headers.get("If-Range") == self.etag:
+            start = int(requested.removeprefix("bytes=").rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(BODY) - 1}/{len(BODY)}")
+            body = BODY[start:]
+        else:
+            self.send_response(200)
+            body = BODY
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def range_url():
+    _RangeHandler.range_requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/data"
+    server.shutdown()
+    server.server_close()
+
+def test_resumes_a_partial_file_of_the_same_version(range_url, tmp_path):
+    file_name = tmp_path / "data.csv"
+    temp_path(file_name).write_bytes(BODY[:20])
+    temp_path(file_name, ".validator").write_text('"v2"')
+
+    assert stream_to_file(range_url, file_name, 1024, 0) == 200
+    assert file_name.read_bytes() == BODY
+    assert _RangeHandler.range_requests == [("bytes=20-", '"v2"')]
+    assert not temp_path(file_name, ".validator").exists()
+
+def test_downloads_again_when_the_resource_changed(range_url, tmp_path):
+    file_name = tmp_path / "data.csv"
+    temp_path(file_name).write_bytes(b"OLD,PREFIX,OF,ANOTHER,VERSION")
+    temp_path(file_name, ".validator").write_text('"v1"')
+
+    assert stream_to_file(range_url, file_name, 1024, 0) == 200
+    assert file_name.read_bytes() == BODY
+
+def test_does_not_resume_a_partial_file_without_validator(range_url, tmp_path):
+    file_name = tmp_path / "data.csv"
+    temp_path(file_name).write_bytes(b"LEFT,OVER")
+
+    assert stream_to_file(range_url, file_name, 1024, 0) == 200
+    assert file_name.read_bytes() == BODY
+    assert _RangeHandler.range_requests == [(None, None)]
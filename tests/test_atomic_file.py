@@ -0,0 +1,22 @@
+import pytest
+from Functions.atomic_file import atomic_open, write_atomic
+
+def test_replaces_the_file(tmp_path):
+    target = tmp_path / "state" / "marks.json"
+    write_atomic(target, "{}")
+    write_atomic(target, b'{"a": 1}')
+
+    assert target.read_text() == '{"a": 1}'
+    assert [path.name for path in target.parent.iterdir()] == ["marks.json"]
+
+def test_failed_write_keeps_the_old_file_and_no_temporary_file(tmp_path):
+    target = tmp_path / "marks.json"
+    write_atomic(target, "{}")
+
+    with pytest.raises(RuntimeError):
+        with atomic_open(target) as f:
+            f.write('{"partial"')
+            raise RuntimeError("serialisation failed")
+
+    assert target.read_text() == "{}"
+    assert [path.name for path in tmp_path.iterdir()] == ["marks.json"]
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+from Functions.change_history import record_run, rebuild_catalog, read_index, BASE, DELTA
+from Functions.diff_engine import diff_tables
+
+KEY = ["Agency ID", "Dataflow ID"]
+
+def _catalog(rows):
+    return pd.DataFrame(rows, columns=["Agency ID", "Dataflow ID", "Version"])
+
+CATALOGS = [
+    _catalog([("OECD", "A", "1.0"), ("OECD", "B", "1.0")]),
+    _catalog([("OECD", "A", "1.1"), ("OECD", "B", "1.0"), ("OECD", "C", "1.0")]),
+    _catalog([("OECD", "A", "1.1"), ("OECD", "C", "1.0")]),
+    _catalog([("OECD", "A", "1.2"), ("OECD", "C", "1.0"), ("OECD", "D", "1.0")]),
+]
+
+@pytest.fixture
+def history(tmp_path):
+    """
+    Four runs recorded with a new base snapshot every two deltas: base, delta, delta + base, delta.
+    """
+    record_run(tmp_path, "run0", CATALOGS[0], None, base_every=2)
+    for i in range(1, len(CATALOGS)):
+        record_run(tmp_path, f"run{i}", CATALOGS[i], diff_tables(CATALOGS[i - 1], CATALOGS[i], KEY), base_every=2)
+    return tmp_path
+
+def _rows(df):
+    return sorted(map(tuple, df.astype(str).to_numpy()))
+
+def test_records_bases_and_deltas(history):
+    assert [(entry["run_id"], entry["kind"]) for entry in read_index(history)] == [
+        ("run0", BASE), ("run1", DELTA), ("run2", DELTA), ("run2", BASE), ("run3", DELTA),
+    ]
+
+@pytest.mark.parametrize("run", range(len(CATALOGS)))
+def test_rebuilds_the_catalog_of_every_run(history, run):
+    assert _rows(rebuild_catalog(history, KEY, as_of=f"run{run}")) == _rows(CATALOGS[run])
+
+def test_rebuilds_the_latest_catalog_by_default(history):
+    assert _rows(rebuild_catalog(history, KEY)) == _rows(CATALOGS[-1])
+
+def test_rebuilds_as_of_a_timestamp(history):
+    entries = read_index(history)
+    run1_time = next(entry["timestamp"] for entry in entries if entry["run_id"] == "run1")
+
+    assert _rows(rebuild_catalog(history, KEY, as_of=run1_time)) == _rows(CATALOGS[1])
+
+def test_recording_a_run_twice_has_no_effect(history):
+    entries = read_index(history)
+    record_run(history, "run3", CATALOGS[3], diff_tables(CATALOGS[2], CATALOGS[3], KEY), base_every=2)
+
+    assert read_index(history) == entries
+
+def test_fails_before_the_first_base(history):
+    with pytest.raises(ValueError):
+        rebuild_catalog(history, KEY, as_of="2000-01-01T00:00:00")
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+from Functions.chunked_download import stitch_chunks, time_chunk_queries
+
+HEADER = "REF_AREA,MEASURE,TIME_PERIOD,OBS_VALUE\n"
+
+def _chunk(path, *rows, header=HEADER, newline=True):
+    path.write_text(header + "\n".join(rows) + ("\n" if newline else ""))
+    return path
+
+def test_stitches_chunks_under_one_header(tmp_path):
+    first = _chunk(tmp_path / "c0", "AUS,GDP,2020,1", "AUS,GDP,2021,2")
+    second = _chunk(tmp_path / "c1", "FRA,GDP,2020,3", newline=False)
+    output = tmp_path / "out.csv"
+
+    rows = stitch_chunks([first, None, second], output)
+
+    assert rows == 3
+    assert output.read_text() == HEADER + "AUS,GDP,2020,1\nAUS,GDP,2021,2\nFRA,GDP,2020,3\n"
+    assert not (tmp_path / "out.csv.part").exists()
+
+def test_rejects_chunks_with_different_columns(tmp_path):
+    first = _chunk(tmp_path / "c0", "AUS,GDP,2020,1")
+    second = _chunk(tmp_path / "c1", "FRA,2020,3", header="REF_AREA,TIME_PERIOD,OBS_VALUE\n")
+    output = tmp_path / "out.csv"
+
+    with pytest.raises(ValueError):
+        stitch_chunks([first, second], output)
+    assert not output.exists()
+
+def test_rejects_when_no_chunk_has_observations(tmp_path):
+    with pytest.raises(ValueError):
+        stitch_chunks([None, None], tmp_path / "out.csv")
+
+def test_accepts_the_series_of_the_unchunked_query(tmp_path):
+    first = _chunk(tmp_path / "c0", "AUS,GDP,2020,1", "AUS,GDP,2021,2")
+    second = _chunk(tmp_path / "c1", "FRA,GDP,2020,3")
+    series_keys = _chunk(tmp_path / "keys", "AUS,GDP", "FRA,GDP", header="REF_AREA,MEASURE\n")
+    output = tmp_path / "out.csv"
+
+    assert stitch_chunks([first, second], output, series_keys, ["REF_AREA", "MEASURE", "TIME_PERIOD"]) == 3
+    assert len(pd.read_csv(output)) == 3
+
+def test_rejects_missing_series(tmp_path):
+    first = _chunk(tmp_path / "c0", "AUS,GDP,2020,1")
+    series_keys = _chunk(tmp_path / "keys", "AUS,GDP", "FRA,GDP", header="REF_AREA,MEASURE\n")
+    output = tmp_path / "out.csv"
+
+    with pytest.raises(ValueError, match="1 missing"):
+        stitch_chunks([first], output, series_keys)
+    assert not output.exists()
+    assert not (tmp_path / "out.csv.part").exists()
+
+def test_time_windows_are_open_ended():
+    queries = time_chunk_queries("https://example.org/data/OECD,DF?format=csvfile", [2000, 2010])
+
+    assert queries == [
+        "https://example.org/data/OECD,DF?format=csvfile&endPeriod=1999",
+        "https://example.org/data/OECD,DF?format=csvfile&startPeriod=2000&endPeriod=2009",
+        "https://example.org/data/OECD,DF?format=csvfile&startPeriod=2010",
+    ]
@@ -0,0 +1,61 @@
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from Functions.columnar_converter import convert_csv, read_columnar
+
+CSV = (
+    "REF_AREA,TIME_PERIOD,OBS_VALUE,CONF_LEVEL,OBS_STATUS\n"
+    "AUS,2020,1.5,95,A\n"
+    "AUS,2020-Q3,2,,E\n"
+    "FRA,2020-M07,NaN,90,A\n"
+    "FRA,2020-W01,,90,A\n"
+    "DEU,2020-07-15,3,90,A\n"
+    "DEU,2020-S2,4,90,A\n"
+)
+
+@pytest.fixture
+def csv_file(tmp_path):
+    csv_file = tmp_path / "OECD_DF_ALL.csv"
+    csv_file.write_text(CSV)
+    return csv_file
+
+def test_stores_typed_columns(csv_file):
+    output = convert_csv(csv_file, column_types={"CONF_LEVEL": pa.int64()})
+
+    schema = pq.read_schema(output)
+    assert schema.field("OBS_VALUE").type == pa.float64()
+    assert schema.field("TIME_PERIOD").type == pa.date32()
+    assert schema.field("CONF_LEVEL").type == pa.int64()
+    assert pa.types.is_dictionary(schema.field("OBS_STATUS").type)
+
+    df = read_columnar(output)
+    assert df["TIME_PERIOD"].tolist() == [
+        datetime.date(2020, 1, 1), datetime.date(2020, 7, 1), datetime.date(2020, 7, 1),
+        datetime.date(2019, 12, 30), datetime.date(2020, 7, 15), datetime.date(2020, 7, 1),
+    ]
+    assert df["CONF_LEVEL"].isna().tolist() == [False, True, False, False, False, False]
+    assert df["OBS_VALUE"].isna().sum() == 2
+
+@pytest.mark.parametrize("column, value", [("OBS_VALUE", "n/a"), ("TIME_PERIOD", "2020-Q5"), ("CONF_LEVEL", "9.5")])
+def test_rejects_values_of_another_kind(csv_file, column, value):
+    header = CSV.splitlines()[0].split(",")
+    row = ["AUS", "2021", "1", "90", "A"]
+    row[header.index(column)] = value
+    csv_file.write_text(CSV + ",".join(row) + "\n")
+
+    with pytest.raises(ValueError):
+        convert_csv(csv_file, column_types={"CONF_LEVEL": pa.int64()})
+    assert not csv_file.with_suffix(".parquet").exists()
+
+def test_switches_between_a_file_and_time_partitions(csv_file):
+    convert_csv(csv_file)
+
+    partitioned = convert_csv(csv_file, partition_by_time=True)
+    assert partitioned.is_dir()
+    assert len(read_columnar(partitioned)) == 6
+    assert read_columnar(partitioned)["TIME_PERIOD"].min() == datetime.date(2019, 12, 30)
+
+    single = convert_csv(csv_file)
+    assert single.is_file()
+    assert len(read_columnar(single)) == 6
@@ -0,0 +1,60 @@
+import pandas as pd
+from Functions.diff_engine import diff_tables, CHANGE_TYPE_COLUMN, CHANGED_FIELDS_COLUMN, NEW_INSERT, DELETED, UPDATED
+
+KEY = ["Agency ID", "Dataflow ID"]
+
+def _catalog(rows):
+    return pd.DataFrame(rows, columns=["Agency ID", "Dataflow ID", "Version", "Name"])
+
+def _by_key(changes):
+    return {(row["Agency ID"], row["Dataflow ID"]): row for _, row in changes.iterrows()}
+
+def test_classifies_added_removed_and_changed_rows():
+    old = _catalog([("OECD", "A", "1.0", "Alpha"), ("OECD", "B", "1.0", "Beta"), ("OECD", "C", "1.0", "Gamma")])
+    new = _catalog([("OECD", "A", "1.0", "Alpha"), ("OECD", "B", "1.1", "Beta"), ("OECD", "D", "1.0", "Delta")])
+
+    changes = _by_key(diff_tables(old, new, KEY))
+
+    assert set(changes) == {("OECD", "B"), ("OECD", "C"), ("OECD", "D")}
+    assert changes[("OECD", "B")][CHANGE_TYPE_COLUMN] == UPDATED
+    assert changes[("OECD", "B")][CHANGED_FIELDS_COLUMN] == "Version"
+    assert changes[("OECD", "B")]["Version"] == "1.1"
+    assert changes[("OECD", "C")][CHANGE_TYPE_COLUMN] == DELETED
+    assert changes[("OECD", "C")]["Name"] == "Gamma"
+    assert changes[("OECD", "D")][CHANGE_TYPE_COLUMN] == NEW_INSERT
+
+def test_lists_every_changed_field():
+    old = _catalog([("OECD", "A", "1.0", "Alpha")])
+    new = _catalog([("OECD", "A", "2.0", "Alpha revised")])
+
+    changes = diff_tables(old, new, KEY)
+
+    assert changes[CHANGED_FIELDS_COLUMN].tolist() == ["Version, Name"]
+
+def test_identical_tables_have_no_changes():
+    old = _catalog([("OECD", "A", "1.0", "Alpha"), ("OECD", "B", None, "Beta")])
+
+    assert diff_tables(old, old.copy(), KEY).empty
+
+def test_duplicate_keys_keep_the_last_row():
+    old = _catalog([("OECD", "A", "1.0", "Alpha"), ("OECD", "A", "1.1", "Alpha")])
+    new = _catalog([("OECD", "A", "0.9", "Alpha"), ("OECD", "A", "1.1", "Alpha")])
+
+    assert diff_tables(old, new, KEY).empty
+
+def test_mismatched_dtypes_compare_by_value():
+    old = pd.DataFrame({"Agency ID": ["OECD", "OECD"], "Dataflow ID": ["A", "B"], "Version": [1.5, 2.0]})
+    new = pd.DataFrame({"Agency ID": ["OECD", "OECD"], "Dataflow ID": ["A", "B"], "Version": ["1.5", "2.1"]})
+
+    changes = diff_tables(old, new, KEY)
+
+    assert changes["Dataflow ID"].tolist() == ["B"]
+    assert changes[CHANGE_TYPE_COLUMN].tolist() == [UPDATED]
+
+def test_changes_are_sorted_by_key():
+    old = _catalog([("OECD", "Z", "1.0", "Zeta")])
+    new = _catalog([("OECD", "M", "1.0", "Mu"), ("ABS", "B", "1.0", "Beta")])
+
+    changes = diff_tables(old, new, KEY)
+
+    assert list(zip(changes["Agency ID"], changes["Dataflow ID"])) == [("ABS", "B"), ("OECD", "M"), ("OECD", "Z")]
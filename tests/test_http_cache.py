@@ -0,0 +1,56 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from Functions.http_cache import conditional_get, invalidate
+
+BODY = b"STRUCTURE,REF_AREA,OBS_VALUE\nDATAFLOW,AUS,1\n"
+ETAG = '"v1"'
+
+class _Handler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def url():
+    _Handler.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/data"
+    server.shutdown()
+    server.server_close()
+
+def test_not_modified_reuses_the_cached_body(url, tmp_path):
+    first = conditional_get(url, tmp_path)
+    second = conditional_get(url, tmp_path)
+
+    assert (first.status_code, first.not_modified) == (200, False)
+    assert (second.status_code, second.not_modified) == (304, True)
+    assert second.path == first.path
+    assert second.path.read_bytes() == BODY
+    assert _Handler.requests_seen == [None, ETAG]
+
+def test_invalidated_entry_is_downloaded_again(url, tmp_path):
+    conditional_get(url, tmp_path)
+    invalidate(url, tmp_path)
+
+    response = conditional_get(url, tmp_path)
+
+    assert (response.status_code, response.not_modified) == (200, False)
+    assert response.path.read_bytes() == BODY
+    assert _Handler.requests_seen == [None, None]
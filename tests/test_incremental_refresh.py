@@ -0,0 +1,110 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+from Functions.incremental_refresh import merge_delta, refresh_dataflow
+from Functions.run_context import RunContext
+
+KEY = ["REF_AREA", "TIME_PERIOD"]
+
+def _write(path, rows, columns=("REF_AREA", "TIME_PERIOD", "OBS_VALUE", "ACTION")):
+    pd.DataFrame(rows, columns=list(columns)).to_csv(path, index=False)
+    return path
+
+def _read(path):
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return {(row["REF_AREA"], row["TIME_PERIOD"]): row["OBS_VALUE"] for _, row in df.iterrows()}
+
+def test_upserts_and_deletes(tmp_path):
+    local_file = _write(tmp_path / "local.csv", [
+        ("AUS", "2020", "1", "I"), ("AUS", "2021", "2", "I"), ("FRA", "2020", "3", "I"), ("FRA", "2021", "4", "I"),
+    ])
+    delta_file = _write(tmp_path / "delta.csv", [
+        ("AUS", "2021", "20", "R"),  # revised
+        ("FRA", "2020", "", "D"),    # deleted
+        ("DEU", "2022", "5", "I"),   # added
+    ])
+
+    applied = merge_delta(local_file, delta_file, KEY, chunk_rows=2)
+
+    assert applied == 3
+    assert _read(local_file) == {("AUS", "2020"): "1", ("AUS", "2021"): "20", ("FRA", "2021"): "4", ("DEU", "2022"): "5"}
+    assert not (tmp_path / "local.csv.merge").exists()
+
+def test_delete_of_unknown_key_is_ignored(tmp_path):
+    local_file = _write(tmp_path / "local.csv", [("AUS", "2020", "1", "I")])
+    delta_file = _write(tmp_path / "delta.csv", [("NZL", "2020", "", "D")])
+
+    merge_delta(local_file, delta_file, KEY, chunk_rows=10)
+
+    assert _read(local_file) == {("AUS", "2020"): "1"}
+
+def test_mismatched_columns_leave_the_local_file_alone(tmp_path):
+    local_file = _write(tmp_path / "local.csv", [("AUS", "2020", "1", "I")])
+    delta_file = _write(tmp_path / "delta.csv", [("AUS", "2020", "9")], columns=("REF_AREA", "TIME_PERIOD", "OBS_VALUE"))
+    before = local_file.read_bytes()
+
+    assert merge_delta(local_file, delta_file, KEY, chunk_rows=10) is None
+    assert local_file.read_bytes() == before
+
+FULL_BODY = b"REF_AREA,TIME_PERIOD,OBS_VALUE,UNIT_MEASURE\nAUS,2020,1,USD\nAUS,2021,5,USD\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        if "updatedAfter" in self.path:
+            # The new structure added a column the local copy does not have
+            body = b"REF_AREA,TIME_PERIOD,OBS_VALUE,UNIT_MEASURE,ACTION\nAUS,2021,5,USD,I\n"
+        elif self.path.startswith("/data/"):
+            body = FULL_BODY
+        else:
+            body = b"<Structure version='2.0'/>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def ctx(tmp_path):
+    _Handler.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    config = {
+        "PATHS": {"HIGH_WATER_MARKS_FILE": "data/high_water_marks.json", "HTTP_CACHE_FOLDER": "data/http_cache"},
+        "API": {
+            "DATA_QUERY": url + "/data/{agency_id},{dataflow_id}",
+            "STRUCTURE_QUERY": url + "/dataflow/{agency_id}/{dataflow_id}/{version}",
+        },
+        "HTTP": {"RETRIES": 0},
+    }
+    output_folder = tmp_path / "output"
+    output_folder.mkdir()
+    _write(output_folder / "OECD_DF_ALL.csv", [("AUS", "2020", "1")], columns=("REF_AREA", "TIME_PERIOD", "OBS_VALUE"))
+    (output_folder / "OECD_DF_metadata.xml").write_text("<Structure version='1.0'/>")
+    yield RunContext(config, tmp_path)
+    server.shutdown()
+    server.server_close()
+
+def test_downloads_the_whole_dataflow_when_changes_do_not_merge(ctx):
+    assert refresh_dataflow(ctx, "OECD", "DF", "1.0") is True
+
+    assert (ctx.project_root / "output" / "OECD_DF_ALL.csv").read_bytes() == FULL_BODY
+    assert not (ctx.project_root / "output" / "OECD_DF_DELTA.csv").exists()
+    assert _Handler.requests_seen[-1] == "/data/OECD,DF"
+
+def test_downloads_the_structure_of_a_new_version(ctx):
+    refresh_dataflow(ctx, "OECD", "DF", "2.0", version_changed=True)
+
+    assert _Handler.requests_seen[0] == "/dataflow/OECD/DF/2.0"
+    assert (ctx.project_root / "output" / "OECD_DF_metadata.xml").read_text() == "<Structure version='2.0'/>"
+
+def test_keeps_the_structure_of_an_unchanged_version(ctx):
+    refresh_dataflow(ctx, "OECD", "DF", "1.0")
+
+    assert not any(path.startswith("/dataflow/") for path in _Handler.requests_seen)
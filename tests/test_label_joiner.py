@@ -0,0 +1,56 @@
+import pytest
+from Functions.label_joiner import export_with_labels
+
+STRUCTURE = """<?xml version="1.0" encoding="utf-8"?>
+<message:Structure xmlns:message="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message"
+    xmlns:structure="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure"
+    xmlns:common="http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common">
+  <message:Structures>
+    <structure:Codelists>
+      <structure:Codelist id="CL_AREA" agencyID="OECD" version="1.0">
+        <structure:Code id="AUS"><common:Name xml:lang="en">Australia</common:Name></structure:Code>
+        <structure:Code id="FRA"><common:Name xml:lang="en">France</common:Name></structure:Code>
+      </structure:Codelist>
+    </structure:Codelists>
+    <structure:DataStructures>
+      <structure:DataStructure id="DSD" agencyID="OECD" version="1.0">
+        <structure:DataStructureComponents>
+          <structure:DimensionList>
+            <structure:Dimension id="REF_AREA" position="1">
+              <structure:LocalRepresentation>
+                <structure:Enumeration><Ref id="CL_AREA" agencyID="OECD" version="1.0"/></structure:Enumeration>
+              </structure:LocalRepresentation>
+            </structure:Dimension>
+          </structure:DimensionList>
+        </structure:DataStructureComponents>
+      </structure:DataStructure>
+    </structure:DataStructures>
+  </message:Structures>
+</message:Structure>
+"""
+
+@pytest.fixture
+def metadata_file(tmp_path):
+    metadata_file = tmp_path / "OECD_DF_metadata.xml"
+    metadata_file.write_text(STRUCTURE)
+    return metadata_file
+
+def test_exports_labels_in_chunks(tmp_path, metadata_file):
+    csv_file = tmp_path / "OECD_DF_ALL.csv"
+    csv_file.write_text("REF_AREA,TIME_PERIOD,OBS_VALUE\nAUS,2020,1\nFRA,2020,2\nAUS,2021,3\n")
+
+    output = export_with_labels(csv_file, metadata_file, chunk_rows=2)
+
+    assert output.read_text() == (
+        "REF_AREA,REF_AREA label,TIME_PERIOD,OBS_VALUE\n"
+        "AUS,Australia,2020,1\nFRA,France,2020,2\nAUS,Australia,2021,3\n"
+    )
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted([csv_file.name, metadata_file.name, output.name])
+
+def test_exports_the_header_of_a_dataflow_without_observations(tmp_path, metadata_file):
+    csv_file = tmp_path / "OECD_DF_ALL.csv"
+    csv_file.write_text("REF_AREA,TIME_PERIOD,OBS_VALUE\n")
+
+    output = export_with_labels(csv_file, metadata_file)
+
+    assert output.read_text() == "REF_AREA,REF_AREA label,TIME_PERIOD,OBS_VALUE\n"
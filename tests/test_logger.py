@@ -0,0 +1,17 @@
+import json
+from Functions.logger import get_logger, shutdown_logging
+from Functions.run_context import RunContext
+
+def test_uses_the_logging_section_of_the_run_context(tmp_path):
+    config = {
+        "PATHS": {"LOG_FOLDER": "run_logs"},
+        "LOGGING": {"FORMAT": "json", "FILE_NAME": "pipeline.log", "CONSOLE_LEVEL": "ERROR"},
+    }
+    RunContext(config, tmp_path)
+
+    get_logger().info("configured from the run context")
+    shutdown_logging()
+
+    entry = json.loads((tmp_path / "run_logs" / "pipeline.log").read_text().splitlines()[-1])
+    assert entry["message"] == "configured from the run context"
+    assert entry["level"] == "INFO"
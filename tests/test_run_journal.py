@@ -0,0 +1,54 @@
+from Functions.run_journal import RunJournal
+
+STAGES = ["data fetching", "data comparison", "API data download"]
+
+def test_resumes_an_interrupted_run(tmp_path):
+    journal_file = tmp_path / "run_journal.jsonl"
+    journal = RunJournal(journal_file)
+    assert journal.start_run(STAGES) is False
+    journal.complete_stage("data fetching")
+    journal.checkpoint("changes saved")
+    journal.complete_item("download", "OECD,DF_A,1.0")
+
+    resumed = RunJournal(journal_file)
+
+    assert resumed.start_run(STAGES) is True
+    assert resumed.resumed
+    assert resumed.run_id == journal.run_id
+    assert (journal.attempt, resumed.attempt) == (1, 2)
+    assert resumed.stage_done("data fetching")
+    assert not resumed.stage_done("data comparison")
+    assert resumed.has_checkpoint("changes saved")
+    assert resumed.item_done("download", "OECD,DF_A,1.0")
+    assert not resumed.item_done("download", "OECD,DF_B,1.0")
+
+def test_starts_afresh_after_a_finished_run(tmp_path):
+    journal_file = tmp_path / "run_journal.jsonl"
+    journal = RunJournal(journal_file)
+    journal.start_run(STAGES)
+    journal.complete_stage("data fetching")
+    journal.finish_run()
+
+    next_run = RunJournal(journal_file)
+
+    assert next_run.start_run(STAGES) is False
+    assert not next_run.stage_done("data fetching")
+
+def test_does_not_resume_a_run_of_other_stages(tmp_path):
+    journal_file = tmp_path / "run_journal.jsonl"
+    RunJournal(journal_file).start_run(STAGES)
+
+    assert RunJournal(journal_file).start_run(STAGES[:1]) is False
+
+def test_ignores_a_torn_last_line(tmp_path):
+    journal_file = tmp_path / "run_journal.jsonl"
+    journal = RunJournal(journal_file)
+    journal.start_run(STAGES)
+    journal.complete_stage("data fetching")
+    with open(journal_file, "a") as f:
+        f.write('{"event": "stage_done", "sta')
+
+    resumed = RunJournal(journal_file)
+
+    assert resumed.start_run(STAGES) is True
+    assert resumed.stage_done("data fetching")
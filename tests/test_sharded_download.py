@@ -0,0 +1,122 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from Functions import http_client
+from Functions.sharded_download import WorkQueue, _heartbeat_loop, PENDING, LEASED, DONE, FAILED
+
+JOBS = [("OECD", "DF_A", "1.0"), ("OECD", "DF_B", "1.0"), ("OECD", "DF_C", "2.0")]
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite", lease_seconds=0.2, max_attempts=2)
+    queue.enqueue("gen1", JOBS)
+    return queue
+
+def test_enqueue_adds_each_job_once(queue):
+    assert queue.enqueue("gen1", JOBS) == 0
+    assert queue.counts("gen1")[PENDING] == 3
+
+def test_enqueue_removes_other_generations(queue):
+    queue.claim("gen1", "worker-1")
+
+    assert queue.enqueue("gen2", JOBS[:1]) == 1
+    assert queue.counts("gen1") == {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+    assert queue.counts("gen2")[PENDING] == 1
+
+def test_workers_never_lease_the_same_job(queue):
+    first = queue.claim("gen1", "worker-1", batch_size=2)
+    second = queue.claim("gen1", "worker-2", batch_size=2)
+
+    assert first == JOBS[:2]
+    assert second == JOBS[2:]
+    assert queue.claim("gen1", "worker-3") == []
+
+def test_finish_marks_jobs_done_or_pending(queue):
+    done, retried = queue.claim("gen1", "worker-1", batch_size=2)
+
+    assert queue.finish("gen1", "worker-1", done, succeeded=True)
+    assert queue.finish("gen1", "worker-1", retried, succeeded=False)
+    assert queue.counts("gen1") == {PENDING: 2, LEASED: 0, DONE: 1, FAILED: 0}
+    assert queue.claim("gen1", "worker-2", batch_size=3) == [JOBS[2], retried]
+
+def test_expired_lease_is_reclaimed(queue):
+    job, = queue.claim("gen1", "worker-1")
+    time.sleep(0.3)
+
+    assert queue.claim("gen1", "worker-2", batch_size=3)[-1] == job
+    assert not queue.finish("gen1", "worker-1", job, succeeded=True)
+    assert queue.finish("gen1", "worker-2", job, succeeded=True)
+    assert queue.counts("gen1")[DONE] == 1
+
+def test_heartbeat_keeps_the_lease(queue):
+    job, = queue.claim("gen1", "worker-1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat("gen1", "worker-1") == 1
+
+    assert job not in queue.claim("gen1", "worker-2", batch_size=3)
+
+def test_job_fails_after_max_attempts(queue):
+    job, = queue.claim("gen1", "worker-1")
+    time.sleep(0.3)
+    assert job in queue.claim("gen1", "worker-2", batch_size=3)
+    time.sleep(0.3)
+
+    assert job not in queue.claim("gen1", "worker-3", batch_size=3)
+    assert queue.counts("gen1")[FAILED] == 1
+
+def test_failed_jobs_can_be_retried(queue):
+    job, = queue.claim("gen1", "worker-1")
+    queue.finish("gen1", "worker-1", job, succeeded=False)
+    queue.claim("gen1", "worker-1", batch_size=3)
+    queue.finish("gen1", "worker-1", job, succeeded=False)
+    assert queue.failed_jobs("gen1") == [job]
+
+    assert queue.retry_failed("gen1") == 1
+    assert queue.failed_jobs("gen1") == []
+    assert job in queue.claim("gen1", "worker-2", batch_size=3)
+
+class _SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+class _BeatCounter:
+    def __init__(self):
+        self.beats = 0
+
+    def heartbeat(self, generation, worker_id):
+        self.beats += 1
+        return 1
+
+def _beats_during(action):
+    counter = _BeatCounter()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_loop, args=(counter, "gen1", "worker-1", 0.05, stop))
+    heartbeat.start()
+    try:
+        action()
+    finally:
+        stop.set()
+        heartbeat.join()
+    return counter.beats
+
+def test_idle_worker_does_not_renew_its_leases():
+    assert _beats_during(lambda: time.sleep(0.3)) == 0
+
+def test_request_waiting_for_its_response_renews_the_leases():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/slow"
+        assert _beats_during(lambda: http_client.get(url).content) >= 3
+    finally:
+        server.shutdown()
+        server.server_close()